@@ -0,0 +1,237 @@
+''' annotate: suggest wikidata properties for many column headers offline.
+
+    Queries are streamed from a CSV file (one column per /search parameter:
+    label, data_type, scope, filter, constraint, otherProperties, size,
+    extra_info) or a JSONL file (one /search/batch entry per line), and
+    answered by a pool of processes forked once the data is loaded, so they
+    share it copy-on-write. Input is read in windows of --window queries:
+    identical queries are answered once, queries with the same label share
+    one candidate retrieval, and the results of a window are written in
+    input order as JSON lines before the next one is read.
+
+    A query which is invalid, or whose retrieval fails, gets an error line
+    instead of candidates and the run goes on. --resume appends to the output
+    of an interrupted run, skipping the queries it already holds a line for.
+
+    With PROPERTY_FINDER_HOST=local (or --host local) no network access is needed.
+
+    python annotate.py headers.csv --output candidates.jsonl [--workers 8] [--host local] [--resume]
+'''
+import argparse, csv, gc, json, multiprocessing, os, sys
+from collections import OrderedDict
+from itertools import islice
+from time import time
+
+from tqdm import tqdm
+
+from api.cache import TTLCache
+from api.PropertyFinder2 import PropertyFinder
+from api.querylog import signature
+from api.settings import SEARCH_host
+
+PARAMETERS = ['label', 'data_type', 'type', 'scope', 'filter', 'constraint', 'otherProperties', 'size',
+              'extra_info']
+
+# The PropertyFinder of the parent process, inherited by the forked workers
+_finder = None
+
+
+class InvalidLine(object):
+    ''' A JSONL line which is not JSON
+    '''
+
+    def __init__(self, text, error):
+        self.text = text
+        self.error = error
+
+
+def read_queries(path, format):
+    ''' Generate the queries of a CSV or JSONL file ('-' for stdin), as dicts of
+        /search parameters; a JSONL line may also be a bare label string
+    '''
+    fd = sys.stdin if path == '-' else open(path, newline='')
+    try:
+        if format == 'csv':
+            for row in csv.DictReader(fd):
+                yield {key: value for key, value in row.items() if key in PARAMETERS and value not in ('', None)}
+        else:
+            for line in fd:
+                if not line.strip():
+                    continue
+                try:
+                    query = json.loads(line)
+                except ValueError as e:
+                    yield InvalidLine(line.rstrip('\n'), f'Invalid JSON: {e}')
+                    continue
+                yield {'label': query} if isinstance(query, str) else query
+    finally:
+        if fd is not sys.stdin:
+            fd.close()
+
+
+def windows(queries, size):
+    window = []
+    for query in queries:
+        window.append(query)
+        if len(window) == size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def answer(task):
+    ''' Candidates of the queries of task, a list of groups of (params, size)
+        sharing a label: candidate retrieval runs once per group.
+        A query which fails gets {'Error': ...} instead.
+    '''
+    finder = _finder
+    results = []
+    for group in task:
+        retrieved = {}
+        for params, size in group:
+            try:
+                key = finder._retrieval_key(params)
+                if key not in retrieved:
+                    retrieved[key] = finder._retrieve(*key)
+                results.append(finder.generate_top_candidates(dict(params), size, retrieved[key]))
+            except Exception as e:
+                results.append({'Error': repr(e)})
+    return results
+
+
+def plan(finder, window, done, task_size):
+    ''' Parse a window of queries, and pack the distinct ones which are not in
+        done into tasks of about task_size queries, grouped by label
+        Returns: (signature or error of each query, answers known already,
+                  List[task], the signatures of each task in order)
+    '''
+    keys = []
+    answers = {}
+    groups = OrderedDict()
+    for query in window:
+        if isinstance(query, InvalidLine):
+            keys.append({'Error': query.error})
+            continue
+        if not isinstance(query, dict):
+            keys.append({'Error': 'A query must be a JSON object or a label string'})
+            continue
+        params, size, error = finder._parse_args(query)
+        if error is not None:
+            keys.append(error[0])
+            continue
+        key = signature(params, size, finder.metadata)
+        keys.append(key)
+        if key in answers:
+            continue
+        answers[key] = done.get(key)
+        if answers[key] is None:
+            groups.setdefault(params['label'], []).append((params, size, key))
+
+    tasks, task_keys = [[]], [[]]
+    for group in groups.values():
+        for i in range(0, len(group), task_size):
+            if len(task_keys[-1]) >= task_size:
+                tasks.append([])
+                task_keys.append([])
+            part = group[i:i + task_size]
+            tasks[-1].append([(params, size) for params, size, _ in part])
+            task_keys[-1] += [key for _, _, key in part]
+    if not task_keys[-1]:
+        tasks.pop()
+        task_keys.pop()
+    return keys, answers, tasks, task_keys
+
+
+def written_lines(path):
+    ''' Number of complete lines of the output of an interrupted run; a last
+        line cut short is removed, its query is answered again
+    '''
+    with open(path, 'rb+') as fd:
+        data = fd.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            fd.truncate(end)
+    return data[:end].count(b'\n')
+
+
+def main():
+    global _finder
+
+    parser = argparse.ArgumentParser(description='Suggest wikidata properties for a file of column headers')
+    parser.add_argument('input', help="CSV or JSONL file of queries, '-' for stdin")
+    parser.add_argument('--output', default='-', help="JSONL file of the results, '-' for stdout")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='input format, from the extension by default')
+    parser.add_argument('--host', default=SEARCH_host, help="KGTK-search URL, 'local' to work offline, or a comma separated list of those")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--window', type=int, default=10000, help='queries read and answered at a time')
+    parser.add_argument('--task-size', type=int, default=64, help='most queries sent to a worker at once')
+    parser.add_argument('--cache', type=int, default=100000, help='answers kept to reuse across windows')
+    parser.add_argument('--resume', action='store_true',
+                        help='append to --output, skipping the queries it has a line for')
+    args = parser.parse_args()
+    format = args.format or ('csv' if args.input.endswith('.csv') else 'jsonl')
+
+    start = time()
+    _finder = PropertyFinder(host=args.host, result_cache='')
+    print(f'Loaded the data in {time() - start:.1f}s', file=sys.stderr)
+
+    pool = None
+    if args.workers > 1:
+        # Objects created so far are never collected: the workers' garbage
+        # collections then leave the shared pages of the data untouched
+        gc.freeze()
+        pool = multiprocessing.get_context('fork').Pool(args.workers)
+
+    skip = 0
+    if args.resume and args.output != '-' and os.path.exists(args.output):
+        skip = written_lines(args.output)
+        print(f'Resuming after {skip} queries', file=sys.stderr)
+
+    done = TTLCache(args.cache, float('inf'))
+    output = sys.stdout if args.output == '-' else open(args.output, 'a' if args.resume else 'w')
+    queries = answered = failed = 0
+    start = time()
+    try:
+        with tqdm(unit=' queries', file=sys.stderr) as progress:
+            for window in windows(islice(read_queries(args.input, format), skip, None), args.window):
+                keys, answers, tasks, task_keys = plan(_finder, window, done, args.task_size)
+
+                results = pool.imap(answer, tasks) if pool is not None else map(answer, tasks)
+                for signatures, result in zip(task_keys, results):
+                    for key, candidates in zip(signatures, result):
+                        answers[key] = candidates
+                        # Failures are not kept, a later occurrence is tried again
+                        if not isinstance(candidates, dict):
+                            done.set(key, candidates)
+                    answered += len(signatures)
+
+                for query, key in zip(window, keys):
+                    result = key if isinstance(key, dict) else answers[key]
+                    if isinstance(query, InvalidLine):
+                        query = query.text
+                    if isinstance(result, dict):
+                        line = {'query': query, 'error': result['Error']}
+                        failed += 1
+                    else:
+                        line = {'query': query, 'candidates': result}
+                    output.write(json.dumps(line) + '\n')
+                output.flush()
+
+                queries += len(window)
+                progress.update(len(window))
+                progress.set_postfix(distinct=answered)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if output is not sys.stdout:
+            output.close()
+
+    elapsed = time() - start
+    print(f'{queries} queries ({answered} distinct, {failed} errors) in {elapsed:.1f}s, '
+          f'{queries / max(elapsed, 1e-9):.0f} queries/s with {args.workers} workers', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,105 +1,249 @@
-import json, wordninja
-import pandas as pd
-from requests import get
+import json, os, wordninja
+import numpy as np
 from collections import defaultdict
 from math import isnan, nan
 
+from concurrent.futures import ThreadPoolExecutor
 from flask import request
+from threading import Lock
 from time import time
 
-from .metadata import PropertyMetaData
-from .ranking import PropertyRanker
-from .settings import FILE_claims_property, JSON_constraints, KGTK_search
+from .constraints import ConstraintTable, NOITEM, SCOPE_MAN, NOT_QUALIFIER, NOT_MAIN_VALUE
+from .generation import current_generation
+from .querylog import record
+from .metrics import timed, count, observe, requests_total, fallback_depth, candidates_per_level
+from .cache import get_result_cache
+from .backends import get_backend
+from .settings import FILE_claims_property, JSON_constraints, SEARCH_host, \
+    RESULT_cache, RESULT_cache_bytes, BATCH_workers, BATCH_max_size, RELATIONS, RELATION_depth, RELATION_decay, \
+    TEXT_search, TEXT_size
 
 import warnings
 
 warnings.filterwarnings("ignore")
 
+# Positions in RELATIONS of the relations expanded into level 2 (P1696, P1647, P6609)
+# and level 3 (P1659)
+RELATED_tags = [RELATIONS.index(r) for r in ('P1696', 'P1647', 'P6609')]
+SEE_ALSO_tags = [RELATIONS.index('P1659')]
+
+# Types accepted for each parameter of a query
+PARAMETER_types = {'label': (str,), 'data_type': (str, type(None)), 'type': (str, type(None)), 'scope': (str,),
+                   'filter': (str, bool), 'constraint': (str, type(None)), 'otherProperties': (str,),
+                   'size': (int, str), 'extra_info': (str, bool)}
+PARAMETER_names = {(str,): 'a string', (str, type(None)): 'a string', (str, bool): 'a string or a boolean',
+                   (int, str): 'an integer'}
+
 
 class PropertyFinder(object):
-    metadata = PropertyMetaData()
-    ranker = PropertyRanker()
+    # Metadata and ranker of the data loaded at startup; an instance uses
+    # those of the generation it was built with
+    metadata = current_generation().metadata
+    ranker = current_generation().ranker
+
+    _shared = None
+    _shared_lock = Lock()
+    _executor = ThreadPoolExecutor(max_workers=BATCH_workers, thread_name_prefix='batch')
 
-    def __init__(self, host=KGTK_search,
+    def __init__(self, host=SEARCH_host,
                  metadata_constraints=JSON_constraints,
-                 query_size=500, use_ninja=True, use_part=True):
+                 query_size=500, use_ninja=True, use_part=True, result_cache=RESULT_cache, generation=None,
+                 relation_depth=RELATION_depth, relation_decay=RELATION_decay, text_search=TEXT_search):
+        ''' generation: the DataGeneration to serve, the current one by default
+            relation_depth: hops followed from the level 1 properties to find those of levels 2 and 3
+            relation_decay: score factor of each hop beyond the first
+            text_search: add the best BM25 matches of the label over the property
+                         names and descriptions to the retrieved properties
+        '''
         self.host = host
-
-        self.map_P1696 = self.gen_relation('P1696')
-        self.map_P1647 = self.gen_relation('P1647', False)
-        self.map_P6609 = self.gen_relation('P6609', False)
-        self.map_P1659 = self.gen_relation('P1659')
-
-        with open(metadata_constraints) as fp:
-            self.constraints = json.load(fp)
+        self.generation = generation if generation is not None else current_generation()
+        self.metadata = self.generation.metadata
+        self.ranker = self.generation.ranker
+        self.backend = get_backend(host, self.generation)
+
+        # The constraints dict of the default file is only rebuilt if the
+        # unfused filters ask for it
+        self._constraints = None
+        if metadata_constraints == JSON_constraints:
+            self.constraint_table = self.generation.constraint_table
+        else:
+            with open(metadata_constraints) as fp:
+                self._constraints = json.load(fp)
+            self.constraint_table = ConstraintTable(self._constraints)
+        self.settings = {'host': host, 'metadata_constraints': metadata_constraints, 'query_size': query_size,
+                         'use_ninja': use_ninja, 'use_part': use_part, 'result_cache': result_cache,
+                         'relation_depth': relation_depth, 'relation_decay': relation_decay,
+                         'text_search': text_search}
 
         self.query_size = query_size
         self.ninja = use_ninja
         self.partial_query = use_part
+        self.relation_depth = relation_depth
+        self.relation_decay = relation_decay
+        self.text_search = text_search
+
+        if self.text_search:
+            self.generation.text_index()
+
+        self.result_cache = get_result_cache(result_cache, RESULT_cache_bytes)
+        if self.result_cache is not None:
+            self.result_cache.purge(self.generation.fingerprint)
+
+    @classmethod
+    def shared(cls):
+        ''' Return the process-wide PropertyFinder, building it on first use.
+            flask_restful creates a new resource per request, so the resource
+            should use this instead of constructing its own finder.
+        '''
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    @property
+    def constraints(self):
+        if self._constraints is None:
+            return self.generation.constraints
+        return self._constraints
+
+    # Maps X -> [Y] of the relations, built on first use; candidate expansion
+    # uses the generation's RelationIndex instead
+    map_P1696 = property(lambda self: self.generation.relations['P1696'])
+    map_P1647 = property(lambda self: self.generation.relations['P1647'])
+    map_P6609 = property(lambda self: self.generation.relations['P6609'])
+    map_P1659 = property(lambda self: self.generation.relations['P1659'])
+
+    @classmethod
+    def swap(cls, generation):
+        ''' Make a finder over generation the shared one, with the settings of the
+            current shared finder. Requests holding the previous finder finish with it.
+        '''
+        finder = cls(generation=generation, **cls.shared().settings)
+        with cls._shared_lock:
+            cls._shared = finder
+        return finder
+
+    def _search(self, term, extra_info=True, type_=None):
+        ''' Run one ngram query against the retrieval backend of host (see api/backends.py)
+            type_: only return properties of this datatype, if the backend can filter on it
+        '''
+        return self.backend.search(term, self.query_size, extra_info, type_)
 
-    def _query(self, label, type_=None):
+    def _search_many(self, terms, type_=None):
+        ''' Run independent ngram queries, concurrently for the remote backends
+        '''
+        return self.backend.search_many(terms, self.query_size, type_=type_)
+
+    def _retrieval_type(self, type_):
+        ''' The datatype _retrieve can restrict the matches to: the local index
+            filters on it, the KGTK-search API has no datatype parameter
+        '''
+        return type_ if self.backend.filters_types else None
+
+    def _retrieval_key(self, params):
+        ''' The arguments of _retrieve for the query params
+        '''
+        type_ = params['type']
+        return params['label'], self._retrieval_type(self.metadata.get_type_alias(type_) if type_ else None)
+
+    def _query(self, label, type_=None, retrieved=None):
         ''' Given a query string: label,
             get relevant properties from the KGTK-search API
+            retrieved: the result of _retrieve(label), when it is already known
         '''
-        response2 = get(
-            f'{self.host}/{label}?extra_info=true&language=en&item=property&type=ngram'
-            f'&size={self.query_size}&instance_of=',
-            verify=False)
-        query_result = set([x['qnode'] for x in response2.json()])
-
-        try:
-            # Split word using wordninja
-            if len(query_result) == 0 and self.ninja:
-                label_splitted = ' '.join([x[:10] for x in wordninja.split(label)])
-                response2 = get(
-                    f'{self.host}/{label_splitted}?language=en&item=property'
-                    f'&type=ngram&size={self.query_size}&instance_of=',
-                    verify=False)
-                for x in response2.json():
-                    query_result.add(x['qnode'])
-
-                # Use a part of the input as the query string
-                if len(query_result) == 0 and self.partial_query:
-
-                    label_splitted = [x[:10] for x in wordninja.split(label)]
-
-                    response2a = get(
-                        f'{self.host}/{label_splitted[0]}?extra_info=true&language=en&item=property'
-                        f'&type=ngram&size={self.query_size}&instance_of=',
-                        verify=False)
-                    for x in response2a.json():
-                        query_result.add(x['qnode'])
-
-                    response2b = get(
-                        f'{self.host}/{label_splitted[-1]}?extra_info=true&language=en&item=property'
-                        f'&type=ngram&size={self.query_size}&instance_of=',
-                        verify=False)
-                    for x in response2b.json():
-                        query_result.add(x['qnode'])
-
-                    if len(label_splitted) > 2:
-
-                        response2c = get(
-                            f'{self.host}/{label_splitted[0] + label_splitted[1]}?extra_info=true'
-                            f'&language=en&item=property&type=ngram&size={self.query_size}&instance_of=',
-                            verify=False)
-                        for x in response2c.json():
-                            query_result.add(x['qnode'])
-
-                        response2d = get(
-                            f'{self.host}/{label_splitted[-2] + label_splitted[-1]}?extra_info=true'
-                            f'&language=en&item=property&type=ngram&size={self.query_size}&instance_of=',
-                            verify=False)
-                        for x in response2d.json():
-                            query_result.add(x['qnode'])
-        except:
-            return []
+        if retrieved is None:
+            retrieved = self._retrieve(label, self._retrieval_type(type_))
 
         if type_:
-            return [x for x in query_result if
-                    PropertyFinder.metadata.check_property_exists(x) and PropertyFinder.metadata.check_type(x, type_)]
+            typed = self.metadata.typed(type_)
+            return [x for x in retrieved if x in typed]
 
-        return [x for x in query_result]
+        return list(retrieved)
+
+    def _retrieve(self, label, type_=None, text_matches=None):
+        ''' All the properties matching label, using the wordninja split
+            and partial queries as fallbacks
+            type_: restrict the matches to this datatype (see _retrieval_type)
+            text_matches: the result of _text_search for label, when it is already known
+        '''
+        with timed('retrieve'):
+            depth = 'main'
+            query_result, matched = self._search_typed(label, type_)
+
+            try:
+                # Split word using wordninja
+                if not matched and self.ninja:
+                    depth = 'ninja'
+                    result, matched = self._search_typed(self._ninja_term(label), type_, extra_info=False)
+                    query_result.update(result)
+
+                    # Use a part of the input as the query string
+                    if not matched and self.partial_query:
+                        depth = 'partial'
+                        for result in self._search_many(self._partial_terms(label), type_):
+                            query_result.update(result)
+            except:
+                return []
+            finally:
+                count(fallback_depth, depth)
+
+            if self.text_search:
+                if text_matches is None:
+                    text_matches = self._text_search([label], [type_])[0]
+                query_result.update(text_matches)
+
+            return [x for x in query_result]
+
+    def _retrieve_many(self, keys):
+        ''' _retrieve for each distinct (label, type) of keys, in parallel,
+            with the text matches of all the labels scored at once
+            Returns: Dict[key, the result of _retrieve, or the exception it raised]
+        '''
+        retrievals = list(dict.fromkeys(keys))
+        text_matches = dict.fromkeys(retrievals)
+        if self.text_search and retrievals:
+            text_matches.update(zip(retrievals, self._text_search(*map(list, zip(*retrievals)))))
+
+        def retrieve(key):
+            # A failed query only fails the queries of its label
+            try:
+                return self._retrieve(*key, text_matches[key])
+            except Exception as e:
+                return e
+
+        return dict(zip(retrievals, PropertyFinder._executor.map(retrieve, retrievals)))
+
+    def _text_search(self, labels, types):
+        ''' The TEXT_size best BM25 matches of each label restricted to its type,
+            all the labels scored at once
+        '''
+        with timed('text_search'):
+            masks = [self.metadata.type_mask(type_) if type_ else None for type_ in types]
+            return self.generation.text_index().search_many(labels, TEXT_size, masks)
+
+    def _search_typed(self, term, type_, extra_info=True):
+        ''' The matches of term restricted to type_, and whether term matches any property.
+            The fallback queries only run for terms matching nothing at all, not
+            for those matching no property of type_.
+        '''
+        result = set(self._search(term, extra_info, type_))
+        return result, len(result) > 0 or (bool(type_) and len(self._search(term, extra_info)) > 0)
+
+    def _ninja_term(self, label):
+        ''' label split into words by wordninja, the first fallback query
+        '''
+        return ' '.join([x[:10] for x in wordninja.split(label)])
+
+    def _partial_terms(self, label):
+        ''' Parts of label queried when neither it nor its split match anything
+        '''
+        label_splitted = [x[:10] for x in wordninja.split(label)]
+
+        terms = [label_splitted[0], label_splitted[-1]]
+        if len(label_splitted) > 2:
+            terms += [label_splitted[0] + label_splitted[1], label_splitted[-2] + label_splitted[-1]]
+        return terms
 
     def filter_by_set(self, s, l):
         ''' Return all the unique values in l,
@@ -115,72 +259,143 @@ class PropertyFinder(object):
         ''' Given a relation R, generate the triples such that
             X R Y, containing all X, Y that satisfying this relation
         '''
-        pr = pd.read_csv(FILE_claims_property, sep='\t', usecols=['node1', 'label', 'node2'])
-        pr = pr[pr['label'].apply(lambda x: x == label)].reset_index(drop=True)
-        pr = pr[['node1', 'node2']]
+        return self.gen_relations([label])[label]
 
-        pr1 = pr.groupby('node1')['node2'].apply(list).reset_index()
-        pr_dict = pr1.set_index('node1').to_dict()['node2']
+    def gen_relations(self, labels):
+        ''' Build the maps X -> [Y] for every relation R in labels (X R Y)
+            with a single read of the claims file
+            Returns: Dict[defaultdict(list)], keyed by relation
+        '''
+        import pandas as pd
+        pr = pd.read_csv(FILE_claims_property, sep='\t', usecols=['node1', 'label', 'node2'])
+        pr = pr[pr['label'].isin(labels)]
 
-        pr_dict_r = defaultdict(list)
-        for k, v in pr_dict.items():
-            for vi in v:
-                pr_dict_r[k].append(vi)
+        relations = {label: defaultdict(list) for label in labels}
+        for (label, node1), node2 in pr.groupby(['label', 'node1'])['node2']:
+            relations[label][node1] = node2.tolist()
 
-        return pr_dict_r
+        return relations
 
-    def get_candidates(self, name_, type_):
+    def get_candidates(self, name_, type_, retrieved=None):
         ''' Get all the candidates given a query string: name_, and the specified type_
             Returns: Dict[List]
             1 -> properties whose label/aliases matches with query string
             2 -> relevant properties to category (1), using P1696, P1647, P6609
             3 -> relevant properties to category (1), using P1659
         '''
-        result = self._query(name_, type_)
-
-        ranked = {}
-        loaded = set()
-        loaded, ranked[1] = self.filter_by_set(loaded, result)
-
-        ranked[2] = []
-        for z in result:
-            ranked[2] += self.map_P1696[z] + self.map_P1647[z] + self.map_P6609[z]
-        loaded, ranked[2] = self.filter_by_set(loaded, ranked[2])
-
-        ranked[3] = []
-        for z in result:
-            ranked[3] += self.map_P1659[z]
-        loaded, ranked[3] = self.filter_by_set(loaded, ranked[3])
+        ranked = dict(self.iter_candidates(name_, type_, retrieved))
 
         if type_ is None:
             return ranked
 
-        r = {}
-        r[0] = []
-        for i, L in enumerate(ranked):
-            r[i + 1] = []
-            for pnode in ranked[L]:
-                if PropertyFinder.metadata.check_type(pnode, type_):
-                    r[i + 1].append(pnode)
-
+        r = {0: []}
+        r.update(ranked)
         r[4] = []
 
         return r
 
+    def iter_candidates(self, name_, type_, retrieved=None, hops=None):
+        ''' Generate the levels of get_candidates one at a time, as (level, List),
+            so that the expansions of a level are only computed when it is needed
+            hops: if given, filled with the hop distance of the candidates reached
+            through more than one relation (relation_depth > 1)
+        '''
+        result = self._query(name_, type_, retrieved)
+
+        with timed('candidates'):
+            loaded = set()
+            # result only holds properties of type_ already
+            loaded, level = self.filter_by_set(loaded, result)
+        observe(candidates_per_level, len(level), '1')
+        yield 1, level
+
+        # Expand all the level 1 properties at once along the relations of
+        # each level, never reaching a property twice
+        index = self.generation.relation_index
+        with timed('candidates'):
+            ids = index.ids(result)
+            seen = np.zeros(len(self.generation.store), dtype=bool)
+            seen[ids[ids >= 0]] = True
+            level = self._hop_level(index.expand(ids, RELATED_tags, seen, self.relation_depth), type_, hops)
+        observe(candidates_per_level, len(level), '2')
+        yield 2, level
+
+        with timed('candidates'):
+            level = self._hop_level(index.expand(ids, SEE_ALSO_tags, seen, self.relation_depth), type_, hops)
+        observe(candidates_per_level, len(level), '3')
+        yield 3, level
+
+    def _hop_level(self, reached, type_, hops=None):
+        ''' Candidates of a level from the ids reached at each hop, nearest first
+            hops: if given, filled with the hop of the candidates beyond the first one
+        '''
+        pnodes = self.generation.store.pnodes
+        level = []
+        for hop, ids in enumerate(reached, 1):
+            found = list(set(map(pnodes.__getitem__, ids.tolist())))
+            if hops is not None and hop > 1:
+                hops.update(dict.fromkeys(found, hop))
+            level += found
+        return self._filter_type(level, type_)
+
+    def _filter_type(self, pnodes, type_):
+        if type_ is None:
+            return pnodes
+        typed = self.metadata.typed(type_)
+        return [pnode for pnode in pnodes if pnode in typed]
+
     def filter_ranked(self, ranked, params):
         ''' Rule-based filtering
-            Using several wikidata constraints
+            Using several wikidata constraints, in a single pass equivalent to
+            filter_by_item, filter_by_scope (unless scope is 'both'),
+            filter_by_allowed_qualifiers, filter_by_required_qualifiers
+            and filter_by_conflicts applied in sequence
         '''
-        ranked = self.filter_by_item(ranked)
+        with timed('filter'):
+            return self._filter_ranked(ranked, params)
 
-        if params['scope'] != 'both':
-            ranked = self.filter_by_scope(ranked, params['scope'])
+    def _filter_ranked(self, ranked, params):
+        table = self.constraint_table
+        scope_flag = NOT_QUALIFIER if params['scope'] == 'qualifier' else NOT_MAIN_VALUE
+        check_scope = params['scope'] != 'both'
+        allowed = table.allowed.get(params['constraint'])
+        required = table.required.get(params['constraint'])
+        disallowed = table.disallowed(params['otherProperties'])
 
-        ranked = self.filter_by_allowed_qualifiers(ranked, params['constraint'])
-        ranked = self.filter_by_required_qualifiers(ranked, params['constraint'])
+        r = defaultdict(list)
+        # Properties ending at level 0, grouped by their level after the scope
+        # filter: the sequential passes collect them in the order those levels
+        # were first filled
+        zero = {}
+        flags = table.flags
+        for k, pnodes in ranked.items():
+            for pnode in pnodes:
+                f = flags.get(pnode, 0)
+                if f & NOITEM:
+                    continue
 
-        ranked = self.filter_by_conflicts(ranked, params['otherProperties'])
-        return ranked
+                level = k
+                if check_scope and f & scope_flag:
+                    if f & SCOPE_MAN:
+                        continue
+                    level = 4
+                if not level in zero:
+                    zero[level] = []
+
+                if allowed is not None and not pnode in allowed:
+                    continue
+                if pnode in disallowed:
+                    continue
+
+                if level == 0 or (required is not None and pnode in required):
+                    zero[level].append(pnode)
+                else:
+                    r[level].append(pnode)
+
+        level_zero = [pnode for pnodes in zero.values() for pnode in pnodes]
+        if level_zero:
+            r[0] = level_zero
+        return r
 
     def filter_by_item(self, ranked):
 
@@ -285,30 +500,70 @@ class PropertyFinder(object):
 
         return r
 
-    def find_property(self, label, params):
-
-        params['type'] = PropertyFinder.metadata.get_type_alias(params['type'])
+    def find_property(self, label, params, size=None, retrieved=None):
 
-        candidates = self.get_candidates(label, params['type'])
-
-        if params['filter']:
-            candidates = self.filter_ranked(candidates, params)
-
-        for level in candidates:
-            candidates[level] = PropertyFinder.ranker.rank(candidates[level], label, PropertyFinder.metadata,
-                                                           scope=params['scope'])
+        candidates = dict(self.iter_ranked(label, params, size, retrieved))
 
         return dict(sorted(candidates.items(), key=lambda x: x[0]))
 
-    def generate_top_candidates(self, params, size=10):
+    def iter_ranked(self, label, params, size=None, retrieved=None):
+        ''' Generate the ranked levels of find_property in order, as (level, Dict[pnode, score]).
+            A level, and the candidate expansion it needs, is only computed when the
+            previous ones have been consumed. With size, each level is only ranked
+            as far as its first size candidates.
+        '''
+        params['type'] = self.metadata.get_type_alias(params['type'])
+
+        hops = {}
+        levels = self.iter_candidates(label, params['type'], retrieved, hops)
+
+        def rank(pnodes):
+            # Candidates h hops away have their score multiplied by decay ** (h - 1)
+            weights = None
+            if hops:
+                weights = {pnode: self.relation_decay ** (hops[pnode] - 1) for pnode in pnodes if pnode in hops}
+            return self.ranker.rank(pnodes, label, self.metadata,
+                                    scope=params['scope'], size=size, weights=weights)
+
+        if not params['filter']:
+            for level, pnodes in levels:
+                yield level, rank(pnodes)
+            return
+
+        if params['constraint'] in self.constraint_table.required:
+            # Required qualifiers are moved to level 0 from every level
+            candidates = self.filter_ranked(dict(levels), params)
+            for level in sorted(candidates):
+                yield level, rank(candidates[level])
+            return
+
+        # Otherwise levels 1-3 only lose candidates, or move them to level 4
+        demoted = []
+        for level, pnodes in levels:
+            candidates = self.filter_ranked({level: pnodes}, params)
+            yield level, rank(candidates[level])
+            demoted += candidates[4]
+        yield 4, rank(demoted)
+
+    def generate_top_candidates(self, params, size=10, retrieved=None):
         ''' argument params may include the following parameters:
             type
             scope
             filter
             constraint
             otherProperties
+            retrieved: the result of _retrieve(label), when it is already known
+        '''
+        label = self._complete_params(params)
+        ranked = self._cached_ranking(label, params, size)
+        if ranked is None:
+            ranked = self._rank_and_cache(label, params, size, retrieved)
+        return self._candidates_info(ranked, params, size)
+
+    def _complete_params(self, params):
+        ''' Fill in the defaults of params, and pop its label
+            Returns: the label
         '''
-
         if not 'type' in params:
             params['type'] = None
         if not 'scope' in params:
@@ -320,22 +575,60 @@ class PropertyFinder(object):
         if not 'otherProperties' in params:
             params['otherProperties'] = ''
 
-        label = params.pop('label')
-
-        candidates = self.find_property(label, params)
+        return params.pop('label')
 
-        results = []
-        for level in candidates:
-            for pnode, score in candidates[level].items():
+    def _cached_ranking(self, label, params, size):
+        ''' The first size ranked candidates of the completed params from the
+            result cache, None when it does not hold them
+        '''
+        if self.result_cache is None:
+            return None
+        cached = self.result_cache.get(self._result_key(label, params))
+        if cached is not None and (cached[1] or len(cached[0]) >= size):
+            return cached[0]
+        return None
+
+    def _rank_and_cache(self, label, params, size, retrieved=None):
+        ''' Rank at least size candidates of the completed params, into the result cache
+        '''
+        ranked, complete = self._rank_prefix(label, params, size, retrieved)
+        if self.result_cache is not None:
+            self.result_cache.set(self._result_key(label, params), ranked, complete)
+        return ranked
 
-                results.append(PropertyFinder.metadata.get_info(pnode, score, params['extra_info']))
-                if len(results) >= size:
-                    break
+    def _candidates_info(self, ranked, params, size):
+        ''' The first size ranked candidates in the format of /search
+        '''
+        with timed('get_info'):
+            return [self.metadata.get_info(pnode, score, params['extra_info'])
+                    for pnode, score in ranked[:size]]
 
-            if len(results) >= size:
-                break
+    def rank_candidates(self, label, params, size=None, retrieved=None):
+        ''' The candidates of find_property, in order, as a list of (pnode, score).
+            With size, at least the first size candidates are returned.
+        '''
+        return self._rank_prefix(label, params, size, retrieved)[0]
 
-        return results
+    def _rank_prefix(self, label, params, size=None, retrieved=None):
+        ''' Consume iter_ranked until size candidates are ranked
+            Returns: (List[(pnode, score)], whether it holds all the candidates)
+            The list is always a prefix of the full ranking.
+        '''
+        ranked = []
+        for level, candidates in self.iter_ranked(label, params, size, retrieved):
+            ranked += [(pnode, float(score)) for pnode, score in candidates.items()]
+            if size is not None and len(ranked) >= size:
+                return ranked, False
+        return ranked, True
+
+    def _result_key(self, label, params):
+        ''' Key of the result cache: everything the ranked candidates depend on
+        '''
+        other = sorted(set(p for p in params['otherProperties'].split(',') if p))
+        return (self.generation.fingerprint, self.settings['metadata_constraints'], self.host, self.query_size,
+                self.ninja, self.partial_query, self.relation_depth, self.relation_decay, self.text_search, label,
+                self.metadata.get_type_alias(params['type']),
+                params['scope'], params['filter'], params['constraint'], ','.join(other))
 
     def _build_params(self, label, type_, scope='both', filter='true', constraint=None,
                       otherProperties='', extra_info=False):
@@ -349,39 +642,132 @@ class PropertyFinder(object):
                 'otherProperties': otherProperties,
                 'extra_info': extra_info.lower() == 'true'}
 
-    def search(self):
-        ''' Flask API interface
+    def _parse_args(self, args):
+        ''' Validate and build the parameters of one query from a mapping
+            (the request arguments, or one entry of a batch)
+            Returns: (params, size, None), or (None, None, (error, status code))
         '''
-        label = request.args.get('label', '')
+        label = args.get('label', '')
         if label == '':
-            return {'Error': 'label (query string) needed. Please enter the following parameter ?label=xxx'}, 400
+            return None, None, ({'Error': 'label (query string) needed. '
+                                          'Please enter the following parameter ?label=xxx'}, 400)
 
-        type_ = request.args.get('data_type', None)
-        if type_ is None:
-            type_ = request.args.get('type', None)
+        # JSON entries of a batch may hold any type: null stands for a missing
+        # value only where the default is None
+        for name, types in PARAMETER_types.items():
+            value = args.get(name, '')
+            if not isinstance(value, types) or isinstance(value, bool) and bool not in types:
+                return None, None, ({'Error': f'{name} parameter must be {PARAMETER_names[types]}'}, 400)
 
-        if not type_ is None and not PropertyFinder.metadata.check_type_allowed(type_):
-            return {'Error': 'Input data_type is not supported'}, 400
+        type_ = args.get('data_type', None)
+        if type_ is None:
+            type_ = args.get('type', None)
 
-        # Check remote is running
-        response = get(f'{self.host}/time?extra_info=true&language=en&item=property&type=ngram&size=1&instance_of=',
-                       verify=False)
-        if response.status_code >= 500:
-            return {'Error': 'Remote service for querying properties is down.'}, 500
+        if not type_ is None and not self.metadata.check_type_allowed(type_):
+            return None, None, ({'Error': 'Input data_type is not supported'}, 400)
 
-        scope = request.args.get('scope', 'both')
-        filter = request.args.get('filter', 'true')
-        constraint = request.args.get('constraint', None)
-        otherProperties = request.args.get('otherProperties', '')
-        size = request.args.get('size', 10)
-        extra_info = request.args.get('extra_info', 'false')
+        scope = args.get('scope', 'both')
+        filter = str(args.get('filter', 'true'))
+        constraint = args.get('constraint', None)
+        otherProperties = args.get('otherProperties', '')
+        size = args.get('size', 10)
+        extra_info = str(args.get('extra_info', 'false'))
 
         try:
             size = int(size)
         except:
-            return {'Error': 'size parameter must be an integer'}, 400
+            return None, None, ({'Error': 'size parameter must be an integer'}, 400)
+        # A negative size would slice off the end of a cached ranking
+        if size < 1:
+            return None, None, ({'Error': 'size parameter must be a positive integer'}, 400)
 
         params = self._build_params(label, type_, scope, filter, constraint,
                                     otherProperties, extra_info)
+        return params, size, None
+
+    def search(self):
+        ''' Flask API interface
+        '''
+        count(requests_total, 'search')
+        params, size, error = self._parse_args(request.args)
+        if error is not None:
+            return error
+        record(self, params, size)
+
+        # Check remote is running
+        if not self.backend.is_up():
+            return {'Error': 'Remote service for querying properties is down.'}, 500
+
+        with timed('total'):
+            return self.generate_top_candidates(params, size)
+
+    def search_many(self, queries, log_queries=False):
+        ''' Answer a batch of queries, each a dict with the parameters of search
+            (label, data_type, scope, filter, constraint, otherProperties, size, extra_info)
+            Candidate retrieval runs once per distinct label, identical queries are
+            answered once, and independent queries run in parallel.
+            log_queries: record the valid queries in the query log
+            Returns: List, the candidates or {'Error': ...} of each query in input order,
+                     a query which fails getting {'Error': ...} as well
+        '''
+        parsed = [self._parse_args(query) for query in queries]
+        if log_queries:
+            for params, size, error in parsed:
+                if error is None:
+                    record(self, params, size)
+
+        # One retrieval per label, or per label and type when the backend filters on types
+        retrieved = self._retrieve_many(self._retrieval_key(params) for params, _, error in parsed
+                                        if error is None)
+
+        futures = {}
+        keys = []
+        for params, size, error in parsed:
+            if error is not None:
+                keys.append(None)
+                continue
+            key = tuple(sorted(params.items())) + (size,)
+            if not key in futures:
+                matches = retrieved[self._retrieval_key(params)]
+                futures[key] = matches if isinstance(matches, Exception) else PropertyFinder._executor.submit(
+                    self.generate_top_candidates, dict(params), size, matches)
+            keys.append(key)
+
+        def answer(future):
+            try:
+                if isinstance(future, Exception):
+                    raise future
+                return future.result()
+            except Exception as e:
+                return {'Error': repr(e)}
+
+        return [answer(futures[key]) if key is not None else error[0]
+                for key, (_, _, error) in zip(keys, parsed)]
+
+    def search_batch(self):
+        ''' Flask API interface of search_many:
+            the JSON body is a list of queries, or {"queries": [...]}
+        '''
+        count(requests_total, 'batch')
+        body = request.get_json(silent=True)
+        if isinstance(body, dict):
+            body = body.get('queries')
+        if not isinstance(body, list) or not all(isinstance(query, dict) for query in body):
+            return {'Error': 'The request body must be a JSON list of queries'}, 400
+        if len(body) > BATCH_max_size:
+            return {'Error': f'At most {BATCH_max_size} queries are allowed per batch'}, 400
+
+        # Check remote is running
+        if not self.backend.is_up():
+            return {'Error': 'Remote service for querying properties is down.'}, 500
+
+        return self.search_many(body, log_queries=True)
+
+
+def _after_fork():
+    # The batch threads of the parent, and a lock they may have held, do not survive a fork
+    PropertyFinder._executor = ThreadPoolExecutor(max_workers=BATCH_workers, thread_name_prefix='batch')
+    PropertyFinder._shared_lock = Lock()
+
 
-        return self.generate_top_candidates(params, size)
+os.register_at_fork(after_in_child=_after_fork)
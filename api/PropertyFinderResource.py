@@ -5,7 +5,16 @@ from .PropertyFinder2 import PropertyFinder
 class PropertyFinderResource(Resource):
 
     def __init__(self):
-        self.finder = PropertyFinder()
+        self.finder = PropertyFinder.shared()
 
     def get(self):
         return self.finder.search()
+
+
+class PropertyFinderBatchResource(Resource):
+
+    def __init__(self):
+        self.finder = PropertyFinder.shared()
+
+    def post(self):
+        return self.finder.search_batch()
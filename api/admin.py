@@ -0,0 +1,202 @@
+import os
+from threading import Event, Lock, Thread
+from time import time
+
+from flask import Blueprint, request
+
+from .generation import build_generation, current_generation, set_current_generation
+from .memory import footprint
+from .metrics import registry
+from .PropertyFinder2 import PropertyFinder
+from .settings import ADMIN_open, ADMIN_token, FILE_snapshot, RELOAD_watch_interval
+from .snapshot import SOURCE_FILES, fingerprint
+
+
+class Reloader(object):
+    ''' Loads a new data generation in a background thread, then makes it the
+        one served by the shared PropertyFinder. Requests keep being answered
+        by the previous generation until the swap, and those in flight at the
+        swap finish with it.
+    '''
+
+    def __init__(self):
+        self.reloads = 0
+        self.skipped = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_duration = None
+        self._after_fork()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # A reload running in the parent does not continue in a forked process
+        self._thread = None
+        self._lock = Lock()
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def reload(self, force=False):
+        ''' Start a reload, unless one is running already
+            force: build a new generation even if data/ did not change
+            Returns: whether a reload was started
+        '''
+        with self._lock:
+            if self.running():
+                return False
+            self._thread = Thread(target=self._run, args=(force,), name='data-reload', daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self, force):
+        start = time()
+        try:
+            if not force and fingerprint() == current_generation().fingerprint:
+                self.skipped += 1
+                return
+            generation = build_generation()
+            PropertyFinder.swap(generation)
+            set_current_generation(generation)
+            self.reloads += 1
+            self.last_error = None
+            print(f'Loaded data generation {generation.version} ({generation.fingerprint[:12]}) '
+                  f'in {time() - start:.1f}s')
+        except Exception as e:
+            self.failures += 1
+            self.last_error = repr(e)
+            print(f'Reloading data/ failed, still serving generation {current_generation().version}: {e!r}')
+        finally:
+            self.last_duration = time() - start
+
+    def stats(self):
+        return {'running': self.running(), 'reloads': self.reloads, 'skipped': self.skipped,
+                'failures': self.failures, 'last_error': self.last_error, 'last_duration': self.last_duration}
+
+
+class DataWatcher(object):
+    ''' Polls the size and modification time of the files under data/ every
+        interval seconds, and reloads once a change has settled (no further
+        change during one interval), so a file being copied is not read half-written
+    '''
+
+    def __init__(self, reloader, interval=RELOAD_watch_interval, files=SOURCE_FILES + [FILE_snapshot]):
+        self.reloader = reloader
+        self.interval = interval
+        self.files = files
+        self._stop = Event()
+
+    def _stamp(self):
+        stamps = []
+        for name in self.files:
+            try:
+                stat = os.stat(name)
+                stamps.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                stamps.append(None)
+        return stamps
+
+    def _run(self):
+        last = self._stamp()
+        pending = False
+        while not self._stop.wait(self.interval):
+            stamp = self._stamp()
+            if stamp != last:
+                last = stamp
+                pending = True
+            elif pending and self.reloader.reload():
+                pending = False
+
+    def start(self):
+        Thread(target=self._run, name='data-watch', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+reloader = Reloader()
+_watcher = None
+_watcher_pid = None
+
+
+def watch_data(interval=RELOAD_watch_interval):
+    ''' Reload when the files under data/ change; interval <= 0 disables it.
+        The watcher thread belongs to the calling process: a forked worker
+        starts its own when it calls this.
+    '''
+    global _watcher, _watcher_pid
+    if interval > 0 and (_watcher is None or _watcher_pid != os.getpid()):
+        _watcher = DataWatcher(reloader, interval).start()
+        _watcher_pid = os.getpid()
+    return _watcher
+
+
+@registry.collector
+def _generation_metrics():
+    yield ('propertyfinder_data_generation', 'gauge', 'Version of the data generation being served',
+           [({}, current_generation().version)])
+    yield ('propertyfinder_data_reloads_total', 'counter', 'Data reloads by outcome',
+           [({'result': 'loaded'}, reloader.reloads), ({'result': 'unchanged'}, reloader.skipped),
+            ({'result': 'failed'}, reloader.failures)])
+
+
+bp = Blueprint('admin', __name__)
+
+
+def refused(authorization):
+    ''' The error answering an /admin request with this Authorization header
+        when it is not allowed, None if it is.
+        Without ADMIN_token the endpoints are closed, unless ADMIN_open.
+    '''
+    if ADMIN_token:
+        if authorization != f'Bearer {ADMIN_token}':
+            return {'Error': 'Not authorized'}, 403
+        return None
+    if not ADMIN_open:
+        return {'Error': 'The admin endpoints are disabled: set PROPERTY_FINDER_ADMIN_TOKEN'}, 403
+    return None
+
+
+def start_reload(force=False):
+    ''' Start loading data/ into a new generation, force to reload unchanged data
+    '''
+    if not reloader.reload(force):
+        return {'Error': 'A reload is already running', 'generation': current_generation().info()}, 409
+    return {'reloading': True, 'generation': current_generation().info()}, 202
+
+
+def generation_info():
+    ''' The data generation being served, and the outcome of the last reloads
+    '''
+    return {'generation': current_generation().info(), 'reload': reloader.stats()}, 200
+
+
+@bp.route('/admin/reload', methods=['POST'])
+def reload():
+    ''' Start loading data/ into a new generation, ?force=true to reload unchanged data
+    '''
+    error = refused(request.headers.get('Authorization'))
+    if error is not None:
+        return error
+    return start_reload(request.args.get('force', 'false').lower() == 'true')
+
+
+@bp.route('/admin/generation')
+def generation():
+    ''' The data generation being served, and the outcome of the last reloads
+    '''
+    error = refused(request.headers.get('Authorization'))
+    if error is not None:
+        return error
+    return generation_info()
+
+
+@bp.route('/admin/memory')
+def memory():
+    ''' Resident memory of this worker, and the bytes held by each structure
+        of the data generation being served
+    '''
+    error = refused(request.headers.get('Authorization'))
+    if error is not None:
+        return error
+    return footprint()
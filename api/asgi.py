@@ -0,0 +1,368 @@
+''' Async serving mode: an ASGI application with the /search, /search/batch
+    and /admin contract of the Flask app, which also loads the changes to
+    data/ as it does.
+
+    Candidate retrieval from KGTK-search, including the remote members of a
+    list of backends, runs on the event loop with aiohttp, so a single process
+    keeps many lookups waiting on the network at once; candidate expansion,
+    filtering and ranking run in a thread pool so they do not stall the loop,
+    as do the queries of the local index. Requires aiohttp and an ASGI
+    server, e.g.
+
+    pip install aiohttp uvicorn
+    uvicorn api.asgi:app --port 12576
+'''
+import asyncio, json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+import aiohttp
+
+from .metrics import registry, count, timed, requests_total, remote_calls, fallback_depth
+from .admin import generation_info, refused, start_reload, watch_data
+from .backends import Composite, LocalIndex, RemoteHTTP, backend_requests, hedged_requests
+from .PropertyFinder2 import PropertyFinder
+from .memory import footprint
+from .querylog import record, warmup
+from .remote import get_client, normalize
+from .settings import REMOTE_timeout, ASYNC_connections, ASYNC_workers, BATCH_max_size
+
+
+class AsyncRemoteSearch(object):
+    ''' aiohttp client of the KGTK-search API. Shares the response cache and
+        circuit breaker of the threaded client of the same host.
+    '''
+
+    def __init__(self, host, connections=ASYNC_connections, timeout=REMOTE_timeout):
+        self.host = host
+        self.client = get_client(host)
+        self.connections = connections
+        self.timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+        self.session = None
+
+    async def start(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.connections, ssl=False),
+                                                 timeout=self.timeout)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def search(self, term, size, extra_info=True):
+        ''' qnodes of the properties matching term
+        '''
+        key = (normalize(term), size, extra_info)
+        result = self.client.cache.get(key)
+        if result is not None:
+            return result
+
+        await self.start()
+        count(remote_calls, 'search')
+        try:
+            async with self.session.get(self.client.url(term, size, extra_info)) as response:
+                result = tuple(x['qnode'] for x in await response.json(content_type=None))
+        except Exception:
+            self.client.breaker.record_failure()
+            raise
+        self.client.breaker.record_success()
+
+        self.client.cache.set(key, result)
+        return result
+
+    async def is_up(self, loop):
+        breaker = self.client.breaker
+        if not breaker._started:
+            # The first check probes the remote synchronously
+            return await loop.run_in_executor(None, breaker.allow)
+        return breaker.allow()
+
+
+class PropertyFinderASGI(object):
+    ''' ASGI application serving PropertyFinder.shared() '''
+
+    def __init__(self, workers=ASYNC_workers):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='rank')
+        self.clients = {}
+
+    def client(self, host):
+        if host not in self.clients:
+            self.clients[host] = AsyncRemoteSearch(host)
+        return self.clients[host]
+
+    async def is_up(self, finder, loop):
+        backend = finder.backend
+        if isinstance(backend, RemoteHTTP):
+            return await self.client(backend.host).is_up(loop)
+        if isinstance(backend, Composite):
+            # Its first check may probe the remote members synchronously
+            return await loop.run_in_executor(self.executor, backend.is_up)
+        return backend.is_up()
+
+    async def backend_search(self, backend, term, size, extra_info=True, type_=None):
+        ''' backend.search awaited: the KGTK-search queries of a RemoteHTTP
+            backend, or of the remote members of a Composite, on the event loop,
+            those of the local index in the thread pool
+        '''
+        if isinstance(backend, RemoteHTTP):
+            return await self.client(backend.host).search(term, size, extra_info)
+        if isinstance(backend, Composite):
+            return await self.composite_search(backend, term, size, extra_info, type_)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, backend.search, term, size, extra_info, type_)
+
+    async def composite_search(self, composite, term, size, extra_info=True, type_=None):
+        ''' Composite.search with its members awaited as tasks: a query missing
+            its deadline, or losing to the answer of another member, is cancelled
+        '''
+        loop = asyncio.get_running_loop()
+        pending = {}
+        error = None
+        queue = list(zip(composite.backends, composite.deadlines))
+        next_hedge = float('inf')
+        try:
+            while True:
+                now = loop.time()
+                if queue and (not pending or now >= next_hedge):
+                    backend, deadline = queue.pop(0)
+                    if not backend.is_up(block=False) and queue:
+                        continue
+                    if pending:
+                        count(hedged_requests, backend.name)
+                    task = asyncio.ensure_future(self.backend_search(backend, term, size, extra_info, type_))
+                    pending[task] = (backend, now + deadline if deadline is not None else float('inf'))
+                    next_hedge = now + composite.hedge if composite.hedge is not None else float('inf')
+                    continue
+                if not pending:
+                    raise error if error is not None else RuntimeError(f'No retrieval backend answered {term!r}')
+
+                wake = min([next_hedge if queue else float('inf')] + [expiry for _, expiry in pending.values()])
+                done, _ = await asyncio.wait(pending, timeout=None if wake == float('inf') else max(wake - now, 0),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    backend, _ = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        count(backend_requests, backend.name, 'failed')
+                        error = e
+                        continue
+                    count(backend_requests, backend.name, 'answered')
+                    for loser, _ in pending.values():
+                        count(backend_requests, loser.name, 'lost')
+                    return result
+
+                now = loop.time()
+                for task, (backend, expiry) in list(pending.items()):
+                    if now >= expiry:
+                        del pending[task]
+                        task.cancel()
+                        count(backend_requests, backend.name, 'deadline')
+                        error = TimeoutError(f'{backend.name} did not answer {term!r} within its deadline')
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def search_typed(self, finder, term, type_, extra_info=True):
+        ''' PropertyFinder._search_typed, the queries awaited
+        '''
+        backend, size = finder.backend, finder.query_size
+        result = set(await self.backend_search(backend, term, size, extra_info, type_))
+        return result, len(result) > 0 or (bool(type_) and len(await self.backend_search(backend, term, size,
+                                                                                          extra_info)) > 0)
+
+    async def retrieve(self, finder, label, type_=None):
+        ''' PropertyFinder._retrieve, the queries of the backend awaited
+        '''
+        with timed('retrieve'):
+            depth = 'main'
+            query_result, matched = await self.search_typed(finder, label, type_)
+
+            try:
+                if not matched and finder.ninja:
+                    depth = 'ninja'
+                    result, matched = await self.search_typed(finder, finder._ninja_term(label), type_,
+                                                              extra_info=False)
+                    query_result.update(result)
+
+                    if not matched and finder.partial_query:
+                        depth = 'partial'
+                        terms = finder._partial_terms(label)
+                        for result in await asyncio.gather(*[self.backend_search(finder.backend, term,
+                                                                                 finder.query_size, type_=type_)
+                                                             for term in terms]):
+                            query_result.update(result)
+            except Exception:
+                return []
+            finally:
+                count(fallback_depth, depth)
+
+            if finder.text_search:
+                loop = asyncio.get_running_loop()
+                query_result.update((await loop.run_in_executor(self.executor, finder._text_search,
+                                                                [label], [type_]))[0])
+
+            return [x for x in query_result]
+
+    async def answer(self, finder, params, size, retrievals):
+        ''' generate_top_candidates(params, size) with the retrieval awaited,
+            and skipped when the result cache holds the ranking already
+            retrievals: the retrieval tasks by key, shared by the queries of a request
+        '''
+        key = finder._retrieval_key(params)
+        label = finder._complete_params(params)
+        ranked = finder._cached_ranking(label, params, size)
+        if ranked is not None:
+            return finder._candidates_info(ranked, params, size)
+
+        if key not in retrievals:
+            retrievals[key] = asyncio.ensure_future(self.retrieve(finder, *key))
+        retrieved = await retrievals[key]
+
+        def rank():
+            return finder._candidates_info(finder._rank_and_cache(label, params, size, retrieved), params, size)
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, rank)
+
+    async def search(self, finder, args):
+        count(requests_total, 'search')
+        params, size, error = finder._parse_args(args)
+        if error is not None:
+            return error
+        record(finder, params, size)
+
+        loop = asyncio.get_running_loop()
+        if not await self.is_up(finder, loop):
+            return {'Error': 'Remote service for querying properties is down.'}, 500
+        if isinstance(finder.backend, LocalIndex):
+            # Nothing to wait for
+            return await loop.run_in_executor(self.executor, finder.generate_top_candidates, params, size), 200
+
+        try:
+            return await self.answer(finder, params, size, {}), 200
+        except Exception:
+            # Same as the threaded mode, where _retrieve lets a failed main query raise
+            return {'message': 'Internal Server Error'}, 500
+
+    async def search_batch(self, finder, body):
+        ''' PropertyFinder.search_many, the retrievals awaited: one per label,
+            identical queries answered once, a failed query getting {'Error': ...}
+        '''
+        count(requests_total, 'batch')
+        try:
+            body = json.loads(body) if body else None
+        except ValueError:
+            body = None
+        if isinstance(body, dict):
+            body = body.get('queries')
+        if not isinstance(body, list) or not all(isinstance(query, dict) for query in body):
+            return {'Error': 'The request body must be a JSON list of queries'}, 400
+        if len(body) > BATCH_max_size:
+            return {'Error': f'At most {BATCH_max_size} queries are allowed per batch'}, 400
+
+        loop = asyncio.get_running_loop()
+        if not await self.is_up(finder, loop):
+            return {'Error': 'Remote service for querying properties is down.'}, 500
+        if isinstance(finder.backend, LocalIndex):
+            return await loop.run_in_executor(self.executor, finder.search_many, body, True), 200
+
+        parsed = [finder._parse_args(query) for query in body]
+        answers = {}
+        retrievals = {}
+        for params, size, error in parsed:
+            if error is None:
+                record(finder, params, size)
+                key = tuple(sorted(params.items())) + (size,)
+                if key not in answers:
+                    answers[key] = asyncio.ensure_future(self.answer(finder, dict(params), size, retrievals))
+        results = dict(zip(answers, await asyncio.gather(*answers.values(), return_exceptions=True)))
+
+        response = []
+        for params, size, error in parsed:
+            if error is not None:
+                response.append(error[0])
+                continue
+            result = results[tuple(sorted(params.items())) + (size,)]
+            response.append({'Error': repr(result)} if isinstance(result, Exception) else result)
+        return response, 200
+
+    def admin(self, scope, path, args):
+        ''' The /admin endpoints of the Flask app (api/admin.py)
+        '''
+        authorization = dict(scope['headers']).get(b'authorization')
+        error = refused(authorization.decode('latin-1') if authorization is not None else None)
+        if error is not None:
+            return error
+        if path == '/admin/reload' and scope['method'] == 'POST':
+            return start_reload(args.get('force', 'false').lower() == 'true')
+        if path == '/admin/generation' and scope['method'] == 'GET':
+            return generation_info()
+        if path == '/admin/memory' and scope['method'] == 'GET':
+            return footprint(), 200
+        return {'message': 'Not Found'}, 404
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+
+        body = b''
+        if scope['method'] == 'POST':
+            more = True
+            while more:
+                message = await receive()
+                body += message.get('body', b'')
+                more = message.get('more_body', False)
+
+        finder = PropertyFinder.shared()
+        path = scope['path'].rstrip('/') or '/'
+        # First value of each parameter, as request.args.get in Flask
+        args = {}
+        for key, value in parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True):
+            args.setdefault(key, value)
+        if path == '/search' and scope['method'] == 'GET':
+            payload, status = await self.search(finder, args)
+        elif path == '/search/batch' and scope['method'] == 'POST':
+            payload, status = await self.search_batch(finder, body)
+        elif path.startswith('/admin/'):
+            payload, status = self.admin(scope, path, args)
+        elif path == '/ready':
+            payload, status = warmup.stats(), 200 if warmup.ready else 503
+        elif path == '/metrics' and scope['method'] == 'GET':
+            return await self.respond(send, 200, registry.expose().encode('utf-8'),
+                                      b'text/plain; version=0.0.4; charset=utf-8')
+        elif path == '/':
+            return await self.respond(send, 200, b'<html>Welcome! This web provides the service for finding '
+                                                 b'wikidata properties.</html>', b'text/html; charset=utf-8')
+        else:
+            payload, status = {'message': 'Not Found'}, 404
+
+        await self.respond(send, status, json.dumps(payload).encode('utf-8'), b'application/json')
+
+    async def respond(self, send, status, body, content_type):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode()),
+                                (b'access-control-allow-origin', b'*')]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Prewarming runs in the background, /ready tells when it is done,
+                # and changes to data/ are loaded as in the Flask app
+                PropertyFinder.shared()
+                warmup.start(PropertyFinder.shared)
+                watch_data()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                for client in self.clients.values():
+                    await client.close()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = PropertyFinderASGI()
@@ -0,0 +1,261 @@
+''' Candidate retrieval backends: where the ngram queries of _retrieve are sent.
+
+    A backend answers search(term, size, extra_info, type_) with the ids of the
+    properties matching term, best first, and search_many with those of several
+    terms. filters_types tells whether it applies type_; is_up whether it can
+    currently answer, is_up(block=False) without waiting for a first probe.
+
+    RemoteHTTP    a KGTK-search API (the shared RemoteSearch client of its host)
+    LocalIndex    the in-process ngram index of a data generation
+    Composite     several backends tried in order. The next one is queried
+                  when the previous fails or misses its deadline, or, with a
+                  hedge delay, as soon as the previous has not answered within
+                  it; the first answer wins. Each backend has its own pool
+                  of threads, and one whose threads are all busy is skipped.
+                  Deadlines run from the start of the query.
+
+    get_backend builds them from a PROPERTY_FINDER_HOST spec: a URL, 'local',
+    or a comma separated list of those, each optionally followed by
+    @<deadline in ms>, e.g. 'https://mirror/api@300,https://kgtk.isi.edu/api,local'
+'''
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Lock
+from time import monotonic
+
+from .metrics import registry, count
+from .remote import get_client
+from .settings import LOCAL_search, REMOTE_pool_size, SEARCH_hedge, SEARCH_deadline
+
+backend_requests = registry.counter('propertyfinder_backend_requests_total',
+                                    'Queries sent to each member of a composite backend, by outcome '
+                                    '(answered, failed, deadline, lost, busy)', ('backend', 'outcome'))
+hedged_requests = registry.counter('propertyfinder_hedged_requests_total',
+                                   'Queries sent to a backend while an earlier one was still pending', ('backend',))
+
+
+class RemoteHTTP(object):
+    ''' KGTK-search API at host
+    '''
+    filters_types = False
+
+    def __init__(self, host):
+        self.name = host
+        self.host = host
+        self.client = get_client(host)
+
+    def search(self, term, size, extra_info=True, type_=None):
+        return self.client.search(term, size, extra_info)
+
+    def search_many(self, terms, size, extra_info=True, type_=None):
+        return self.client.search_many(terms, size, extra_info)
+
+    def is_up(self, block=True):
+        return self.client.is_up(block)
+
+
+class LocalIndex(object):
+    ''' The ngram index over the property labels and aliases of generation
+    '''
+    filters_types = True
+    name = LOCAL_search
+
+    def __init__(self, generation):
+        self.generation = generation
+        generation.index()
+
+    def search(self, term, size, extra_info=True, type_=None):
+        mask = self.generation.metadata.type_mask(type_) if type_ else None
+        return self.generation.index().search(term, size, mask)
+
+    def search_many(self, terms, size, extra_info=True, type_=None):
+        return [self.search(term, size, type_=type_) for term in terms]
+
+    def is_up(self, block=True):
+        return True
+
+
+class BackendPool(object):
+    ''' The threads querying one backend. A query is only handed to a free
+        thread: when all of them are busy (e.g. held by queries of a hung
+        backend which are no longer waited for) submit refuses it, so the
+        caller moves on to the next backend instead of queueing behind them.
+    '''
+
+    def __init__(self, size=REMOTE_pool_size):
+        self.size = size
+        self.busy = 0
+        self.lock = Lock()
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='backend')
+
+    def submit(self, fn, args, queue=False):
+        ''' (future, call) of fn(*args), call.started being set when it begins
+            to run, or None when every thread is busy, unless queue
+        '''
+        with self.lock:
+            if self.busy >= self.size and not queue:
+                return None
+            self.busy += 1
+        call = Call()
+        future = self.executor.submit(call.run, fn, args)
+        future.add_done_callback(self._release)
+        return future, call
+
+    def _release(self, future):
+        with self.lock:
+            self.busy -= 1
+
+
+class Call(object):
+    ''' A query run by a BackendPool: its deadline runs from started
+    '''
+    __slots__ = ('started',)
+
+    def __init__(self):
+        self.started = None
+
+    def run(self, fn, args):
+        self.started = monotonic()
+        return fn(*args)
+
+
+_pools = {}
+_pools_lock = Lock()
+
+
+def backend_pool(backend):
+    ''' The BackendPool of backend, one per backend name in the process
+    '''
+    with _pools_lock:
+        pool = _pools.get(backend.name)
+        if pool is None:
+            pool = _pools[backend.name] = BackendPool()
+        return pool
+
+
+def _after_fork():
+    # The threads of the parent, and the locks they may have held, do not survive a fork
+    global _pools_lock
+    _pools.clear()
+    _pools_lock = Lock()
+    Composite._terms = ThreadPoolExecutor(max_workers=REMOTE_pool_size, thread_name_prefix='backend-batch')
+
+
+class Composite(object):
+    ''' Backends queried in order, each with an optional deadline in seconds
+    '''
+    # The terms of search_many run apart from the BackendPools of the members:
+    # a term waiting on its members never holds a thread they need
+    _terms = ThreadPoolExecutor(max_workers=REMOTE_pool_size, thread_name_prefix='backend-batch')
+
+    def __init__(self, backends, deadlines=None, hedge=SEARCH_hedge):
+        ''' deadlines: seconds each backend is waited for once its query started,
+                       None for no deadline
+            hedge: seconds after which the next backend is queried while the
+                   previous is still pending, None to only query it on a failure
+        '''
+        self.backends = backends
+        self.deadlines = deadlines or [None] * len(backends)
+        self.hedge = hedge
+        self.name = ','.join(backend.name for backend in backends)
+        # The type filter is only pushed down when every member applies it,
+        # so the answer does not depend on which one wins
+        self.filters_types = all(backend.filters_types for backend in backends)
+
+    def search(self, term, size, extra_info=True, type_=None):
+        ''' The first answer of the backends, see the module documentation.
+            A backend whose threads are all busy is skipped, unless it is the
+            last one left. Raises the last error when none answers.
+        '''
+        pending = {}
+        error = None
+        queue = list(zip(self.backends, self.deadlines))
+        next_hedge = float('inf')
+        while True:
+            now = monotonic()
+            if queue and (not pending or now >= next_hedge):
+                backend, deadline = queue.pop(0)
+                # A hung backend must not hold the query before its deadline
+                if not backend.is_up(block=False) and queue:
+                    continue
+                # The last backend left waits for one of its threads, its
+                # deadline only running once the query started
+                submitted = backend_pool(backend).submit(backend.search, (term, size, extra_info, type_),
+                                                         queue=not queue)
+                if submitted is None:
+                    count(backend_requests, backend.name, 'busy')
+                    error = RuntimeError(f'{backend.name} has no free thread for {term!r}')
+                    continue
+                if pending:
+                    count(hedged_requests, backend.name)
+                future, call = submitted
+                pending[future] = (backend, deadline, call)
+                next_hedge = now + self.hedge if self.hedge is not None else float('inf')
+                continue
+            if not pending:
+                raise error if error is not None else RuntimeError(f'No retrieval backend answered {term!r}')
+
+            # A query not started yet is checked again after its deadline
+            expiries = [(call.started or now) + deadline for _, deadline, call in pending.values()
+                        if deadline is not None]
+            wake = min([next_hedge if queue else float('inf')] + expiries)
+            done, _ = wait(pending, timeout=None if wake == float('inf') else max(wake - now, 0),
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                backend, _, _ = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    count(backend_requests, backend.name, 'failed')
+                    error = e
+                    continue
+                count(backend_requests, backend.name, 'answered')
+                for other, (loser, _, _) in pending.items():
+                    other.cancel()
+                    count(backend_requests, loser.name, 'lost')
+                return result
+
+            now = monotonic()
+            for future, (backend, deadline, call) in list(pending.items()):
+                if deadline is not None and call.started is not None and now >= call.started + deadline:
+                    # The query keeps its thread until it returns, but is no longer waited for
+                    del pending[future]
+                    count(backend_requests, backend.name, 'deadline')
+                    error = TimeoutError(f'{backend.name} did not answer {term!r} within its deadline')
+
+    def search_many(self, terms, size, extra_info=True, type_=None):
+        return list(Composite._terms.map(lambda term: self.search(term, size, extra_info, type_), terms))
+
+    def is_up(self, block=True):
+        return any(backend.is_up(block) for backend in self.backends)
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def parse_spec(spec):
+    ''' [(host, deadline in seconds or None)] of a comma separated backend spec
+    '''
+    members = []
+    for member in spec.split(','):
+        member = member.strip()
+        if not member:
+            continue
+        deadline = SEARCH_deadline
+        host, _, suffix = member.rpartition('@')
+        if host and suffix.isdigit():
+            member, deadline = host, int(suffix) / 1000
+        members.append((member, deadline))
+    return members
+
+
+def get_backend(spec, generation):
+    ''' The backend of a PROPERTY_FINDER_HOST spec, its local index over generation
+    '''
+    members = parse_spec(spec)
+    if not members:
+        raise ValueError(f'No retrieval backend in {spec!r}')
+    backends = [LocalIndex(generation) if host == LOCAL_search else RemoteHTTP(host) for host, _ in members]
+    if len(backends) == 1 and members[0][1] is None:
+        return backends[0]
+    return Composite(backends, [deadline for _, deadline in members])
@@ -0,0 +1,264 @@
+import atexit, json, sqlite3
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from .metrics import registry
+from .settings import RESULT_cache_rows, RESULT_commit_every, RESULT_commit_interval, RESULT_db_timeout
+
+
+class TTLCache(object):
+    ''' Thread-safe LRU cache bounded to maxsize entries,
+        each entry expiring ttl seconds after it was set
+    '''
+
+    def __init__(self, maxsize, ttl, clock=monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires <= self.clock():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (self.clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None or entry[0] <= self.clock() else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {'size': len(self._data), 'maxsize': self.maxsize, 'ttl': self.ttl,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'expirations': self.expirations}
+
+
+class ResultCache(object):
+    ''' LRU of ranked candidate lists, bounded by an estimate of their memory
+        and optionally backed by a sqlite file that survives restarts.
+        An entry is (ranked, complete): the list may only be a prefix of the
+        full ranking when complete is False.
+        Keys start with the fingerprint of the static data, so entries computed
+        from a different data snapshot are never returned.
+        The sqlite file holds at most max_rows entries, the oldest written
+        dropped first. Its writes are buffered and written in one short
+        transaction every commit_every entries or commit_interval seconds, so
+        no transaction stays open between calls. The file is best effort: when
+        another process holds it for longer than timeout seconds, a read is a
+        miss and the buffered writes are dropped.
+    '''
+
+    def __init__(self, max_bytes, path=None, max_rows=RESULT_cache_rows, commit_every=RESULT_commit_every,
+                 commit_interval=RESULT_commit_interval, timeout=RESULT_db_timeout):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.max_rows = max_rows
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_hits = 0
+        self.disk_errors = 0
+        self.dropped_writes = 0
+
+        self._db = None
+        self._rows = 0
+        self._pending = OrderedDict()
+        self._committed_at = monotonic()
+        if path is not None:
+            # The schema waits for the default timeout, queries for the short one
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            with self._db:
+                columns = [row[1] for row in self._db.execute('PRAGMA table_info(results)')]
+                if columns and 'stamp' not in columns:
+                    # A file written before the row cap: its entries have no write order
+                    self._db.execute('DROP TABLE results')
+                self._db.execute('CREATE TABLE IF NOT EXISTS results '
+                                 '(key TEXT PRIMARY KEY, fingerprint TEXT, value TEXT, stamp INTEGER)')
+                self._db.execute('CREATE INDEX IF NOT EXISTS results_stamp ON results (stamp)')
+            self._db.execute(f'PRAGMA busy_timeout = {int(timeout * 1000)}')
+            self._rows = self._db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+            self._stamp = self._db.execute('SELECT COALESCE(MAX(stamp), 0) FROM results').fetchone()[0]
+            atexit.register(self.commit)
+
+    @staticmethod
+    def _size(entry):
+        return 64 + sum(88 + len(pnode) for pnode, _ in entry[0])
+
+    def _store(self, key, entry):
+        if key in self._data:
+            self.bytes -= self._size(self._data.pop(key))
+        self._data[key] = entry
+        self.bytes += self._size(entry)
+        while self.bytes > self.max_bytes and self._data:
+            _, evicted = self._data.popitem(last=False)
+            self.bytes -= self._size(evicted)
+            self.evictions += 1
+
+    def get(self, key):
+        ''' The entry (ranked [(pnode, score)], complete) stored for key, None on a miss
+        '''
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry
+
+            if self._db is not None:
+                try:
+                    row = self._db.execute('SELECT value FROM results WHERE key = ?',
+                                           (json.dumps(key),)).fetchone()
+                except sqlite3.Error:
+                    self.disk_errors += 1
+                    row = None
+                if row is not None:
+                    ranked, complete = json.loads(row[0])
+                    entry = ([tuple(x) for x in ranked], complete)
+                    self._store(key, entry)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return entry
+
+            self.misses += 1
+            return None
+
+    def set(self, key, ranked, complete=True):
+        with self._lock:
+            entry = (ranked, complete)
+            self._store(key, entry)
+            if self._db is not None:
+                self._pending[json.dumps(key)] = (key[0], json.dumps(entry))
+                if (len(self._pending) >= self.commit_every
+                        or monotonic() - self._committed_at >= self.commit_interval):
+                    self._commit()
+
+    def _trim(self):
+        ''' Drop the oldest rows, down to 90% of max_rows so that trimming is amortized
+        '''
+        self._rows = self._db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        excess = self._rows - int(self.max_rows * 0.9)
+        if excess > 0:
+            self._db.execute('DELETE FROM results WHERE key IN '
+                             '(SELECT key FROM results ORDER BY stamp LIMIT ?)', (excess,))
+            self._rows -= excess
+
+    def _commit(self):
+        ''' Write the buffered entries in one transaction, or drop them if the file is locked
+        '''
+        pending = self._pending
+        self._pending = OrderedDict()
+        self._committed_at = monotonic()
+        if not pending:
+            return
+        rows = []
+        for key, (fingerprint, value) in pending.items():
+            self._stamp += 1
+            rows.append((key, fingerprint, value, self._stamp))
+        try:
+            with self._db:
+                self._db.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', rows)
+                # An upper bound (the keys may have been there), _trim counts them exactly
+                self._rows += len(rows)
+                if self._rows > self.max_rows:
+                    self._trim()
+        except sqlite3.Error:
+            self.disk_errors += 1
+            self.dropped_writes += len(rows)
+
+    def commit(self):
+        ''' Write the pending entries to the sqlite file
+        '''
+        if self._db is not None:
+            with self._lock:
+                self._commit()
+
+    def purge(self, fingerprint):
+        ''' Drop every entry computed from data other than fingerprint
+        '''
+        with self._lock:
+            for key in [k for k in self._data if k[0] != fingerprint]:
+                self.bytes -= self._size(self._data.pop(key))
+            if self._db is not None:
+                self._pending = OrderedDict((key, value) for key, value in self._pending.items()
+                                            if value[0] == fingerprint)
+                try:
+                    with self._db:
+                        self._db.execute('DELETE FROM results WHERE fingerprint != ?', (fingerprint,))
+                    self._rows = self._db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+                except sqlite3.Error:
+                    # Stale rows are never returned, the next purge or trim drops them
+                    self.disk_errors += 1
+
+    def stats(self):
+        return {'size': len(self._data), 'bytes': self.bytes, 'max_bytes': self.max_bytes, 'path': self.path,
+                'rows': self._rows, 'max_rows': self.max_rows if self.path else None,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'disk_hits': self.disk_hits, 'disk_errors': self.disk_errors, 'dropped_writes': self.dropped_writes}
+
+
+_result_caches = {}
+_result_caches_lock = Lock()
+
+
+def get_result_cache(spec, max_bytes):
+    ''' Shared ResultCache for a RESULT_cache setting:
+        '' (disabled, returns None), 'memory', or the path of a sqlite file
+    '''
+    if not spec:
+        return None
+    with _result_caches_lock:
+        if spec not in _result_caches:
+            _result_caches[spec] = ResultCache(max_bytes, None if spec == 'memory' else spec)
+        return _result_caches[spec]
+
+
+def result_cache_stats():
+    return [cache.stats() for cache in list(_result_caches.values())]
+
+
+@registry.collector
+def _result_cache_metrics():
+    caches = list(_result_caches.items())
+    yield ('propertyfinder_result_cache_hits_total', 'counter', 'Ranked lists served from the result cache',
+           [({'cache': spec}, cache.hits) for spec, cache in caches])
+    yield ('propertyfinder_result_cache_misses_total', 'counter', 'Result cache misses',
+           [({'cache': spec}, cache.misses) for spec, cache in caches])
@@ -0,0 +1,48 @@
+# Flags of a property, compiled from its wikidata constraints
+NOITEM = 1
+SCOPE_MAN = 2
+NOT_QUALIFIER = 4    # has a scope constraint which excludes qualifiers
+NOT_MAIN_VALUE = 8   # has a scope constraint which excludes main values
+
+
+class ConstraintTable(object):
+    ''' constraints.json compiled for filtering: one int of flags per property,
+        and the allowed / required qualifiers and conflicts as frozensets
+    '''
+
+    def __init__(self, constraints):
+        self.flags = {}
+        self.allowed = {}
+        self.required = {}
+        self.conflicts = {}
+
+        for pnode, info in constraints.items():
+            f = 0
+            if 'noitem' in info:
+                f |= NOITEM
+            if 'scope_man' in info:
+                f |= SCOPE_MAN
+            if 'scope' in info:
+                if not 'Q' in info['scope']:
+                    f |= NOT_QUALIFIER
+                if not 'V' in info['scope']:
+                    f |= NOT_MAIN_VALUE
+            if f:
+                self.flags[pnode] = f
+
+            if 'allowed_qualifiers' in info:
+                self.allowed[pnode] = frozenset(info['allowed_qualifiers'])
+            if 'required_qualifiers' in info:
+                self.required[pnode] = frozenset(info['required_qualifiers'])
+            if 'conflicts' in info:
+                self.conflicts[pnode] = frozenset(info['conflicts'])
+
+    def disallowed(self, otherProperties):
+        ''' Properties conflicting with any of the comma separated otherProperties
+        '''
+        disallowed = set()
+        if otherProperties == '':
+            return disallowed
+        for pnode in otherProperties.split(','):
+            disallowed |= self.conflicts.get(pnode, frozenset())
+        return disallowed
@@ -0,0 +1,112 @@
+''' Versioned generations of the static data served by PropertyFinder.
+
+    A DataGeneration holds everything derived from the files under data/ and
+    is never modified once built. Reloading builds a new generation next to
+    the current one; PropertyFinder instances keep the generation they were
+    built with, so requests in flight finish against the data they started on.
+'''
+from threading import Lock
+from time import time
+
+from .constraints import ConstraintTable
+from .metadata import PropertyMetaData
+from .ranking import PropertyRanker
+from .records import build_store, load_store
+from .relations import RelationIndex
+from .search_index import NgramIndex, load_index
+from .settings import RELATIONS
+from .text_index import TextIndex, load_text_index
+
+
+class DataGeneration(object):
+    ''' The property store with the metadata, ranker, relation index and
+        constraint table built from it.
+        The first generation uses the process-wide store (and index).
+        The relation maps and constraints dict are only rebuilt on first use,
+        the filtering and expansion work on the compact structures.
+    '''
+
+    def __init__(self, version, store=None):
+        self.version = version
+        self.initial = store is None
+        self.store = load_store() if self.initial else store
+        self.fingerprint = self.store.fingerprint
+        self.loaded_at = time()
+
+        self.metadata = PropertyMetaData(None if self.initial else store)
+        self.ranker = PropertyRanker(store=None if self.initial else store)
+        self.relation_index = RelationIndex(self.store)
+        self.constraint_table = ConstraintTable(self.store.to_constraints())
+        self._relations = None
+        self._constraints = None
+
+        self._index = None
+        self._index_lock = Lock()
+        self._text_index = None
+        self._text_index_lock = Lock()
+
+    @property
+    def relations(self):
+        ''' The maps X -> [Y] of every relation R in RELATIONS (X R Y)
+        '''
+        if self._relations is None:
+            self._relations = {label: self.store.to_relation(label) for label in RELATIONS}
+        return self._relations
+
+    @property
+    def constraints(self):
+        ''' The part of constraints.json used for filtering, as a dict
+        '''
+        if self._constraints is None:
+            self._constraints = self.store.to_constraints()
+        return self._constraints
+
+    def index(self):
+        ''' The ngram index over the names of this generation, built on first use
+        '''
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    self._index = load_index() if self.initial else NgramIndex(self.store)
+        return self._index
+
+    def text_index(self):
+        ''' The BM25 index over the names and descriptions of this generation, built on first use
+        '''
+        if self._text_index is None:
+            with self._text_index_lock:
+                if self._text_index is None:
+                    self._text_index = load_text_index() if self.initial else TextIndex(self.store)
+        return self._text_index
+
+    def info(self):
+        return {'version': self.version, 'fingerprint': self.fingerprint, 'loaded_at': self.loaded_at,
+                'properties': len(self.store)}
+
+
+_current = None
+_current_lock = Lock()
+
+
+def current_generation():
+    ''' The generation new PropertyFinders are built with
+    '''
+    global _current
+    if _current is None:
+        with _current_lock:
+            if _current is None:
+                _current = DataGeneration(1)
+    return _current
+
+
+def build_generation():
+    ''' Load the files under data/ again into a new generation, without
+        making it current
+    '''
+    return DataGeneration(current_generation().version + 1, build_store(fresh=True))
+
+
+def set_current_generation(generation):
+    global _current
+    with _current_lock:
+        _current = generation
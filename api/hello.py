@@ -1,8 +1,17 @@
 from flask import Blueprint, current_app
 
+from .querylog import warmup
+
 bp = Blueprint('hello', __name__)
 
 @bp.route('/')
 def hello() -> str:
     # return f"Backend is {current_app.config['STORAGE_BACKEND']}"
     return f"<html>Welcome! This web provides the service for finding wikidata properties.</html>"
+
+
+@bp.route('/ready')
+def ready():
+    ''' 200 once the data is loaded and the caches prewarmed, 503 before
+    '''
+    return warmup.stats(), 200 if warmup.ready else 503
@@ -0,0 +1,103 @@
+''' Memory accounting of the data held by a worker.
+
+    footprint() walks the structures of a DataGeneration and reports, per
+    component, the bytes on the Python heap and the bytes of arrays mapped
+    from the snapshot file (shared by all the workers through the page cache).
+    An object reachable from several components is counted once, in the first.
+'''
+import mmap, os, sys
+import numpy as np
+
+from .generation import current_generation
+
+_SKIP = (type, type(sys), type(len), type(lambda: None))
+
+
+class Sizer(object):
+    ''' Deep size of objects, each object counted once across calls
+    '''
+
+    def __init__(self):
+        self.seen = set()
+
+    def size(self, obj):
+        ''' (heap bytes, mapped bytes) of obj and what it references
+        '''
+        heap, mapped = 0, 0
+        stack = [obj]
+        while stack:
+            obj = stack.pop()
+            if id(obj) in self.seen or isinstance(obj, _SKIP) or type(obj).__name__ == 'lock':
+                continue
+            self.seen.add(id(obj))
+
+            if isinstance(obj, np.ndarray):
+                root = obj
+                while isinstance(root.base, np.ndarray):
+                    root = root.base
+                base = root.base.obj if isinstance(root.base, memoryview) else root.base
+                if isinstance(base, mmap.mmap):
+                    mapped += obj.nbytes
+                elif root is obj or id(root) not in self.seen:
+                    self.seen.add(id(root))
+                    heap += root.nbytes
+                continue
+
+            heap += sys.getsizeof(obj)
+            if isinstance(obj, dict):
+                stack.extend(obj.keys())
+                stack.extend(obj.values())
+            elif isinstance(obj, (list, tuple, set, frozenset)):
+                stack.extend(obj)
+            elif isinstance(obj, (str, bytes, int, float, bool, type(None))):
+                pass
+            else:
+                if hasattr(obj, '__dict__'):
+                    stack.append(obj.__dict__)
+                for slot in getattr(type(obj), '__slots__', ()):
+                    if hasattr(obj, slot):
+                        stack.append(getattr(obj, slot))
+        return heap, mapped
+
+
+def rss():
+    ''' Resident set size of this process in bytes, None where /proc is missing
+    '''
+    try:
+        with open('/proc/self/statm') as fd:
+            return int(fd.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def footprint(generation=None):
+    ''' Heap and mapped bytes of each structure of generation (the current one by default).
+        Structures built on first use are only reported once built.
+    '''
+    generation = generation if generation is not None else current_generation()
+    store = generation.store
+    components = [
+        ('store.arrays', store.arrays),
+        ('store.ids', store.ids),
+        ('store.pnodes', store.pnodes),
+        ('store.records', store._records),
+        ('metadata', generation.metadata),
+        ('ranker', generation.ranker),
+        ('relation_index', generation.relation_index),
+        ('relations', generation._relations),
+        ('constraints', generation._constraints),
+        ('constraint_table', generation.constraint_table),
+        ('ngram_index', generation._index),
+        ('text_index', generation._text_index),
+    ]
+
+    sizer = Sizer()
+    report = {}
+    for name, obj in components:
+        if obj is None:
+            continue
+        heap, mapped = sizer.size(obj)
+        report[name] = {'heap': heap, 'mapped': mapped}
+    report['total'] = {'heap': sum(r['heap'] for r in report.values()),
+                       'mapped': sum(r['mapped'] for r in report.values())}
+    return {'generation': generation.version, 'rss': rss(), 'structures': report}
@@ -1,7 +1,6 @@
-import pandas as pd
-import math, json
-from requests import get
-from .settings import FILE_label, FILE_alias, FILE_description, FILE_datatype, FILE_metadata
+import numpy as np
+
+from .records import load_store
 
 allowed_types = ['commonsMedia', 'wikibase-item', 'external-id', 'url', 'string',
                  'quantity', 'time', 'globe-coordinate', 'monolingualtext',
@@ -17,68 +16,58 @@ type_aliases = {'media': 'commonsMedia', 'item': 'wikibase-item', 'id': 'externa
 
 class PropertyMetaData(object):
 
-    def __init__(self):
+    def __init__(self, store=None):
+        ''' store: the PropertyStore to describe, the process-wide one by default
+        '''
+        self.store = store if store is not None else self._build_names()
+        self._build_partitions()
 
-        self.name_table = self._build_names()
-        with open(FILE_metadata) as fd:
-            self.remote_metadata = json.load(fd)
+    def _build_partitions(self):
+        ''' Partition the properties by datatype, as a boolean mask over the
+            store ids (for the index and relation arrays) and a set of pnodes
+        '''
+        codes = np.asarray(self.store['datatype'])
+        self.type_masks = {}
+        self.type_sets = {}
+        for code, data_type in enumerate(self.store.datatypes):
+            mask = codes == code
+            self.type_masks[data_type] = mask
+            self.type_sets[data_type] = frozenset(self.store.pnodes[i] for i in np.nonzero(mask)[0].tolist())
 
     def _build_names(self):
-        ''' Build a table that includes the following information
-        label, aliases, description, datatype,
+        ''' Build the property store that includes the following information
+        label, aliases, description, datatype, pagerank, statements
         '''
-        labels = pd.read_csv(FILE_label, sep='\t')
-        labels['node2'] = labels['node2'].apply(lambda x: x[1:-4])
-        labels.columns = ['pnode', 'label']
-        labels = labels.groupby('pnode')['label'].apply(list).reset_index().set_index('pnode')
-
-        aliases = pd.read_csv(FILE_alias, sep='\t')
-        aliases['node2'] = aliases['node2'].apply(lambda x: x[1:-4])
-        aliases.columns = ['pnode', 'alias']
-        aliases = aliases.groupby('pnode')['alias'].apply(list).reset_index().set_index('pnode')
-
-        description = pd.read_csv(FILE_description, sep='\t')
-        description['node2'] = description['node2'].apply(lambda x: x[1:-4])
-        description.columns = ['pnode', 'description']
-        description = description.set_index('pnode')
-
-        data_type = pd.read_csv(FILE_datatype, sep='\t', usecols=['node1', 'node2'])
-        data_type.columns = ['pnode', 'data_type']
-        data_type = data_type.set_index('pnode')
-
-        merged = pd.concat([labels, aliases, description, data_type], axis=1)
-        for row in merged.loc[merged.alias.isnull(), 'alias'].index:
-            merged.at[row, 'alias'] = []
-
-        return merged
+        return load_store()
 
     def get_info(self, pnode, score=0.0, extra_info=False, warning=[]):
         ''' Return the properties according to the required format
         '''
+        record = self.store.record(pnode)
         dic = {'qnode': pnode,
-               'description': [self.name_table.loc[pnode]['description']]
+               'description': [record.description]
         }
         if extra_info:
-            dic['label'] = self.name_table.loc[pnode]['label']
-            dic['alias'] = self.name_table.loc[pnode]['alias']
-            dic['pagerank'] = self.remote_metadata[pnode]['pagerank']
-            dic['statements'] = self.remote_metadata[pnode]['statements']
+            dic['label'] = list(record.label)
+            dic['alias'] = list(record.alias)
+            dic['pagerank'], dic['statements'] = self.store.remote_metadata(pnode)
             dic['score'] = score
-            dic['data_type'] = self.name_table.loc[pnode]['data_type']
+            dic['data_type'] = record.data_type
 
         return dic
 
     def get_label(self, pnode):
-        return self.name_table.loc[pnode]['label'][0]
+        return self.store.record(pnode).label[0]
 
     def get_names(self, pnode):
-        for name in self.name_table.loc[pnode]['label']:
+        record = self.store.record(pnode)
+        for name in record.label:
             yield name
-        for alias in self.name_table.loc[pnode]['alias']:
+        for alias in record.alias:
             yield alias
 
     def get_type(self, pnode):
-        return self.name_table.loc[pnode]['data_type']
+        return self.store.record(pnode).data_type
 
     def get_type_alias(self, type_):
         if type_ in type_aliases:
@@ -87,7 +76,7 @@ class PropertyMetaData(object):
 
     def check_property_exists(self, pnode):
         try:
-            self.name_table.loc[pnode]
+            self.store.id(pnode)
             return True
         except KeyError:
             return False
@@ -95,5 +84,18 @@ class PropertyMetaData(object):
     def check_type(self, pnode, type_):
         return self.get_type_alias(type_) == self.get_type(pnode)
 
+    def typed(self, type_):
+        ''' The pnodes of type_ (or of the type it is an alias of)
+        '''
+        return self.type_sets.get(self.get_type_alias(type_), frozenset())
+
+    def type_mask(self, type_):
+        ''' Boolean mask over the store ids of the properties of type_
+        '''
+        type_ = self.get_type_alias(type_)
+        if type_ not in self.type_masks:
+            return np.zeros(len(self.store), dtype=bool)
+        return self.type_masks[type_]
+
     def check_type_allowed(self, type_):
         return type_ in allowed_types or type_ in type_aliases
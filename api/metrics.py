@@ -0,0 +1,188 @@
+''' Low-overhead counters and histograms of the search pipeline, exposed in the
+    Prometheus text format on /metrics. Stage timings of the current request
+    are also sent back in a Server-Timing header.
+'''
+
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+
+from flask import Blueprint, Response, g, has_request_context
+
+from .settings import METRICS_enabled
+
+STAGE_BUCKETS = [0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+COUNT_BUCKETS = [0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, values)) + '}'
+
+
+class Counter(object):
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}
+        self._lock = Lock()
+
+    def inc(self, *labels, value=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Histogram(object):
+
+    def __init__(self, name, help, labelnames=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.values = {}
+        self._lock = Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        names = self.labelnames + ('le',)
+        for labels, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + ['+Inf'], counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+class Registry(object):
+    ''' Metrics of the process, plus collectors called at scrape time which
+        return (name, type, help, List[(labels dict, value)])
+    '''
+
+    def __init__(self, enabled=METRICS_enabled):
+        self.enabled = enabled
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=STAGE_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        self.collectors.append(fn)
+        return fn
+
+    def expose(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.expose()
+        for fn in self.collectors:
+            for name, type_, help, samples in fn():
+                lines += [f'# HELP {name} {help}', f'# TYPE {name} {type_}']
+                for labels, value in samples:
+                    lines.append(f'{name}{_labels(tuple(labels), tuple(labels.values()))} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+requests_total = registry.counter('propertyfinder_requests_total', 'Search requests by endpoint', ('endpoint',))
+stage_seconds = registry.histogram('propertyfinder_stage_seconds', 'Time spent per pipeline stage', ('stage',))
+remote_calls = registry.counter('propertyfinder_remote_calls_total', 'Requests sent to KGTK-search', ('kind',))
+fallback_depth = registry.counter('propertyfinder_fallback_depth_total',
+                                  'Deepest retrieval fallback reached per query (main, ninja, partial)', ('depth',))
+candidates_per_level = registry.histogram('propertyfinder_candidates', 'Candidates ranked per level',
+                                          ('level',), COUNT_BUCKETS)
+
+
+class _NoTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_no_timer = _NoTimer()
+
+
+class _Timer(object):
+    __slots__ = ['stage', 'start']
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = perf_counter() - self.start
+        stage_seconds.observe(elapsed, self.stage)
+        if has_request_context():
+            timings = g.setdefault('server_timing', {})
+            timings[self.stage] = timings.get(self.stage, 0.0) + elapsed
+        return False
+
+
+def timed(stage):
+    ''' Context manager recording the time spent in a pipeline stage
+    '''
+    if not registry.enabled:
+        return _no_timer
+    return _Timer(stage)
+
+
+def count(counter, *labels, value=1):
+    if registry.enabled:
+        counter.inc(*labels, value=value)
+
+
+def observe(histogram, value, *labels):
+    if registry.enabled:
+        histogram.observe(value, *labels)
+
+
+bp = Blueprint('metrics', __name__)
+
+
+@bp.route('/metrics')
+def metrics():
+    return Response(registry.expose(), mimetype='text/plain; version=0.0.4')
+
+
+@bp.after_app_request
+def server_timing(response):
+    ''' Add the stage timings of the request as a Server-Timing header
+    '''
+    timings = g.get('server_timing')
+    if timings:
+        response.headers['Server-Timing'] = ', '.join(f'{stage};dur={seconds * 1000:.3f}'
+                                                      for stage, seconds in timings.items())
+    return response
@@ -0,0 +1,228 @@
+''' Query log and startup prewarming.
+
+    The log records normalized query signatures (the label and the parameters
+    of a /search query, in the form /search/batch accepts) and how often each
+    was asked. Counts are aggregated in memory and appended periodically as
+    JSON lines to a size-rotated file. Every worker appends to it: a lock on
+    path.lock lets one process at a time open the file, rotate it if it is
+    full, and write.
+
+    When a worker starts (on its first request with app.py, from the lifespan
+    event with api/asgi.py) it loads its data, then answers the most frequent
+    logged queries through search_many: this fills the result and remote caches
+    and opens the connections of the KGTK-search pool. /ready answers 503 until it
+    is done, so the load balancer only routes traffic to warmed workers.
+'''
+import atexit, fcntl, json, logging, os
+from collections import Counter
+from logging.handlers import RotatingFileHandler
+from threading import Event, Lock, Thread
+from time import time
+
+from .metrics import registry
+from .settings import QUERYLOG_path, QUERYLOG_max_bytes, QUERYLOG_backups, QUERYLOG_interval, PREWARM_size
+
+
+def signature(params, size, metadata):
+    ''' Normalized form of the query params: the type alias resolved, default
+        values dropped, and otherProperties sorted
+    '''
+    query = {'label': params['label'], 'size': size}
+    if params['type']:
+        query['data_type'] = metadata.get_type_alias(params['type'])
+    if params['scope'] != 'both':
+        query['scope'] = params['scope']
+    if not params['filter']:
+        query['filter'] = 'false'
+    if params['constraint']:
+        query['constraint'] = params['constraint']
+    other = sorted(set(p for p in params['otherProperties'].split(',') if p))
+    if other:
+        query['otherProperties'] = ','.join(other)
+    if params['extra_info']:
+        query['extra_info'] = 'true'
+    return json.dumps(query, sort_keys=True)
+
+
+class QueryLog(object):
+    ''' Counts of query signatures, flushed to path every interval seconds
+    '''
+
+    def __init__(self, path, max_bytes=QUERYLOG_max_bytes, backups=QUERYLOG_backups, interval=QUERYLOG_interval):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.interval = interval
+        self.counts = Counter()
+        self.recorded = 0
+        self._started = False
+        self._lock = Lock()
+        self._stop = Event()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def record(self, params, size, metadata):
+        with self._lock:
+            self.counts[signature(params, size, metadata)] += 1
+            self.recorded += 1
+
+    def flush(self):
+        ''' Append the counts gathered since the last flush
+        '''
+        with self._lock:
+            counts, self.counts = self.counts, Counter()
+        if not counts:
+            return
+        now = round(time())
+        with open(f'{self.path}.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Opened under the lock, so a rotation by another worker is seen here
+            handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backups, delay=True)
+            try:
+                for query, n in counts.most_common():
+                    handler.emit(logging.makeLogRecord({'msg': json.dumps({'time': now, 'query': query, 'count': n})}))
+            finally:
+                handler.close()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        Thread(target=self._run, name='query-log', daemon=True).start()
+        if not self._started:
+            atexit.register(self.flush)
+        self._started = True
+        return self
+
+    def _after_fork(self):
+        # The counts are the parent's to flush, and its flush thread does not survive the fork
+        self.counts = Counter()
+        self._lock = Lock()
+        self._stop = Event()
+        if self._started:
+            self.start()
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+    def top(self, n):
+        ''' The n most frequent queries of the log and its rotated files, most frequent first
+            Returns: List[dict], in the form of a /search/batch entry
+        '''
+        totals = Counter()
+        for name in [self.path] + [f'{self.path}.{i}' for i in range(1, self.backups + 1)]:
+            if not os.path.exists(name):
+                continue
+            with open(name) as fd:
+                for line in fd:
+                    try:
+                        entry = json.loads(line)
+                        totals[entry['query']] += entry['count']
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        return [json.loads(query) for query, _ in totals.most_common(n)]
+
+
+_query_log = None
+_query_log_lock = Lock()
+
+
+def _after_fork():
+    global _query_log_lock
+    _query_log_lock = Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def get_query_log(path=QUERYLOG_path):
+    ''' The process-wide QueryLog, None when the log is disabled
+    '''
+    global _query_log
+    if not path:
+        return None
+    if _query_log is None:
+        with _query_log_lock:
+            if _query_log is None:
+                _query_log = QueryLog(path).start()
+    return _query_log
+
+
+def record(finder, params, size):
+    ''' Log a query answered by finder, if the log is enabled
+    '''
+    log = get_query_log()
+    if log is not None:
+        log.record(params, size, finder.metadata)
+
+
+class Warmup(object):
+    ''' Loads the PropertyFinder, then answers the top logged queries with it,
+        in a background thread
+    '''
+
+    def __init__(self, size=PREWARM_size):
+        self.size = size
+        self.ready = False
+        self.queries = 0
+        self.duration = None
+        self.error = None
+        self._thread = None
+        self._load = None
+        self._lock = Lock()
+        # A worker forked before the warm up finished (gunicorn --preload)
+        # does not inherit the thread, so it starts its own
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def start(self, load):
+        ''' load: returns the PropertyFinder to warm up, e.g. PropertyFinder.shared
+        '''
+        with self._lock:
+            if self._thread is None:
+                self._load = load
+                self._thread = Thread(target=self._run, args=(load,), name='warmup', daemon=True)
+                self._thread.start()
+        return self
+
+    def _after_fork(self):
+        self._lock = Lock()
+        if self._thread is not None and not self.ready:
+            self._thread = None
+            self.start(self._load)
+
+    def _run(self, load):
+        start = time()
+        try:
+            finder = load()
+            # Starts the health checks of remote backends, whose first probe
+            # would otherwise delay a request
+            finder.backend.is_up()
+            log = get_query_log()
+            if log is not None and self.size > 0:
+                queries = log.top(self.size)
+                self.queries = len(queries)
+                if queries:
+                    finder.search_many(queries)
+        except Exception as e:
+            # A worker that could not warm up still serves, as a cold one would
+            self.error = repr(e)
+        finally:
+            self.duration = time() - start
+            self.ready = True
+
+    def stats(self):
+        return {'ready': self.ready, 'prewarmed_queries': self.queries, 'duration': self.duration,
+                'error': self.error}
+
+
+warmup = Warmup()
+
+
+@registry.collector
+def _warmup_metrics():
+    yield ('propertyfinder_ready', 'gauge', 'Whether the worker finished warming up', [({}, int(warmup.ready))])
+    log = _query_log
+    if log is not None:
+        yield ('propertyfinder_logged_queries_total', 'counter', 'Queries recorded in the query log',
+               [({}, log.recorded)])
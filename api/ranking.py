@@ -1,61 +1,87 @@
 import numpy as np
-import pandas as pd
 from collections import defaultdict
-from difflib import SequenceMatcher
-from .settings import FILE_claims_count, FILE_qualifiers_count, FILE_total_count
+from .metrics import timed
+from .records import load_store
+from .settings import RANK_similarity
+from .similarity import NameMatrix, exact_similarity, load_matrix
 
 
-class PropertyRanker(object):
-
-    def __init__(self):
-        ''' table_counts: stores the number of main values, qualifiers, and reference counts '''
-        self.table_counts = self._build_table()
-
-    def _build_table(self):
+def top_k(scores, k=None):
+    ''' Indices of the k highest scores, highest first, ties in input order
+        (the order of a stable sort). Avoids a full sort when k is small.
+    '''
+    if k is None or k >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    kth = np.partition(-scores, k - 1)[k - 1]
+    selected = np.nonzero(-scores <= kth)[0]
+    return selected[np.argsort(-scores[selected], kind='stable')][:k]
 
-        claims_counts = pd.read_csv(FILE_claims_count, sep='\t', usecols=['node1', 'node2']).set_index('node1')
-        claims_counts.columns = [['main value']]
 
-        qualifier_counts = pd.read_csv(FILE_qualifiers_count, sep='\t', usecols=['node1', 'node2']).set_index('node1')
-        qualifier_counts.columns = [['qualifier']]
-
-        total_counts = pd.read_csv(FILE_total_count, sep='\t', usecols=['node1', 'node2']).set_index('node1')
-        total_counts.columns = [['total']]
-
-        glossory = pd.concat([claims_counts, qualifier_counts, total_counts], axis=1).fillna(0).astype(int)
-        glossory.columns = [x[0] for x in glossory]
-        glossory['both'] = glossory['main value'] + glossory['qualifier']
+class PropertyRanker(object):
 
-        glossory['p:main_value'] = glossory['main value'] / glossory['both']
-        glossory['p:qualifier'] = 1.0 - glossory['p:main_value']
+    def __init__(self, similarity=RANK_similarity, store=None):
+        ''' store: holds the number of main values, qualifiers, and total counts of each property,
+                   the process-wide store by default
+            log_counts: log(count + 1) of each scope, aligned with the store ids
+            similarity: 'exact' for difflib ratios, 'ngram' for the vectorized bigram approximation
+        '''
+        self.store = store if store is not None else self._build_table()
+        self.log_counts = {scope: np.log(counts + 1) for scope, counts in self.store.counts.items()}
+        self.similarity = similarity
+        self.matrix = None
+        if similarity == 'ngram':
+            self.matrix = load_matrix() if store is None else NameMatrix(store)
 
-        return glossory
+    def _build_table(self):
+        return load_store()
 
     def gen_counts(self, pnodes, scope='both'):
         counts = defaultdict(int)
         for node in pnodes:
             try:
-                counts[node] = int(self.table_counts.loc[node][scope])
+                counts[node] = self.store.count(node, scope)
             except KeyError:
                 counts[node] = 0
         return counts
 
-    def gen_similarity(self, pnodes, query, metadata):
-        sim = defaultdict(float)
+    def gen_weights(self, pnodes, scope='both'):
+        ''' log(count + 1) of each pnode, 0 for unknown pnodes or scopes
+        '''
+        if not scope in self.log_counts:
+            return np.zeros(len(pnodes), dtype=np.float64)
+        ids = np.array([self.store.ids.get(node, -1) for node in pnodes], dtype=np.int64)
+        known = (ids >= 0) & (self.store.has_counts[np.maximum(ids, 0)] > 0)
+        return np.where(known, self.log_counts[scope][np.maximum(ids, 0)], 0.0)
+
+    def _similarity(self, pnodes, query, metadata):
+        if self.similarity == 'ngram':
+            ids = [self.store.ids[node] if metadata.check_property_exists(node) else -1 for node in pnodes]
+            return self.matrix.score(query, ids)
+
+        names_of = []
         for node in pnodes:
             try:
-                sim[node] = np.max([SequenceMatcher(None, query, n).ratio() for n in metadata.get_names(node)])
+                names_of.append(list(metadata.get_names(node)))
             except KeyError:
-                sim[node] = 0.0
-        return sim
-
-    def rank(self, pnodes, query, metadata, scope='both'):
+                names_of.append(None)
+        return np.array(exact_similarity(query, names_of), dtype=np.float64)
 
-        ranking = defaultdict(float)
-        counts = self.gen_counts(pnodes, scope)
-        sim = self.gen_similarity(pnodes, query, metadata)
-
-        for pnode in pnodes:
-            ranking[pnode] = sim[pnode] * np.log(counts[pnode] + 1)
-
-        return dict(sorted(ranking.items(), key=lambda x: x[1], reverse=True))
+    def gen_similarity(self, pnodes, query, metadata):
+        return defaultdict(float, zip(pnodes, self._similarity(pnodes, query, metadata).tolist()))
+
+    def rank(self, pnodes, query, metadata, scope='both', size=None, weights=None):
+        ''' Score pnodes by similarity * log(count + 1), highest first.
+            With size, only the size best are returned.
+            weights: optional Dict[pnode, float] of factors applied to the scores
+        '''
+        pnodes = list(dict.fromkeys(pnodes))
+        if not pnodes:
+            return {}
+
+        with timed('rank'):
+            scores = self._similarity(pnodes, query, metadata) * self.gen_weights(pnodes, scope)
+            if weights:
+                scores *= np.array([weights.get(pnode, 1.0) for pnode in pnodes])
+            return {pnodes[i]: scores[i] for i in top_k(scores, size)}
@@ -0,0 +1,176 @@
+import math
+import numpy as np
+from collections import defaultdict
+from threading import Lock
+
+from .snapshot import compile_tables, load_snapshot, C_PRESENT, C_NOITEM, C_SCOPE, C_SCOPE_V, C_SCOPE_Q, \
+    C_SCOPE_R, C_SCOPE_MAN, C_ALLOWED, C_REQUIRED, C_CONFLICTS, CONSTRAINT_LISTS
+
+
+class PropertyRecord(object):
+    ''' Names and datatype of a single property, decoded from the string pools
+    '''
+    __slots__ = ['id', 'pnode', 'label', 'alias', 'description', 'data_type']
+
+    def __init__(self, id, pnode, label, alias, description, data_type):
+        self.id = id
+        self.pnode = pnode
+        self.label = label
+        self.alias = alias
+        self.description = description
+        self.data_type = data_type
+
+
+class PropertyStore(object):
+    ''' Dense integer id per pnode, with array-backed counts / pagerank columns
+        and PropertyRecords decoded on first use.
+        The arrays come either from the binary snapshot (shared through mmap),
+        or are compiled from the files under data/ at startup.
+    '''
+
+    def __init__(self, header, arrays):
+        self.header = header
+        self.arrays = arrays
+        self.fingerprint = header['fingerprint']
+        self.datatypes = header['datatypes']
+
+        self.pnodes = self.strings('pnode')
+        self.ids = {p: i for i, p in enumerate(self.pnodes)}
+        self._records = [None] * len(self.pnodes)
+
+        self.has_names = arrays['has_names']
+        self.has_counts = arrays['has_counts']
+        self.has_metadata = arrays['has_metadata']
+        self.pagerank = arrays['pagerank']
+        self.statements = arrays['statements']
+        self.counts = {'main value': arrays['count_main_value'],
+                       'qualifier': arrays['count_qualifier'],
+                       'total': arrays['count_total'],
+                       'both': arrays['count_main_value'] + arrays['count_qualifier']}
+
+    def __len__(self):
+        return len(self.pnodes)
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def strings(self, pool, first=0, last=None):
+        ''' Decode entries [first, last) of a string pool
+        '''
+        data = self.arrays[f'{pool}_pool']
+        offsets = self.arrays[f'{pool}_offsets']
+        if last is None:
+            last = len(offsets) - 1
+        raw = bytes(data[offsets[first]:offsets[last]])
+        base = offsets[first]
+        return [raw[offsets[i] - base:offsets[i + 1] - base].decode('utf-8') for i in range(first, last)]
+
+    def grouped(self, pool, i):
+        ''' All the entries of a grouped pool (label/alias) belonging to id i
+        '''
+        index = self.arrays[f'{pool}_index']
+        return self.strings(pool, index[i], index[i + 1])
+
+    def neighbors(self, name, i):
+        offsets = self.arrays[f'{name}_offsets']
+        return self.arrays[f'{name}_targets'][offsets[i]:offsets[i + 1]]
+
+    def id(self, pnode):
+        ''' Id of a property with names, KeyError otherwise
+        '''
+        i = self.ids[pnode]
+        if not self.has_names[i]:
+            raise KeyError(pnode)
+        return i
+
+    def record(self, pnode, cache=True):
+        ''' The PropertyRecord of pnode, KeyError if the property is unknown
+            cache: keep the decoded record; a pass over all the properties
+                   (building an index) should not, or every record stays resident
+        '''
+        i = self.id(pnode)
+        record = self._records[i]
+        if record is None:
+            record = self._decode(i)
+            if cache:
+                self._records[i] = record
+        return record
+
+    def _decode(self, i):
+        description = self.strings('description', i, i + 1)[0] if self.arrays['has_description'][i] else math.nan
+        code = int(self.arrays['datatype'][i])
+        data_type = self.datatypes[code] if code >= 0 else math.nan
+        return PropertyRecord(i, self.pnodes[i], tuple(self.grouped('label', i)), tuple(self.grouped('alias', i)),
+                              description, data_type)
+
+    def count(self, pnode, scope='both'):
+        ''' Number of statements of pnode in the given scope, KeyError if unknown
+        '''
+        i = self.ids[pnode]
+        if not self.has_counts[i]:
+            raise KeyError(pnode)
+        return int(self.counts[scope][i])
+
+    def remote_metadata(self, pnode):
+        ''' (pagerank, statements) fetched from the remote index, KeyError if unknown
+        '''
+        i = self.ids[pnode]
+        if not self.has_metadata[i]:
+            raise KeyError(pnode)
+        return float(self.pagerank[i]), int(self.statements[i])
+
+    def to_constraints(self):
+        ''' Rebuild the part of constraints.json used for filtering
+        '''
+        constraints = {}
+        flags = self.arrays['constraint_flags']
+        for i in np.nonzero(flags & C_PRESENT)[0]:
+            f = int(flags[i])
+            info = {}
+            if f & C_SCOPE:
+                info['scope'] = [s for s, bit in (('V', C_SCOPE_V), ('Q', C_SCOPE_Q), ('R', C_SCOPE_R)) if f & bit]
+            if f & C_SCOPE_MAN:
+                info['scope_man'] = True
+            if f & C_NOITEM:
+                info['noitem'] = True
+            for key, bit in zip(CONSTRAINT_LISTS, (C_ALLOWED, C_REQUIRED, C_CONFLICTS)):
+                if f & bit:
+                    info[key] = [self.pnodes[j] for j in self.neighbors(key, i)]
+            constraints[self.pnodes[i]] = info
+        return constraints
+
+    def to_relation(self, relation):
+        ''' Rebuild the map X -> [Y] for relation R (X R Y)
+        '''
+        offsets = self.arrays[f'{relation}_offsets']
+        targets = self.arrays[f'{relation}_targets']
+        pr_dict = defaultdict(list)
+        for i in np.nonzero(np.diff(offsets))[0]:
+            pr_dict[self.pnodes[i]] = [self.pnodes[j] for j in targets[offsets[i]:offsets[i + 1]]]
+        return pr_dict
+
+
+_store = None
+_store_lock = Lock()
+
+
+def build_store(fresh=False):
+    ''' A PropertyStore mapped from the snapshot when it is present and up to
+        date, compiled from data/ otherwise. With fresh, the snapshot and the
+        files under data/ are read again instead of reusing the opened snapshot.
+    '''
+    snapshot = load_snapshot(fresh=fresh)
+    if snapshot is not None:
+        return PropertyStore(snapshot.header, snapshot.arrays)
+    return PropertyStore(*compile_tables())
+
+
+def load_store():
+    ''' The process-wide PropertyStore, built on first use
+    '''
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = build_store()
+    return _store
@@ -0,0 +1,83 @@
+import numpy as np
+
+from .settings import RELATIONS
+
+
+class RelationIndex(object):
+    ''' The relations between properties as a single CSR adjacency over store ids:
+        the edges of id i are targets[offsets[i]:offsets[i + 1]], grouped by
+        relation in the order of RELATIONS (then in file order), and tags[e] is
+        the position in RELATIONS of the relation of edge e.
+    '''
+
+    def __init__(self, store, relations=RELATIONS):
+        self.store = store
+        self.relations = relations
+
+        n = len(store)
+        sources, targets, tags = [], [], []
+        for tag, relation in enumerate(relations):
+            offsets = store[f'{relation}_offsets']
+            sources.append(np.repeat(np.arange(n, dtype=np.int64), np.diff(offsets)))
+            targets.append(np.asarray(store[f'{relation}_targets'], dtype=np.int32))
+            tags.append(np.full(len(targets[-1]), tag, dtype=np.int8))
+        sources = np.concatenate(sources)
+        order = np.argsort(sources, kind='stable')
+
+        self.offsets = np.zeros(n + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(np.bincount(sources, minlength=n))
+        self.targets = np.concatenate(targets)[order]
+        self.tags = np.concatenate(tags)[order]
+        self._groups = {}
+
+    def group(self, tags):
+        ''' (offsets, targets) of the sub-adjacency restricted to the relations in tags
+        '''
+        key = tuple(sorted(tags))
+        if key not in self._groups:
+            selected = np.zeros(len(self.relations), dtype=bool)
+            selected[list(key)] = True
+            keep = selected[self.tags]
+            n = len(self.offsets) - 1
+            sources = np.repeat(np.arange(n), np.diff(self.offsets))
+            offsets = np.zeros(n + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(np.bincount(sources[keep], minlength=n))
+            self._groups[key] = (offsets, self.targets[keep])
+        return self._groups[key]
+
+    def ids(self, pnodes):
+        ''' Store ids of pnodes, -1 for unknown ones
+        '''
+        ids = self.store.ids
+        return np.array([ids.get(pnode, -1) for pnode in pnodes], dtype=np.int64)
+
+    def neighbors(self, ids, tags):
+        ''' Targets of the edges of ids whose relation is in tags, in the order
+            of the concatenated adjacency lists (source by source)
+        '''
+        offsets, targets = self.group(tags)
+        ids = ids[ids >= 0]
+        first = offsets[ids]
+        sizes = offsets[ids + 1] - first
+        ends = np.cumsum(sizes)
+        if len(ends) == 0 or ends[-1] == 0:
+            return targets[:0]
+        return targets[np.repeat(first - ends + sizes, sizes) + np.arange(ends[-1])]
+
+    def expand(self, ids, tags, seen, depth=1):
+        ''' Properties reachable from ids within depth hops along the relations in tags,
+            excluding (and adding to) the boolean mask seen
+            Returns: List[np.ndarray], the new ids of each hop in order of first occurrence
+        '''
+        hops = []
+        frontier = ids
+        for _ in range(depth):
+            reached = self.neighbors(frontier, tags)
+            reached = reached[~seen[reached]]
+            if len(reached) == 0:
+                break
+            _, first = np.unique(reached, return_index=True)
+            frontier = reached[np.sort(first)].astype(np.int64)
+            seen[frontier] = True
+            hops.append(frontier)
+        return hops
@@ -0,0 +1,195 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .cache import TTLCache
+from .metrics import registry, count, remote_calls
+from .settings import REMOTE_timeout, REMOTE_retries, REMOTE_pool_size, REMOTE_cache_size, REMOTE_cache_ttl, \
+    REMOTE_health_interval, REMOTE_failure_threshold
+
+
+def normalize(term):
+    ''' Cache key form of a query term: lower case, single spaces
+    '''
+    return ' '.join(term.lower().split())
+
+
+class CircuitBreaker(object):
+    ''' Cached up/down state of the remote service.
+        The first check probes synchronously (in the background when it
+        must not block), then a daemon thread refreshes the state every
+        interval seconds; consecutive query failures open
+        the breaker until the next successful probe.
+        A forked process starts over, with its own refresh thread.
+    '''
+
+    def __init__(self, probe, interval=REMOTE_health_interval, threshold=REMOTE_failure_threshold):
+        self.probe = probe
+        self.interval = interval
+        self.threshold = threshold
+
+        self.probes = 0
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # The refresh thread of the parent, and a lock it may have held, do not survive a fork
+        self.up = True
+        self.failures = 0
+        self._started = False
+        self._lock = Lock()
+        self._stop = Event()
+
+    def _refresh(self):
+        try:
+            up = self.probe() < 500
+        except Exception:
+            up = False
+        self.probes += 1
+        self.up = up
+        if up:
+            self.failures = 0
+
+    def _run(self, probe):
+        if probe:
+            self._refresh()
+        while not self._stop.wait(self.interval):
+            self._refresh()
+
+    def allow(self, block=True):
+        ''' Whether the remote is considered up.
+            Without block, the first check never waits for a probe: the
+            remote is considered up until the refresh thread probed it.
+        '''
+        if not self._started and self._lock.acquire(blocking=block):
+            try:
+                if not self._started:
+                    if block:
+                        self._refresh()
+                    Thread(target=self._run, args=(not block,), name='kgtk-health', daemon=True).start()
+                    self._started = True
+            finally:
+                self._lock.release()
+        return self.up
+
+    def record_success(self):
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.up = False
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {'up': self.up, 'failures': self.failures, 'probes': self.probes}
+
+
+class RemoteSearch(object):
+    ''' Client of the KGTK-search API over a pooled keep-alive session,
+        with a timeout and retries on connection errors and 5xx responses.
+        Responses are cached per normalized term and query parameters.
+        A forked process opens its own connections and threads.
+    '''
+
+    def __init__(self, host, timeout=REMOTE_timeout, retries=REMOTE_retries, pool_size=REMOTE_pool_size,
+                 cache_size=REMOTE_cache_size, cache_ttl=REMOTE_cache_ttl):
+        self.host = host
+        self.timeout = timeout
+        self.retries = retries
+        self.pool_size = pool_size
+
+        self._connect()
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self.breaker = CircuitBreaker(self.ping)
+        os.register_at_fork(after_in_child=self._connect)
+
+    def _connect(self):
+        retry = Retry(total=self.retries, backoff_factor=0.1, status_forcelist=[502, 503, 504],
+                      allowed_methods=['GET'], raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+        self.session = Session()
+        self.session.verify = False
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='kgtk-search')
+
+    def url(self, term, size, extra_info=True):
+        return (f'{self.host}/{term}?{"extra_info=true&" if extra_info else ""}language=en&item=property'
+                f'&type=ngram&size={size}&instance_of=')
+
+    def get(self, term, size, extra_info=True):
+        return self.session.get(self.url(term, size, extra_info), timeout=self.timeout)
+
+    def search(self, term, size, extra_info=True):
+        ''' qnodes of the properties matching term
+        '''
+        key = (normalize(term), size, extra_info)
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+
+        count(remote_calls, 'search')
+        try:
+            response = self.get(term, size, extra_info)
+            result = tuple(x['qnode'] for x in response.json())
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+
+        self.cache.set(key, result)
+        return result
+
+    def search_many(self, terms, size, extra_info=True):
+        ''' Issue independent queries concurrently, results in the order of terms
+        '''
+        return list(self.executor.map(lambda term: self.search(term, size, extra_info), terms))
+
+    def ping(self):
+        ''' Status code of a minimal query, used to check the remote is running
+        '''
+        count(remote_calls, 'health')
+        return self.get('time', 1).status_code
+
+    def is_up(self, block=True):
+        return self.breaker.allow(block)
+
+    def stats(self):
+        return {'host': self.host, 'cache': self.cache.stats(), 'health': self.breaker.stats()}
+
+
+_clients = {}
+_clients_lock = Lock()
+
+
+def get_client(host):
+    ''' One RemoteSearch (and connection pool) per host, shared in the process
+    '''
+    if host not in _clients:
+        with _clients_lock:
+            if host not in _clients:
+                _clients[host] = RemoteSearch(host)
+    return _clients[host]
+
+
+def client_stats():
+    return [client.stats() for client in list(_clients.values())]
+
+
+@registry.collector
+def _client_metrics():
+    clients = list(_clients.values())
+    yield ('propertyfinder_remote_cache_hits_total', 'counter', 'Responses served from the remote query cache',
+           [({'host': c.host}, c.cache.hits) for c in clients])
+    yield ('propertyfinder_remote_cache_misses_total', 'counter', 'Remote query cache misses',
+           [({'host': c.host}, c.cache.misses) for c in clients])
+    yield ('propertyfinder_remote_up', 'gauge', 'Whether the remote is considered up by the circuit breaker',
+           [({'host': c.host}, int(c.breaker.up)) for c in clients])
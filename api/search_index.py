@@ -0,0 +1,84 @@
+import numpy as np
+from collections import defaultdict
+from threading import Lock
+
+from .records import load_store
+
+
+class NgramIndex(object):
+    ''' In-process replacement for the KGTK ngram search over property names.
+        Every label and alias is split into character n-grams; a query scores
+        each name by the Dice coefficient of their n-gram sets, and a property
+        takes the best score over its names.
+    '''
+
+    def __init__(self, store, n=3, min_score=0.3):
+        self.store = store
+        self.n = n
+        self.min_score = min_score
+
+        name_pnode = []
+        name_size = []
+        postings = defaultdict(list)
+        for i, pnode in enumerate(store.pnodes):
+            if not store.has_names[i]:
+                continue
+            record = store.record(pnode, cache=False)
+            for name in set(record.label + record.alias):
+                grams = self.grams(name)
+                if not grams:
+                    continue
+                for gram in grams:
+                    postings[gram].append(len(name_pnode))
+                name_pnode.append(i)
+                name_size.append(len(grams))
+
+        self.postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self.name_pnode = np.array(name_pnode, dtype=np.int32)
+        self.name_size = np.array(name_size, dtype=np.float64)
+
+    def grams(self, text):
+        text = f' {text.lower().strip()} '
+        return set(text[i:i + self.n] for i in range(len(text) - self.n + 1))
+
+    def scores(self, query):
+        ''' Best Dice score of every property for the query string (len(store))
+        '''
+        grams = [gram for gram in self.grams(query) if gram in self.postings]
+        scores = np.zeros(len(self.store), dtype=np.float64)
+        if not grams:
+            return scores
+
+        overlap = np.bincount(np.concatenate([self.postings[gram] for gram in grams]),
+                              minlength=len(self.name_pnode))
+        hit = np.nonzero(overlap)[0]
+        dice = 2.0 * overlap[hit] / (len(self.grams(query)) + self.name_size[hit])
+        np.maximum.at(scores, self.name_pnode[hit], dice)
+        return scores
+
+    def search(self, query, size=500, mask=None):
+        ''' Return up to size pnodes matching the query, best first
+            mask: optional boolean array over the store ids, only these properties are returned
+        '''
+        scores = self.scores(query)
+        hit = scores >= self.min_score
+        if mask is not None:
+            hit &= mask
+        hit = np.nonzero(hit)[0]
+        order = hit[np.argsort(-scores[hit], kind='stable')][:size]
+        return [self.store.pnodes[i] for i in order]
+
+
+_index = None
+_index_lock = Lock()
+
+
+def load_index():
+    ''' The process-wide NgramIndex over the property store
+    '''
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = NgramIndex(load_store())
+    return _index
@@ -0,0 +1,308 @@
+''' Annotation sessions: the context of a table whose columns are annotated
+    one after the other.
+
+    A session holds the settings shared by the columns of the table (scope,
+    filter, constraint), and for each column submitted its candidates as
+    find_property ranks them without otherProperties, along with the property
+    chosen for it. The suggestions of a column are those candidates without
+    the ones conflicting with the properties chosen for the other columns:
+    the list /search returns with those properties as otherProperties.
+
+    The scores do not depend on otherProperties and the conflict filter only
+    removes candidates, so choosing a property never ranks anything again: it
+    only re-filters the columns holding candidates which conflict with it, or
+    with the property it replaces.
+
+    A session answers from the data generation it was created with. Sessions
+    expire SESSION_ttl seconds after their last use, and the least recently
+    used are dropped beyond SESSION_max.
+
+    Sessions live in the memory of the worker process which created them, and
+    their ids start with its pid: with several workers, the requests of a
+    session must be routed to the same one (sticky routing), and a request
+    reaching another worker is told so.
+'''
+import os
+from threading import Lock
+from uuid import uuid4
+
+from flask import Blueprint, request
+
+from .cache import TTLCache
+from .metrics import registry, count, timed, requests_total
+from .PropertyFinder2 import PropertyFinder
+from .settings import BATCH_max_size, SESSION_max, SESSION_ttl
+
+
+class Column(object):
+    ''' A column of a session: its query, its ranked candidates before the
+        conflict filter, and the property chosen for it
+    '''
+
+    def __init__(self, params, size, ranked):
+        self.label = params['label']
+        self.type = params['type']
+        self.size = size
+        self.extra_info = params['extra_info']
+        self.ranked = ranked
+        self.pnodes = frozenset(pnode for pnode, _ in ranked)
+        self.property = None
+        # The candidates left by the conflict filter, None until computed
+        self.filtered = None
+
+
+class TableSession(object):
+    ''' The columns of a table annotated with the same scope, filter and constraint
+    '''
+
+    def __init__(self, finder, scope='both', filter='true', constraint=None, otherProperties=''):
+        ''' otherProperties: comma separated properties of the table which are not
+                             among its columns, excluded from every column's conflicts
+        '''
+        self.finder = finder
+        self.settings = {'scope': scope, 'filter': str(filter), 'constraint': constraint}
+        self.other = [pnode for pnode in otherProperties.split(',') if pnode]
+        self.columns = {}
+        self.refiltered = 0
+        self._lock = Lock()
+
+    def add_columns(self, columns):
+        ''' Rank the candidates of columns, a list of dicts with the label,
+            data_type, size and extra_info parameters of /search, and optionally
+            a column name (its position in the session by default).
+            Candidate retrieval runs once per distinct label, as in search_many.
+            A column whose candidates cannot be retrieved is not added, and
+            gets {'Error': ...} instead of its suggestions.
+            Returns: Dict[name, suggestions], or (error, status code)
+        '''
+        finder = self.finder
+        parsed = []
+        with self._lock:
+            for i, column in enumerate(columns):
+                name = str(column.get('column', len(self.columns) + i))
+                params, size, error = finder._parse_args(dict(column, **self.settings))
+                if error is not None:
+                    return error
+                parsed.append((name, params, size))
+
+        retrieved = finder._retrieve_many(finder._retrieval_key(params) for _, params, _ in parsed)
+        ranked = {}
+        failed = {}
+        for name, params, size in parsed:
+            try:
+                matches = retrieved[finder._retrieval_key(params)]
+                if isinstance(matches, Exception):
+                    raise matches
+                levels = finder.find_property(params['label'], dict(params, otherProperties=''), retrieved=matches)
+            except Exception as e:
+                failed[name] = {'Error': repr(e)}
+                continue
+            ranked[name] = Column(params, size, [(pnode, float(score)) for candidates in levels.values()
+                                                 for pnode, score in candidates.items()])
+
+        with self._lock:
+            for name, column in ranked.items():
+                replaced = self.columns.get(name)
+                if replaced is not None and replaced.property is not None:
+                    self._choose(name, replaced, None)
+                self.columns[name] = column
+            return {name: failed[name] if name in failed else self._suggestions(name) for name, _, _ in parsed}
+
+    def suggestions(self, name):
+        ''' The candidates of column name, in the format of /search
+        '''
+        with self._lock:
+            return self._suggestions(name)
+
+    def _suggestions(self, name):
+        column = self.columns[name]
+        if column.filtered is None:
+            with timed('session_filter'):
+                disallowed = self._disallowed(name)
+                column.filtered = [x for x in column.ranked if x[0] not in disallowed]
+                self.refiltered += 1
+        metadata = self.finder.metadata
+        return [metadata.get_info(pnode, score, column.extra_info) for pnode, score in column.filtered[:column.size]]
+
+    def _disallowed(self, name):
+        ''' Properties conflicting with the table, other than column name
+        '''
+        if self.settings['filter'].lower() != 'true':
+            return set()
+        chosen = self.other + [column.property for other, column in self.columns.items()
+                               if other != name and column.property is not None]
+        return self.finder.constraint_table.disallowed(','.join(chosen))
+
+    def choose(self, name, pnode):
+        ''' Set the property of column name (None to clear it)
+            Returns: the names of the columns whose suggestions changed
+        '''
+        with self._lock:
+            return self._choose(name, self.columns[name], pnode)
+
+    def _choose(self, name, column, pnode):
+        conflicts = self.finder.constraint_table.conflicts
+        changed = conflicts.get(column.property, frozenset()) | conflicts.get(pnode, frozenset())
+        column.property = pnode
+
+        affected = []
+        for other, candidates in self.columns.items():
+            if other != name and not candidates.pnodes.isdisjoint(changed):
+                candidates.filtered = None
+                affected.append(other)
+        return affected
+
+    def describe(self):
+        with self._lock:
+            return {'generation': self.finder.generation.version,
+                    'scope': self.settings['scope'], 'filter': self.settings['filter'].lower() == 'true',
+                    'constraint': self.settings['constraint'], 'otherProperties': ','.join(self.other),
+                    'columns': {name: {'label': column.label, 'data_type': column.type, 'property': column.property}
+                                for name, column in self.columns.items()}}
+
+
+class SessionStore(object):
+    ''' The TableSessions of this process, by id
+    '''
+
+    def __init__(self, maxsize=SESSION_max, ttl=SESSION_ttl):
+        self.sessions = TTLCache(maxsize, ttl)
+        self.created = 0
+
+    def create(self, finder, **settings):
+        session_id = f'{os.getpid()}-{uuid4().hex}'
+        self.sessions.set(session_id, TableSession(finder, **settings))
+        self.created += 1
+        return session_id
+
+    def get(self, session_id):
+        ''' The session, None when it is unknown or expired.
+            Using a session delays its expiry.
+        '''
+        session = self.sessions.get(session_id)
+        if session is not None:
+            self.sessions.set(session_id, session)
+        return session
+
+    def delete(self, session_id):
+        return self.sessions.pop(session_id) is not None
+
+    def stats(self):
+        return dict(self.sessions.stats(), created=self.created)
+
+
+sessions = SessionStore()
+
+
+@registry.collector
+def _session_metrics():
+    yield ('propertyfinder_sessions', 'gauge', 'Annotation sessions held', [({}, len(sessions.sessions))])
+    yield ('propertyfinder_sessions_created_total', 'counter', 'Annotation sessions created',
+           [({}, sessions.created)])
+
+
+bp = Blueprint('sessions', __name__)
+
+UNKNOWN_column = {'Error': 'Unknown column'}, 404
+
+
+def unknown_session(session_id):
+    worker = session_id.split('-', 1)[0]
+    if worker.isdigit() and int(worker) != os.getpid():
+        return {'Error': f'Session {session_id} belongs to worker {worker}, this is worker {os.getpid()}: '
+                         'sessions are held by the worker process which created them, so the requests of a '
+                         'session must all reach it (run one worker, or route them with sticky sessions)'}, 404
+    return {'Error': 'Unknown or expired session'}, 404
+
+
+@bp.route('/sessions', methods=['POST'])
+def create_session():
+    ''' Create the context of a table: the JSON body may set its scope, filter,
+        constraint and otherProperties
+    '''
+    count(requests_total, 'session')
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return {'Error': 'The request body must be a JSON object'}, 400
+    other = body.get('otherProperties', '')
+    if isinstance(other, list):
+        other = ','.join(other)
+
+    session_id = sessions.create(PropertyFinder.shared(), scope=body.get('scope', 'both'),
+                                 filter=body.get('filter', 'true'), constraint=body.get('constraint'),
+                                 otherProperties=other)
+    return dict(sessions.get(session_id).describe(), session=session_id), 201
+
+
+@bp.route('/sessions/<session_id>')
+def get_session(session_id):
+    session = sessions.get(session_id)
+    if session is None:
+        return unknown_session(session_id)
+    return dict(session.describe(), session=session_id)
+
+
+@bp.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    if not sessions.delete(session_id):
+        return unknown_session(session_id)
+    return {'deleted': session_id}
+
+
+@bp.route('/sessions/<session_id>/columns', methods=['POST'])
+def add_columns(session_id):
+    ''' Submit columns: the JSON body is a list of columns, or {"columns": [...]},
+        each with the parameters of /search and an optional column name.
+        Returns the suggestions of each column, by name.
+    '''
+    count(requests_total, 'session_columns')
+    session = sessions.get(session_id)
+    if session is None:
+        return unknown_session(session_id)
+    body = request.get_json(silent=True)
+    if isinstance(body, dict):
+        body = body.get('columns')
+    if not isinstance(body, list) or not all(isinstance(column, dict) for column in body):
+        return {'Error': 'The request body must be a JSON list of columns'}, 400
+    if len(body) > BATCH_max_size:
+        return {'Error': f'At most {BATCH_max_size} columns are allowed per request'}, 400
+    # Check remote is running
+    if not session.finder.backend.is_up():
+        return {'Error': 'Remote service for querying properties is down.'}, 500
+
+    with timed('total'):
+        return session.add_columns(body)
+
+
+@bp.route('/sessions/<session_id>/columns/<name>')
+def column_suggestions(session_id, name):
+    ''' The suggestions of a column, given the properties chosen for the others
+    '''
+    count(requests_total, 'session_suggestions')
+    session = sessions.get(session_id)
+    if session is None:
+        return unknown_session(session_id)
+    try:
+        return session.suggestions(name)
+    except KeyError:
+        return UNKNOWN_column
+
+
+@bp.route('/sessions/<session_id>/columns/<name>/property', methods=['PUT', 'DELETE'])
+def choose_property(session_id, name):
+    ''' Choose the property of a column ({"property": "P..."}), or clear it with DELETE.
+        Returns the columns whose suggestions changed.
+    '''
+    session = sessions.get(session_id)
+    if session is None:
+        return unknown_session(session_id)
+    pnode = None
+    if request.method == 'PUT':
+        body = request.get_json(silent=True)
+        pnode = body.get('property') if isinstance(body, dict) else None
+        if not isinstance(pnode, str) or not session.finder.metadata.check_property_exists(pnode):
+            return {'Error': 'property must be the id of a known property'}, 400
+    try:
+        return {'column': name, 'property': pnode, 'affected': session.choose(name, pnode)}
+    except KeyError:
+        return UNKNOWN_column
@@ -1,3 +1,5 @@
+import os
+
 FILE_label = 'data/labels.property.en.tsv.gz'
 FILE_alias = 'data/aliases.property.en.tsv.gz'
 FILE_description = 'data/descriptions.property.en.tsv.gz'
@@ -9,6 +11,112 @@ FILE_total_count = 'data/all.label.property.counts.tsv.gz'
 
 FILE_claims_property = 'data/claims.properties.tsv.gz'
 FILE_metadata = 'data/metadata.json'
+FILE_snapshot = 'data/snapshot.bin'
 
 JSON_constraints = 'data/constraints.json'
 KGTK_search = 'https://kgtk.isi.edu/api'
+
+# Candidate retrieval backend: a KGTK-search URL, or LOCAL_search for the
+# in-process ngram index over the property labels and aliases. A comma separated
+# list of those, each optionally followed by @<deadline in ms>, is tried in order
+# (api/backends.py), e.g. 'https://mirror/api@300,https://kgtk.isi.edu/api,local'
+LOCAL_search = 'local'
+SEARCH_host = os.environ.get('PROPERTY_FINDER_HOST', KGTK_search)
+
+# Backend lists: seconds after which the next backend is also queried while the
+# previous has not answered (None: only once it failed), and the default deadline
+# of each backend (None: its client timeout)
+SEARCH_hedge = os.environ.get('PROPERTY_FINDER_HEDGE_MS')
+SEARCH_hedge = float(SEARCH_hedge) / 1000 if SEARCH_hedge else None
+SEARCH_deadline = os.environ.get('PROPERTY_FINDER_DEADLINE_MS')
+SEARCH_deadline = float(SEARCH_deadline) / 1000 if SEARCH_deadline else None
+
+# KGTK-search client: (connect, read) timeout in seconds, retries on
+# connection errors / 5xx, and size of the connection and fan-out pools
+REMOTE_timeout = (3.05, 10)
+REMOTE_retries = 2
+REMOTE_pool_size = 16
+
+# Cache of KGTK-search responses, keyed on the normalized term and query
+# parameters: maximum number of entries and time to live in seconds
+REMOTE_cache_size = 10000
+REMOTE_cache_ttl = 3600
+
+# Circuit breaker replacing the per-request health probe: the remote is
+# probed in the background every REMOTE_health_interval seconds, and is
+# considered down after REMOTE_failure_threshold consecutive failed queries
+REMOTE_health_interval = 30
+REMOTE_failure_threshold = 5
+
+# Opt-in cache of ranked candidate lists in generate_top_candidates:
+# '' disables it, 'memory' keeps it in process, any other value is the path
+# of a sqlite file backing the in-process cache across restarts
+RESULT_cache = os.environ.get('PROPERTY_FINDER_RESULT_CACHE', '')
+RESULT_cache_bytes = 64 * 2 ** 20
+# sqlite backing: at most RESULT_cache_rows rows, the oldest written dropped first,
+# and writes committed every RESULT_commit_every entries or RESULT_commit_interval seconds.
+# A read or write waits at most RESULT_db_timeout seconds for another process holding the file
+RESULT_cache_rows = 1000000
+RESULT_commit_every = 256
+RESULT_commit_interval = 5.0
+RESULT_db_timeout = 0.1
+
+# Query log: normalized query signatures with their counts, appended every
+# QUERYLOG_interval seconds to a file rotated at QUERYLOG_max_bytes ('' disables it).
+# At startup, the PREWARM_size most frequent signatures are answered in the
+# background before /ready reports the worker ready (0 disables it)
+QUERYLOG_path = os.environ.get('PROPERTY_FINDER_QUERY_LOG', '')
+QUERYLOG_max_bytes = 8 * 2 ** 20
+QUERYLOG_backups = 3
+QUERYLOG_interval = 60
+PREWARM_size = int(os.environ.get('PROPERTY_FINDER_PREWARM', 200))
+
+# /search/batch: threads answering the queries of a batch, and the
+# maximum number of queries per batch
+BATCH_workers = 8
+BATCH_max_size = 1000
+
+# Annotation sessions (api/sessions.py): at most SESSION_max are kept, the least
+# recently used dropped first, and each expires SESSION_ttl seconds after its last use
+SESSION_max = int(os.environ.get('PROPERTY_FINDER_SESSIONS', 1000))
+SESSION_ttl = 30 * 60
+
+# Async serving mode (api/asgi.py): threads running candidate expansion and
+# ranking, and the maximum number of open connections to KGTK-search
+ASYNC_workers = 8
+ASYNC_connections = 256
+
+# Local BM25 retrieval over the labels, aliases and descriptions (api/text_index.py),
+# adding its TEXT_size best matches to the candidates when PROPERTY_FINDER_TEXT_SEARCH=1.
+# TEXT_batch bounds the queries scored by one product (a dense TEXT_batch x properties block)
+TEXT_search = os.environ.get('PROPERTY_FINDER_TEXT_SEARCH', '0') == '1'
+TEXT_size = 50
+TEXT_k1 = 1.2
+TEXT_b = 0.75
+TEXT_batch = 256
+
+# Name similarity used for ranking: 'exact' (difflib ratio) or 'ngram'
+# (vectorized bigram Dice approximation, faster but may reorder candidates)
+RANK_similarity = os.environ.get('PROPERTY_FINDER_SIMILARITY', 'exact')
+
+# Per-stage latency histograms and counters on /metrics, and Server-Timing
+# headers on responses; set PROPERTY_FINDER_METRICS=0 to disable
+METRICS_enabled = os.environ.get('PROPERTY_FINDER_METRICS', '1') != '0'
+
+# Hot reload of data/: seconds between checks of the files for changes
+# (0 disables the watch, POST /admin/reload still works), and the bearer
+# token required by the /admin endpoints. Without a token they are closed,
+# unless PROPERTY_FINDER_ADMIN_OPEN=1 opens them to every client
+RELOAD_watch_interval = float(os.environ.get('PROPERTY_FINDER_WATCH_INTERVAL', 10))
+ADMIN_token = os.environ.get('PROPERTY_FINDER_ADMIN_TOKEN', '')
+ADMIN_open = os.environ.get('PROPERTY_FINDER_ADMIN_OPEN', '0') == '1'
+
+# Relations used to expand the directly matched properties:
+# P1696 (inverse property), P1647 (subproperty of), P6609 (value hierarchy property),
+# P1659 (see also)
+RELATIONS = ['P1696', 'P1647', 'P6609', 'P1659']
+
+# Hops followed along the relations from the directly matched properties
+# (1: direct neighbors only), and the score factor applied per extra hop
+RELATION_depth = int(os.environ.get('PROPERTY_FINDER_RELATION_DEPTH', 1))
+RELATION_decay = 0.5
@@ -0,0 +1,116 @@
+import numpy as np
+from difflib import SequenceMatcher
+from threading import Lock
+
+from .records import load_store
+
+
+def exact_similarity(query, names_of):
+    ''' difflib scores: for each candidate, the best SequenceMatcher ratio
+        between query and its names. Each distinct name is scored once.
+        names_of: List[List[str]], None for unknown candidates
+        Returns: List[float]
+    '''
+    ratios = {}
+    matcher = SequenceMatcher(None, query)
+    scores = []
+    for names in names_of:
+        if not names:
+            scores.append(0.0)
+            continue
+        best = 0.0
+        for name in names:
+            ratio = ratios.get(name)
+            if ratio is None:
+                matcher.set_seq2(name)
+                ratio = ratios[name] = matcher.ratio()
+            if ratio > best:
+                best = ratio
+        scores.append(best)
+    return scores
+
+
+class NameMatrix(object):
+    ''' Packed character bigrams of every property name, to score one query
+        against all the names of many candidates at once.
+        The score of a name is the Dice coefficient of the bigram sets, an
+        approximation of difflib's ratio (2 * matches / total length).
+    '''
+
+    def __init__(self, store):
+        self.store = store
+        self.vocabulary = {}
+
+        name_offsets = [0]
+        name_grams = []
+        pnode_offsets = np.zeros(len(store) + 1, dtype=np.int64)
+        for i, pnode in enumerate(store.pnodes):
+            count = 0
+            if store.has_names[i]:
+                record = store.record(pnode, cache=False)
+                for name in record.label + record.alias:
+                    grams = sorted(set(self.vocabulary.setdefault(g, len(self.vocabulary))
+                                       for g in self.grams(name)))
+                    name_grams += grams
+                    name_offsets.append(len(name_grams))
+                    count += 1
+            pnode_offsets[i + 1] = pnode_offsets[i] + count
+
+        self.pnode_offsets = pnode_offsets
+        self.name_offsets = np.array(name_offsets, dtype=np.int64)
+        self.name_sizes = np.diff(self.name_offsets)
+        self.name_grams = np.array(name_grams, dtype=np.int32)
+
+    @staticmethod
+    def grams(text):
+        if len(text) < 2:
+            return [text]
+        return [text[i:i + 2] for i in range(len(text) - 1)]
+
+    def score(self, query, ids):
+        ''' Best Dice score of the query against the names of each id
+            ids: np.ndarray of store ids, -1 for unknown candidates
+        '''
+        ids = np.asarray(ids, dtype=np.int64)
+        scores = np.zeros(len(ids), dtype=np.float64)
+        known = ids >= 0
+        first = np.where(known, self.pnode_offsets[np.maximum(ids, 0)], 0)
+        count = np.where(known, self.pnode_offsets[np.maximum(ids, 0) + 1] - first, 0)
+        if not count.any():
+            return scores
+
+        # Names of all the candidates, contiguous per candidate
+        owner = np.repeat(np.arange(len(ids)), count)
+        names = np.repeat(first - np.cumsum(count) + count, count) + np.arange(count.sum())
+
+        query_grams = np.array(sorted(set(self.vocabulary[g] for g in self.grams(query) if g in self.vocabulary)),
+                               dtype=np.int32)
+        query_size = len(set(self.grams(query)))
+
+        # Bigrams of all those names, and how many of them the query shares
+        sizes = self.name_sizes[names]
+        starts = self.name_offsets[names]
+        grams = self.name_grams[np.repeat(starts - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())]
+        shared = np.isin(grams, query_grams).astype(np.float64)
+        overlap = np.zeros(len(names), dtype=np.float64)
+        nonempty = sizes > 0
+        overlap[nonempty] = np.add.reduceat(shared, (np.cumsum(sizes) - sizes)[nonempty])
+
+        dice = 2.0 * overlap / np.maximum(query_size + sizes, 1)
+        np.maximum.at(scores, owner, dice)
+        return scores
+
+
+_matrix = None
+_matrix_lock = Lock()
+
+
+def load_matrix():
+    ''' The process-wide NameMatrix over the property store
+    '''
+    global _matrix
+    if _matrix is None:
+        with _matrix_lock:
+            if _matrix is None:
+                _matrix = NameMatrix(load_store())
+    return _matrix
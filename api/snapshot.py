@@ -0,0 +1,285 @@
+''' Binary snapshot of all the static data under data/
+
+    Layout: MAGIC | uint32 header length | JSON header | 64-byte aligned arrays
+    The header records the format version, a fingerprint of the source files,
+    the datatype names, and dtype/shape/offset of every array. Arrays are read
+    straight out of a read-only mmap, so forked workers share the same pages.
+'''
+
+import hashlib, json, mmap, os
+import numpy as np
+
+from .settings import FILE_label, FILE_alias, FILE_description, FILE_datatype, FILE_metadata, \
+    FILE_claims_count, FILE_qualifiers_count, FILE_total_count, FILE_claims_property, \
+    JSON_constraints, FILE_snapshot, RELATIONS
+
+MAGIC = b'PFSNAP\x00\x00'
+SNAPSHOT_VERSION = 1
+ALIGN = 64
+
+SOURCE_FILES = [FILE_label, FILE_alias, FILE_description, FILE_datatype, FILE_metadata,
+                FILE_claims_count, FILE_qualifiers_count, FILE_total_count,
+                FILE_claims_property, JSON_constraints]
+
+# Bits of the per-property constraint flags
+C_PRESENT = 1
+C_NOITEM = 2
+C_SCOPE = 4
+C_SCOPE_V = 8
+C_SCOPE_Q = 16
+C_SCOPE_R = 32
+C_SCOPE_MAN = 64
+C_ALLOWED = 128
+C_REQUIRED = 256
+C_CONFLICTS = 512
+
+CONSTRAINT_LISTS = ['allowed_qualifiers', 'required_qualifiers', 'conflicts']
+
+
+def fingerprint(files=SOURCE_FILES):
+    ''' Content hash of the source files the snapshot is compiled from
+    '''
+    digest = hashlib.sha1()
+    for name in files:
+        digest.update(name.encode())
+        with open(name, 'rb') as fd:
+            for chunk in iter(lambda: fd.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_names(path):
+    import pandas as pd
+    names = pd.read_csv(path, sep='\t', usecols=['node1', 'node2'])
+    names['node2'] = names['node2'].str[1:-4]
+    return names
+
+
+def _read_counts(path):
+    import pandas as pd
+    return pd.read_csv(path, sep='\t', usecols=['node1', 'node2']).set_index('node1')['node2']
+
+
+def _pool(strings):
+    ''' Pack strings into one utf-8 byte pool and an offsets array (len + 1)
+    '''
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _grouped_pool(ids, pnodes, values):
+    ''' Group values by pnode (keeping file order) into a string pool,
+        with a per-id index into the pool entries
+    '''
+    codes = np.array([ids[p] for p in pnodes], dtype=np.int64)
+    order = np.argsort(codes, kind='stable')
+    pool, offsets = _pool([values[i] for i in order])
+    index = np.zeros(len(ids) + 1, dtype=np.int64)
+    index[1:] = np.cumsum(np.bincount(codes, minlength=len(ids)))
+    return pool, offsets, index
+
+
+def _csr(ids, edges):
+    ''' edges: List[(source pnode, target pnode)], in order
+        Returns offsets (len(ids) + 1) and neighbor ids
+    '''
+    src = np.array([ids[a] for a, _ in edges], dtype=np.int64)
+    dst = np.array([ids[b] for _, b in edges], dtype=np.int64)
+    order = np.argsort(src, kind='stable')
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(src, minlength=len(ids)))
+    return offsets, dst[order].astype(np.int32)
+
+
+def compile_tables():
+    ''' Parse every file under data/ into flat arrays
+        Returns: (header dict, Dict[str, np.ndarray])
+    '''
+    # pandas is imported here and in the readers only: workers that map the
+    # snapshot never load it (about 40MB of resident memory each)
+    import pandas as pd
+
+    labels = _read_names(FILE_label)
+    aliases = _read_names(FILE_alias)
+    descriptions = _read_names(FILE_description)
+    datatypes = pd.read_csv(FILE_datatype, sep='\t', usecols=['node1', 'node2'])
+
+    counts = {'main_value': _read_counts(FILE_claims_count),
+              'qualifier': _read_counts(FILE_qualifiers_count),
+              'total': _read_counts(FILE_total_count)}
+
+    with open(FILE_metadata) as fd:
+        remote_metadata = json.load(fd)
+    with open(JSON_constraints) as fp:
+        constraints = json.load(fp)
+
+    claims = pd.read_csv(FILE_claims_property, sep='\t', usecols=['node1', 'label', 'node2'])
+    claims = claims[claims['label'].isin(RELATIONS)]
+
+    # Intern every pnode that appears anywhere
+    universe = set(labels['node1']) | set(aliases['node1']) | set(descriptions['node1']) | \
+        set(datatypes['node1']) | set(remote_metadata) | set(constraints) | \
+        set(claims['node1']) | set(claims['node2'])
+    for series in counts.values():
+        universe |= set(series.index)
+    for info in constraints.values():
+        for key in CONSTRAINT_LISTS:
+            universe |= set(info.get(key, []))
+    pnodes = sorted(universe)
+    ids = {p: i for i, p in enumerate(pnodes)}
+    n = len(pnodes)
+
+    arrays = {}
+    arrays['pnode_pool'], arrays['pnode_offsets'] = _pool(pnodes)
+
+    has_names = np.zeros(n, dtype=np.uint8)
+    for frame in (labels, aliases, descriptions, datatypes):
+        has_names[[ids[p] for p in frame['node1']]] = 1
+    arrays['has_names'] = has_names
+
+    for name, frame in (('label', labels), ('alias', aliases)):
+        pool, offsets, index = _grouped_pool(ids, frame['node1'].tolist(), frame['node2'].tolist())
+        arrays[f'{name}_pool'], arrays[f'{name}_offsets'], arrays[f'{name}_index'] = pool, offsets, index
+
+    # One description slot per pnode, flagged when missing
+    description = [''] * n
+    has_description = np.zeros(n, dtype=np.uint8)
+    for pnode, text in zip(descriptions['node1'], descriptions['node2']):
+        description[ids[pnode]] = text
+        has_description[ids[pnode]] = 1
+    arrays['description_pool'], arrays['description_offsets'] = _pool(description)
+    arrays['has_description'] = has_description
+
+    datatype_names = sorted(set(datatypes['node2']))
+    datatype = np.full(n, -1, dtype=np.int8)
+    datatype[[ids[p] for p in datatypes['node1']]] = [datatype_names.index(t) for t in datatypes['node2']]
+    arrays['datatype'] = datatype
+
+    has_counts = np.zeros(n, dtype=np.uint8)
+    for name, series in counts.items():
+        column = np.zeros(n, dtype=np.int64)
+        column[[ids[p] for p in series.index]] = series.values
+        has_counts[[ids[p] for p in series.index]] = 1
+        arrays[f'count_{name}'] = column
+    arrays['has_counts'] = has_counts
+
+    pagerank = np.zeros(n, dtype=np.float64)
+    statements = np.zeros(n, dtype=np.int64)
+    has_metadata = np.zeros(n, dtype=np.uint8)
+    for pnode, info in remote_metadata.items():
+        pagerank[ids[pnode]] = info['pagerank']
+        statements[ids[pnode]] = info['statements']
+        has_metadata[ids[pnode]] = 1
+    arrays['pagerank'], arrays['statements'], arrays['has_metadata'] = pagerank, statements, has_metadata
+
+    flags = np.zeros(n, dtype=np.uint16)
+    lists = {key: [] for key in CONSTRAINT_LISTS}
+    for pnode, info in constraints.items():
+        f = C_PRESENT
+        if 'noitem' in info:
+            f |= C_NOITEM
+        if 'scope' in info:
+            f |= C_SCOPE
+            f |= C_SCOPE_V if 'V' in info['scope'] else 0
+            f |= C_SCOPE_Q if 'Q' in info['scope'] else 0
+            f |= C_SCOPE_R if 'R' in info['scope'] else 0
+        if 'scope_man' in info:
+            f |= C_SCOPE_MAN
+        for key, bit in zip(CONSTRAINT_LISTS, (C_ALLOWED, C_REQUIRED, C_CONFLICTS)):
+            if key in info:
+                f |= bit
+                lists[key] += [(pnode, p) for p in info[key]]
+        flags[ids[pnode]] = f
+    arrays['constraint_flags'] = flags
+    for key in CONSTRAINT_LISTS:
+        arrays[f'{key}_offsets'], arrays[f'{key}_targets'] = _csr(ids, lists[key])
+
+    for relation in RELATIONS:
+        edges = claims[claims['label'] == relation]
+        arrays[f'{relation}_offsets'], arrays[f'{relation}_targets'] = \
+            _csr(ids, list(zip(edges['node1'], edges['node2'])))
+
+    header = {'version': SNAPSHOT_VERSION,
+              'fingerprint': fingerprint(),
+              'datatypes': datatype_names,
+              'relations': RELATIONS,
+              'size': n}
+    return header, arrays
+
+
+def write_snapshot(path=FILE_snapshot):
+    ''' Compile data/ and write the snapshot atomically to path
+    '''
+    header, arrays = compile_tables()
+
+    layout = {}
+    offset = 0
+    for name, arr in arrays.items():
+        layout[name] = {'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': offset}
+        offset += -(-arr.nbytes // ALIGN) * ALIGN
+    header['arrays'] = layout
+
+    raw_header = json.dumps(header).encode()
+    start = len(MAGIC) + 4 + len(raw_header)
+    start = -(-start // ALIGN) * ALIGN
+
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as fd:
+        fd.write(MAGIC)
+        fd.write(np.uint32(len(raw_header)).tobytes())
+        fd.write(raw_header)
+        for name, arr in arrays.items():
+            fd.seek(start + layout[name]['offset'])
+            fd.write(np.ascontiguousarray(arr).tobytes())
+        fd.truncate(start + offset)
+    os.replace(tmp, path)
+    return header
+
+
+class Snapshot(object):
+    ''' Read-only view over a snapshot file
+    '''
+
+    def __init__(self, path=FILE_snapshot):
+        with open(path, 'rb') as fd:
+            self._mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a PropertyFinder snapshot')
+        length = int(np.frombuffer(self._mm, dtype=np.uint32, count=1, offset=len(MAGIC))[0])
+        begin = len(MAGIC) + 4
+        self.header = json.loads(self._mm[begin:begin + length])
+        start = -(-(begin + length) // ALIGN) * ALIGN
+
+        self.arrays = {}
+        for name, spec in self.header['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            count = int(np.prod(spec['shape']))
+            self.arrays[name] = np.frombuffer(self._mm, dtype=dtype, count=count,
+                                              offset=start + spec['offset']).reshape(spec['shape'])
+
+        self.version = self.header['version']
+        self.fingerprint = self.header['fingerprint']
+
+
+_loaded = {}
+
+
+def load_snapshot(path=FILE_snapshot, check=True, fresh=False):
+    ''' Return the snapshot at path, or None if it does not exist or is stale.
+        The snapshot is opened once per process and shared by every user;
+        with fresh, it is opened and checked again (after data/ changed).
+    '''
+    if path in _loaded and not fresh:
+        return _loaded[path]
+
+    snapshot = None
+    if os.path.exists(path):
+        snapshot = Snapshot(path)
+        if snapshot.version != SNAPSHOT_VERSION or (check and snapshot.fingerprint != fingerprint()):
+            print(f'Ignoring stale snapshot {path}, rebuild it with build_snapshot.py')
+            snapshot = None
+    _loaded[path] = snapshot
+    return snapshot
@@ -0,0 +1,14 @@
+from flask import Blueprint
+
+from .cache import result_cache_stats
+from .remote import client_stats
+
+bp = Blueprint('stats', __name__)
+
+
+@bp.route('/stats/cache')
+def cache_stats():
+    ''' Hit / miss / eviction counters of the remote query caches, the state
+        of the remote health check, and the result caches, used to size them
+    '''
+    return {'remote': client_stats(), 'results': result_cache_stats()}
@@ -0,0 +1,147 @@
+import re
+import numpy as np
+import wordninja
+from collections import Counter
+from threading import Lock
+
+from .records import load_store
+from .settings import TEXT_k1, TEXT_b, TEXT_batch
+
+
+class TextIndex(object):
+    ''' BM25 index over the words of the labels, aliases and description of
+        every property, stored as a sparse term x property matrix in CSR form:
+        the properties containing term t are props[offsets[t]:offsets[t + 1]],
+        with their BM25 weights in weights[...].
+        A batch of queries is scored with one sparse product against it,
+        followed by a top-k selection per query.
+    '''
+
+    token_pattern = re.compile(r'[a-z0-9]+')
+
+    def __init__(self, store, k1=TEXT_k1, b=TEXT_b):
+        self.store = store
+        self.vocabulary = {}
+
+        docs, terms, tfs = [], [], []
+        lengths = np.zeros(len(store), dtype=np.float64)
+        for i, pnode in enumerate(store.pnodes):
+            if not store.has_names[i] and not store['has_description'][i]:
+                continue
+            record = store.record(pnode, cache=False)
+            text = list(record.label + record.alias)
+            if isinstance(record.description, str):
+                text.append(record.description)
+            tokens = self.tokens(' '.join(text))
+            lengths[i] = len(tokens)
+            for token, tf in Counter(tokens).items():
+                docs.append(i)
+                terms.append(self.vocabulary.setdefault(token, len(self.vocabulary)))
+                tfs.append(tf)
+
+        docs = np.array(docs, dtype=np.int32)
+        terms = np.array(terms, dtype=np.int32)
+        tfs = np.array(tfs, dtype=np.float64)
+
+        # BM25: idf(t) * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / mean length))
+        df = np.bincount(terms, minlength=len(self.vocabulary))
+        n = np.count_nonzero(lengths)
+        mean_length = lengths[lengths > 0].mean() if n else 1.0
+        idf = np.log(1 + (n - df + 0.5) / (df + 0.5))
+        norm = k1 * (1 - b + b * lengths[docs] / mean_length)
+        weights = idf[terms] * tfs * (k1 + 1) / (tfs + norm)
+
+        order = np.argsort(terms, kind='stable')
+        self.offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(df)
+        self.props = docs[order]
+        self.weights = weights[order]
+
+    def tokens(self, text):
+        return self.token_pattern.findall(text.lower())
+
+    def query_terms(self, query):
+        ''' Term ids of the words of query; words out of the vocabulary are
+            split by wordninja, as headers often run words together
+        '''
+        terms = set()
+        for token in self.tokens(query):
+            if token in self.vocabulary:
+                terms.add(self.vocabulary[token])
+                continue
+            for word in wordninja.split(token):
+                if word in self.vocabulary:
+                    terms.add(self.vocabulary[word])
+        return sorted(terms)
+
+    def scores(self, queries):
+        ''' BM25 scores of every property for each query (len(queries) x len(store)):
+            the product of the binary query x term matrix with the term x property one
+        '''
+        rows, terms = [], []
+        for row, query in enumerate(queries):
+            query_terms = self.query_terms(query)
+            rows += [row] * len(query_terms)
+            terms += query_terms
+        rows = np.array(rows, dtype=np.int64)
+        terms = np.array(terms, dtype=np.int64)
+
+        # Gather the posting list of every (query, term) pair, then sum the
+        # weights per (query, property) cell
+        first = self.offsets[terms]
+        sizes = self.offsets[terms + 1] - first
+        postings = np.repeat(first - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())
+        cells = np.repeat(rows, sizes) * len(self.store) + self.props[postings]
+        scores = np.bincount(cells, weights=self.weights[postings], minlength=len(queries) * len(self.store))
+        return scores.reshape(len(queries), len(self.store))
+
+    def search_many(self, queries, size=50, masks=None, batch=TEXT_batch):
+        ''' The size best properties of each query, best first
+            masks: optional list with a boolean array over the store ids (or None)
+                   per query, only these properties are returned for it
+            batch: queries scored per product, bounding the dense score matrix
+            Returns: List[List[pnode]]
+        '''
+        k = min(size, len(self.store))
+        if k <= 0:
+            return [[] for _ in queries]
+
+        results = []
+        for start in range(0, len(queries), batch):
+            scores = self.scores(queries[start:start + batch])
+            if masks is not None:
+                for row, mask in enumerate(masks[start:start + batch]):
+                    if mask is not None:
+                        scores[row, ~mask] = 0.0
+
+            # Top k of each row, ties broken by store id
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            for row in range(len(scores)):
+                top = best[row][np.lexsort((best[row], -scores[row, best[row]]))]
+                results.append([self.store.pnodes[i] for i in top.tolist() if scores[row, i] > 0])
+        return results
+
+    def search(self, query, size=50, mask=None):
+        ''' The size best properties for query, best first
+        '''
+        return self.search_many([query], size, None if mask is None else [mask])[0]
+
+    def nbytes(self):
+        ''' Memory held by the matrix arrays, in bytes
+        '''
+        return self.offsets.nbytes + self.props.nbytes + self.weights.nbytes
+
+
+_index = None
+_index_lock = Lock()
+
+
+def load_text_index():
+    ''' The process-wide TextIndex over the property store
+    '''
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = TextIndex(load_store())
+    return _index
@@ -1,15 +1,50 @@
+import os
+from threading import Lock
+
+import api.admin
 import api.hello
+import api.metrics
+import api.sessions
+import api.stats
 from flask import Flask
 from flask_cors import CORS
 from flask_restful import Api
-from api.PropertyFinderResource import PropertyFinderResource
+from api.PropertyFinder2 import PropertyFinder
+from api.PropertyFinderResource import PropertyFinderResource, PropertyFinderBatchResource
+from api.admin import watch_data
+from api.querylog import warmup
 
 app = Flask(__name__)
 CORS(app)
 
 app.register_blueprint(api.hello.bp)
+app.register_blueprint(api.metrics.bp)
+app.register_blueprint(api.stats.bp)
+app.register_blueprint(api.admin.bp)
+app.register_blueprint(api.sessions.bp)
+
+_started_pid = None
+_started_lock = Lock()
+
+
+@app.before_request
+def start_background():
+    ''' Start the data watcher and the warm up in the process serving the
+        requests, on its first one (a load balancer polls /ready): threads
+        started at import would stay in the master of gunicorn --preload
+    '''
+    global _started_pid
+    if _started_pid != os.getpid():
+        with _started_lock:
+            if _started_pid != os.getpid():
+                watch_data()
+                warmup.start(PropertyFinder.shared)
+                _started_pid = os.getpid()
+
+
 api = Api(app)
 api.add_resource(PropertyFinderResource, '/search')
+api.add_resource(PropertyFinderBatchResource, '/search/batch')
 
 if __name__ == '__main__':
     app.run(port=12576)
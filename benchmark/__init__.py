@@ -0,0 +1,3 @@
+''' Benchmarks for the PropertyFinder service.
+    Run from the repository root, e.g. python -m benchmark.startup
+'''
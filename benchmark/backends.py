@@ -0,0 +1,126 @@
+''' Retrieval backends (api/backends.py) against KGTK-search stubs with
+    injected latency.
+
+    Starts two stubs in process, a primary and a mirror, both answering after
+    --latency ms except a --slow-fraction of the queries which take
+    --slow-latency ms, then times the ngram queries of the corpus labels from
+    concurrent clients through:
+
+    single      the primary alone
+    failover    the primary with a --deadline, then the mirror
+    hedged      the primary, and the mirror once --hedge ms passed without an answer
+    down        a primary which refuses connections, then the local index
+    hung        a primary answering after --hung-latency ms with a --deadline,
+                then a --mirror-latency ms mirror with a deadline of twice
+                --deadline, from --hung-concurrency clients: the queries left
+                behind on the primary hold all of its threads
+
+    Every query carries a distinct suffix so none is answered by the response
+    cache of the clients. Reports latency percentiles, errors, and the queries
+    sent to each backend by outcome. Exits with status 1 when a query of the
+    down or hung scenarios fails.
+
+    python -m benchmark.backends [--queries 400] [--concurrency 8] [--latency 50]
+                                 [--slow-fraction 0.05] [--slow-latency 1000] [--hedge 100] [--deadline 200]
+                                 [--hung-latency 2000] [--mirror-latency 10] [--hung-concurrency 32]
+'''
+import argparse, json, socket, sys
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from api.backends import Composite, LocalIndex, RemoteHTTP, backend_requests, hedged_requests
+from api.generation import current_generation
+from benchmark.corpus import QUERIES
+from benchmark.loadtest import percentile
+from benchmark.stub_server import serve
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def measure(backend, terms, concurrency, size):
+    ''' Latencies in seconds of backend.search on each term, and the number of errors
+    '''
+    before = dict(backend_requests.values), dict(hedged_requests.values)
+
+    def timed_search(term):
+        start = perf_counter()
+        try:
+            backend.search(term, size)
+            return perf_counter() - start, False
+        except Exception:
+            return perf_counter() - start, True
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed_search, terms))
+    latencies = sorted(latency for latency, _ in results)
+
+    outcomes = {}
+    for (name, outcome), n in backend_requests.values.items():
+        n -= before[0].get((name, outcome), 0)
+        if n:
+            outcomes[f'{name} {outcome}'] = n
+    hedged = sum(hedged_requests.values.values()) - sum(before[1].values())
+    return {'queries': len(terms), 'errors': sum(error for _, error in results),
+            'p50_ms': percentile(latencies, 0.5), 'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99), 'max_ms': latencies[-1] * 1000,
+            'hedged': hedged, 'outcomes': outcomes}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', type=int, default=400, help='queries per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--size', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=50.0, help='stub response delay in ms')
+    parser.add_argument('--jitter', type=float, default=10.0)
+    parser.add_argument('--slow-fraction', type=float, default=0.05)
+    parser.add_argument('--slow-latency', type=float, default=1000.0)
+    parser.add_argument('--hedge', type=float, default=100.0, help='hedge delay in ms')
+    parser.add_argument('--deadline', type=float, default=200.0, help='deadline of the primary in ms')
+    parser.add_argument('--hung-latency', type=float, default=2000.0, help='hung primary response delay in ms')
+    parser.add_argument('--mirror-latency', type=float, default=10.0, help='mirror response delay in ms')
+    parser.add_argument('--hung-concurrency', type=int, default=32)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    stubs = [serve(free_port(), args.latency, args.jitter, background=True, slow_fraction=args.slow_fraction,
+                   slow_latency=args.slow_latency) for _ in range(2)]
+    stubs += [serve(free_port(), latency, background=True) for latency in (args.hung_latency, args.mirror_latency)]
+    primary, mirror, hung, fast = [RemoteHTTP(f'http://127.0.0.1:{stub.server_port}/api') for stub in stubs]
+    down = RemoteHTTP(f'http://127.0.0.1:{free_port()}/api')
+    local = LocalIndex(current_generation())
+
+    scenarios = {
+        'single': primary,
+        'failover': Composite([primary, mirror], [args.deadline / 1000, None], hedge=None),
+        'hedged': Composite([primary, mirror], hedge=args.hedge / 1000),
+        'down': Composite([down, local], hedge=None),
+        'hung': Composite([hung, fast], [args.deadline / 1000, 2 * args.deadline / 1000], hedge=None),
+    }
+    report = {'config': {'latency_ms': args.latency, 'jitter_ms': args.jitter,
+                         'slow_fraction': args.slow_fraction, 'slow_latency_ms': args.slow_latency,
+                         'hedge_ms': args.hedge, 'deadline_ms': args.deadline,
+                         'hung_latency_ms': args.hung_latency, 'mirror_latency_ms': args.mirror_latency,
+                         'concurrency': args.concurrency, 'hung_concurrency': args.hung_concurrency,
+                         'queries': args.queries}}
+    for name, backend in scenarios.items():
+        terms = [f'{QUERIES[i % len(QUERIES)][0]} {name}{i}' for i in range(args.queries)]
+        concurrency = args.hung_concurrency if name == 'hung' else args.concurrency
+        report[name] = measure(backend, terms, concurrency, args.size)
+
+    for stub in stubs:
+        stub.shutdown()
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            fd.write(output)
+    print(output)
+    sys.exit(1 if report['down']['errors'] or report['hung']['errors'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+''' Representative column headers used by the benchmarks, with the data_type
+    the annotator would send along (None when the column type is unknown)
+'''
+
+QUERIES = [
+    ('year', 'time'),
+    ('population', 'quantity'),
+    ('country', 'item'),
+    ('area', 'quantity'),
+    ('date of birth', 'time'),
+    ('gdp', 'quantity'),
+    ('capital', 'item'),
+    ('author', 'item'),
+    ('publication date', 'time'),
+    ('elevation', 'quantity'),
+    ('isbn', 'id'),
+    ('website', 'url'),
+    ('mass', 'quantity'),
+    ('director', 'item'),
+    ('start time', 'time'),
+    ('release year', 'time'),
+    ('zip code', 'id'),
+    ('homepage url', 'url'),
+    ('number of employees', 'quantity'),
+    ('unemployment rate', 'quantity'),
+    ('median household income', 'quantity'),
+    ('team', 'item'),
+    ('genre', 'item'),
+    ('coach', 'item'),
+    ('album', 'item'),
+    ('occupation', None),
+    ('name', None),
+    ('location', None),
+    ('height', None),
+    ('language', None),
+    ('county_name', None),
+    ('state fips', None),
+    ('lat', None),
+    ('lon', None),
+    ('ceo', None),
+    # Concatenated headers which need the wordninja split
+    ('dateofbirth', 'time'),
+    ('populationtotal', 'quantity'),
+    ('countryoforigin', 'item'),
+    ('unemploymentrate', 'quantity'),
+    ('yearofconstructioncompleted', 'time'),
+    ('numberofemployees', None),
+    # Abbreviated headers, with no match before the wordninja split on the
+    # local index
+    ('avgannualrainfallmm', 'quantity'),
+    ('ttlareasqkm', 'quantity'),
+    ('fldx_7', None),
+    # Noisy headers which fall back to partial queries
+    ('totalpopulationestimate2019', 'quantity'),
+    ('birthplacecityname', 'item'),
+    ('nameofheadcoachin2019season', 'item'),
+    ('qqqzzz', None),
+    ('xyzqwv', None),
+]
@@ -0,0 +1,96 @@
+''' Constraint filtering in PropertyFinder.filter_ranked.
+
+    Checks the fused single-pass filter against the five filter_by_* passes
+    applied in sequence, over randomized candidate levels and parameters,
+    and reports the time of both. Exits with status 1 on any difference.
+
+    python -m benchmark.filtering [--cases N] [--seed N]
+'''
+import argparse, json, random, sys
+from time import perf_counter
+
+from api.PropertyFinder2 import PropertyFinder
+from api.settings import LOCAL_search
+
+
+def sequential_filter(finder, ranked, params):
+    ''' filter_ranked as the original sequence of passes
+    '''
+    ranked = finder.filter_by_item(ranked)
+    if params['scope'] != 'both':
+        ranked = finder.filter_by_scope(ranked, params['scope'])
+    ranked = finder.filter_by_allowed_qualifiers(ranked, params['constraint'])
+    ranked = finder.filter_by_required_qualifiers(ranked, params['constraint'])
+    ranked = finder.filter_by_conflicts(ranked, params['otherProperties'])
+    return ranked
+
+
+def levels(ranked):
+    return {k: list(v) for k, v in ranked.items() if v}
+
+
+def random_case(rnd, finder, pnodes):
+    constraints = finder.constraints
+    with_allowed = [p for p, info in constraints.items() if 'allowed_qualifiers' in info]
+    with_required = [p for p, info in constraints.items() if 'required_qualifiers' in info]
+    with_conflicts = [p for p, info in constraints.items() if 'conflicts' in info]
+    scoped = [p for p, info in constraints.items() if 'scope' in info]
+
+    params = {'scope': rnd.choice(['both', 'qualifier', 'main value']),
+              'constraint': rnd.choice([None, 'P0', rnd.choice(with_allowed), rnd.choice(with_required),
+                                        rnd.choice(with_required)]),
+              'otherProperties': rnd.choice(['', ',', ','.join(rnd.sample(with_conflicts, 3)),
+                                             rnd.choice(with_conflicts)])}
+
+    ranked = {}
+    for level in rnd.choice([[1, 2, 3], [0, 1, 2, 3, 4]]):
+        ranked[level] = rnd.sample(pnodes, rnd.randint(0, 40)) if level in (1, 2, 3) else []
+
+    # Scatter scoped properties and the qualifiers the constraint allows or
+    # requires over the levels, so that properties move to levels 0 and 4
+    info = constraints.get(params['constraint'], {})
+    extra = rnd.sample(scoped, 10) + info.get('required_qualifiers', []) + info.get('allowed_qualifiers', [])[:5]
+    for pnode in extra:
+        level = ranked[rnd.choice([1, 2, 3])]
+        level.insert(rnd.randint(0, len(level)), pnode)
+    return ranked, params
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cases', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    finder = PropertyFinder(host=LOCAL_search)
+    store = PropertyFinder.metadata.store
+    pnodes = [p for p in store.pnodes if PropertyFinder.metadata.check_property_exists(p)]
+    # Over-represent constrained properties
+    pnodes += [p for p in finder.constraints] * 2
+
+    rnd = random.Random(args.seed)
+    timings = {'sequential': 0.0, 'fused': 0.0}
+    mismatches = []
+    for case in range(args.cases):
+        ranked, params = random_case(rnd, finder, pnodes)
+        ranked = {k: list(dict.fromkeys(v)) for k, v in ranked.items()}
+
+        start = perf_counter()
+        expected = sequential_filter(finder, {k: list(v) for k, v in ranked.items()}, params)
+        timings['sequential'] += perf_counter() - start
+
+        start = perf_counter()
+        result = finder.filter_ranked({k: list(v) for k, v in ranked.items()}, params)
+        timings['fused'] += perf_counter() - start
+
+        if levels(expected) != levels(result):
+            mismatches.append({'case': case, 'params': params})
+
+    print(json.dumps({'cases': args.cases, 'identical': not mismatches, 'mismatches': mismatches[:10],
+                      'seconds': timings}, indent=2))
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+''' End-to-end load test of the /search endpoint.
+
+    Starts the Flask app (app.py) or the async app (api/asgi.py, under uvicorn)
+    in a subprocess, with candidate retrieval served by the KGTK-search stub
+    (benchmark.stub_server) or the local index, then sends the corpus queries
+    from concurrent clients for a fixed duration.
+    Reports latency percentiles, requests per second and the RSS of the server.
+    Repeated terms are answered from the remote response cache of the server
+    after the first round, as they would be in production; --unique makes every
+    label distinct so that each request waits on the stub.
+
+    python -m benchmark.loadtest [--server flask|asgi] [--backend stub|local] [--latency 50]
+                                 [--concurrency 8] [--duration 10] [--unique] [--output FILE]
+    python -m benchmark.loadtest --url http://host:port   # an already running server
+'''
+import argparse, json, os, subprocess, sys
+from threading import Event, Thread
+from time import perf_counter, sleep
+
+from requests import Session
+
+from benchmark.corpus import QUERIES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rss_mb(pid):
+    ''' Resident set size of a process in MB, None when /proc is unavailable
+    '''
+    try:
+        with open(f'/proc/{pid}/status') as fd:
+            for line in fd:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+
+SERVERS = {
+    'flask': lambda port: ['-c', f'from app import app; app.run(port={port}, threaded=True)'],
+    'asgi': lambda port: ['-m', 'uvicorn', 'api.asgi:app', '--port', str(port), '--log-level', 'warning'],
+}
+
+
+def start(command, url, env=None):
+    ''' Run python with the arguments of command, once url answers with a 2xx
+    '''
+    process = subprocess.Popen([sys.executable] + command, cwd=ROOT, env=dict(os.environ, **(env or {})),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    session = Session()
+    for _ in range(600):
+        if process.poll() is not None:
+            raise RuntimeError(f'{" ".join(command)} exited during startup')
+        try:
+            if session.get(url, timeout=1).ok:
+                return process
+        except Exception:
+            pass
+        sleep(0.1)
+    process.kill()
+    raise RuntimeError(f'{" ".join(command)} did not start')
+
+
+def percentile(timings, q):
+    return timings[min(int(len(timings) * q), len(timings) - 1)] * 1000 if timings else None
+
+
+def query_params(label, type_, size):
+    params = {'label': label, 'size': size}
+    if type_ is not None:
+        params['type'] = type_
+    return params
+
+
+def run(url, concurrency, duration, size, unique=False):
+    ''' Send the corpus queries from concurrent clients until duration elapses
+        Returns: (latencies in seconds, number of failed requests, elapsed seconds)
+    '''
+    stop = Event()
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+
+    def client(n):
+        session = Session()
+        i = n
+        while not stop.is_set():
+            params = query_params(*QUERIES[i % len(QUERIES)], size)
+            if unique:
+                params['label'] += f' {i}'
+            start = perf_counter()
+            try:
+                ok = session.get(f'{url}/search', params=params, timeout=30).status_code == 200
+            except Exception:
+                ok = False
+            latencies[n].append(perf_counter() - start)
+            if not ok:
+                errors[n] += 1
+            i += concurrency
+
+    threads = [Thread(target=client, args=(n,), daemon=True) for n in range(concurrency)]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sorted(t for timings in latencies for t in timings), sum(errors), perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', help='base URL of a running server, instead of starting app.py')
+    parser.add_argument('--server', choices=sorted(SERVERS), default='flask')
+    parser.add_argument('--backend', choices=['stub', 'local'], default='stub')
+    parser.add_argument('--latency', type=float, default=50.0, help='stub response delay in ms')
+    parser.add_argument('--stub-port', type=int, default=8765)
+    parser.add_argument('--port', type=int, default=12577, help='port of the app.py started by the test')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of load, after one warm-up round')
+    parser.add_argument('--size', type=int, default=10)
+    parser.add_argument('--unique', action='store_true', help='make every label distinct, defeating the caches')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    process = None
+    stub = None
+    url = args.url
+    if url is None:
+        if args.backend == 'stub':
+            host = f'http://127.0.0.1:{args.stub_port}/api'
+            stub = start(['-m', 'benchmark.stub_server', '--port', str(args.stub_port), '--latency', str(args.latency)],
+                         f'{host}/time?size=1')
+        else:
+            host = 'local'
+        url = f'http://127.0.0.1:{args.port}'
+        begin = perf_counter()
+        process = start(SERVERS[args.server](args.port), f'{url}/ready', {'PROPERTY_FINDER_HOST': host})
+        startup = perf_counter() - begin
+
+    try:
+        rss_start = rss_mb(process.pid) if process else None
+        warmup = Session()
+        for label, type_ in QUERIES:
+            warmup.get(f'{url}/search', params=query_params(label, type_, args.size), timeout=30)
+
+        peak = [rss_mb(process.pid) if process else None]
+        sampling = Event()
+
+        def sample():
+            while not sampling.wait(0.2):
+                rss = rss_mb(process.pid)
+                if rss is not None and (peak[0] is None or rss > peak[0]):
+                    peak[0] = rss
+
+        if process:
+            Thread(target=sample, daemon=True).start()
+        latencies, errors, elapsed = run(url, args.concurrency, args.duration, args.size, args.unique)
+        sampling.set()
+
+        report = {'config': {'url': args.url, 'server': None if args.url else args.server,
+                             'backend': None if args.url else args.backend,
+                             'stub_latency_ms': args.latency if stub else None,
+                             'concurrency': args.concurrency, 'duration_s': args.duration, 'size': args.size,
+                             'unique': args.unique},
+                  'startup_s': startup if process else None,
+                  'requests': len(latencies),
+                  'errors': errors,
+                  'rps': len(latencies) / elapsed,
+                  'p50_ms': percentile(latencies, 0.5),
+                  'p95_ms': percentile(latencies, 0.95),
+                  'p99_ms': percentile(latencies, 0.99),
+                  'rss_mb': {'start': rss_start, 'peak': peak[0],
+                             'end': rss_mb(process.pid) if process else None}}
+    finally:
+        for server in (process, stub):
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            fd.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+''' Per-worker memory: resident set size of a process serving PropertyFinder,
+    against one holding the tables the way the service used to (pandas
+    DataFrames with lists of names per cell, the metadata.json and
+    constraints.json dicts, and the relation maps of pnode strings).
+
+    Each side is measured in a fresh subprocess.
+
+    python -m benchmark.memory [--text-search]
+'''
+import argparse, json, subprocess, sys
+
+
+def legacy_tables():
+    ''' The static tables as the first version of PropertyMetaData, PropertyRanker
+        and PropertyFinder held them
+    '''
+    import pandas as pd
+    from collections import defaultdict
+    from api.settings import FILE_label, FILE_alias, FILE_description, FILE_datatype, FILE_metadata, \
+        FILE_claims_count, FILE_qualifiers_count, FILE_total_count, FILE_claims_property, JSON_constraints, \
+        RELATIONS
+
+    def names(path, column):
+        table = pd.read_csv(path, sep='\t')
+        table['node2'] = table['node2'].apply(lambda x: x[1:-4])
+        table.columns = ['pnode', column]
+        return table
+
+    labels = names(FILE_label, 'label').groupby('pnode')['label'].apply(list).reset_index().set_index('pnode')
+    aliases = names(FILE_alias, 'alias').groupby('pnode')['alias'].apply(list).reset_index().set_index('pnode')
+    description = names(FILE_description, 'description').set_index('pnode')
+    data_type = pd.read_csv(FILE_datatype, sep='\t', usecols=['node1', 'node2'])
+    data_type.columns = ['pnode', 'data_type']
+    name_table = pd.concat([labels, aliases, description, data_type.set_index('pnode')], axis=1)
+    for row in name_table.loc[name_table.alias.isnull(), 'alias'].index:
+        name_table.at[row, 'alias'] = []
+
+    with open(FILE_metadata) as fd:
+        remote_metadata = json.load(fd)
+
+    counts = []
+    for path, column in ((FILE_claims_count, 'main value'), (FILE_qualifiers_count, 'qualifier'),
+                         (FILE_total_count, 'total')):
+        table = pd.read_csv(path, sep='\t', usecols=['node1', 'node2']).set_index('node1')
+        table.columns = [column]
+        counts.append(table)
+    table_counts = pd.concat(counts, axis=1).fillna(0).astype(int)
+    table_counts['both'] = table_counts['main value'] + table_counts['qualifier']
+    table_counts['p:main_value'] = table_counts['main value'] / table_counts['both']
+    table_counts['p:qualifier'] = 1.0 - table_counts['p:main_value']
+
+    with open(JSON_constraints) as fd:
+        constraints = json.load(fd)
+
+    claims = pd.read_csv(FILE_claims_property, sep='\t', usecols=['node1', 'label', 'node2'])
+    relations = {}
+    for label in RELATIONS:
+        relations[label] = defaultdict(list)
+        for node1, node2 in claims[claims['label'] == label].groupby('node1')['node2']:
+            relations[label][node1] = node2.tolist()
+    del claims
+
+    return name_table, remote_metadata, table_counts, constraints, relations
+
+
+def worker(side, text_search):
+    from api.memory import rss
+    if side == 'legacy':
+        import wordninja, flask, flask_restful
+        tables = legacy_tables()
+        return {'rss': rss()}
+
+    import app
+    from api.memory import footprint
+    from api.PropertyFinder2 import PropertyFinder
+    finder = PropertyFinder.shared()
+    if text_search:
+        finder.generation.text_index()
+    return {'rss': rss(), 'footprint': footprint(finder.generation)['structures']}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--worker', choices=['legacy', 'current'], help=argparse.SUPPRESS)
+    parser.add_argument('--text-search', action='store_true', help='also build the BM25 text index')
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(args.worker, args.text_search)))
+        return
+
+    report = {}
+    for side in ('legacy', 'current'):
+        command = [sys.executable, '-m', 'benchmark.memory', '--worker', side]
+        if args.text_search:
+            command.append('--text-search')
+        report[side] = json.loads(subprocess.run(command, check=True, capture_output=True,
+                                                 text=True).stdout.splitlines()[-1])
+    report['rss_factor'] = report['legacy']['rss'] / report['current']['rss']
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+''' Microbenchmarks of the steps of a query, on inputs derived from the query
+    corpus with the local ngram index (no network access needed).
+
+    python -m benchmark.micro [--repeat N] [--only NAME ...] [--output FILE]
+'''
+import argparse, json
+from time import perf_counter
+
+from api.PropertyFinder2 import PropertyFinder
+from api.records import PropertyStore
+from api.settings import LOCAL_search, RELATIONS
+from api.snapshot import load_snapshot
+from benchmark.corpus import QUERIES
+
+
+def measure(fn, cases, repeat):
+    ''' Time fn(*case) for every case, repeat times
+        Returns: per call timings in microseconds
+    '''
+    timings = []
+    for _ in range(repeat):
+        for case in cases:
+            start = perf_counter()
+            fn(*case)
+            timings.append(perf_counter() - start)
+    timings.sort()
+    return {'calls': len(timings),
+            'mean_us': sum(timings) / len(timings) * 1e6,
+            'p50_us': timings[len(timings) // 2] * 1e6,
+            'p95_us': timings[int(len(timings) * 0.95)] * 1e6,
+            'min_us': timings[0] * 1e6}
+
+
+def build_cases(finder):
+    ''' Candidates and parameters of every corpus query
+    '''
+    cases = []
+    for label, type_ in QUERIES:
+        params = finder._build_params(label, type_, extra_info='true')
+        params.pop('label')
+        params['type'] = PropertyFinder.metadata.get_type_alias(type_)
+        candidates = finder.get_candidates(label, params['type'], finder._retrieve(label))
+        cases.append((label, params, candidates))
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='+', help='names of the benchmarks to run')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    finder = PropertyFinder(host=LOCAL_search)
+    metadata = PropertyFinder.metadata
+    ranker = PropertyFinder.ranker
+    store = metadata.store
+    cases = build_cases(finder)
+    snapshot = load_snapshot()
+
+    pnodes = [pnode for _, _, candidates in cases for level in candidates.values() for pnode in level]
+    filter_params = [dict(params, scope=scope, constraint=constraint, otherProperties=other)
+                     for _, params, _ in cases
+                     for scope, constraint, other in (('both', None, ''), ('qualifier', 'P585', ''),
+                                                      ('main value', None, 'P569,P570'))]
+
+    benchmarks = {
+        'gen_relation': (finder.gen_relation, [(label,) for label in RELATIONS], 1),
+        'to_relation': (store.to_relation, [(label,) for label in RELATIONS], args.repeat),
+        '_build_names': (lambda: PropertyStore(snapshot.header, snapshot.arrays), [()], args.repeat)
+        if snapshot is not None else None,
+        'rank': (lambda label, params, candidates: [ranker.rank(level, label, metadata, params['scope'])
+                                                    for level in candidates.values()], cases, args.repeat),
+        'rank_top10': (lambda label, params, candidates: [ranker.rank(level, label, metadata, params['scope'], 10)
+                                                          for level in candidates.values()], cases, args.repeat),
+        'filter_ranked': (finder.filter_ranked,
+                          [(candidates, params) for (_, _, candidates), params in
+                           zip([case for case in cases for _ in range(3)], filter_params)], args.repeat),
+        'get_info': (lambda pnode: metadata.get_info(pnode, 1.0, True), [(pnode,) for pnode in pnodes], args.repeat),
+    }
+
+    report = {}
+    for name, benchmark in benchmarks.items():
+        if args.only and name not in args.only:
+            continue
+        if benchmark is None:
+            report[name] = None
+            continue
+        fn, inputs, repeat = benchmark
+        report[name] = measure(fn, inputs, repeat)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            fd.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
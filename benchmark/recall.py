@@ -0,0 +1,79 @@
+''' Recall of the local ngram index against recorded KGTK-search responses.
+
+    Record the remote responses for every term issued for the query corpus
+    (main query, wordninja split and partial queries), then compare:
+
+    python -m benchmark.recall --record [--host https://kgtk.isi.edu/api]
+    python -m benchmark.recall [--k 10 50 500]
+'''
+import argparse, json, os, sys
+
+from api.PropertyFinder2 import PropertyFinder
+from api.settings import KGTK_search, LOCAL_search
+from benchmark.corpus import QUERIES
+
+RECORDED = os.path.join(os.path.dirname(__file__), 'recorded', 'kgtk_ngram.json')
+
+
+def load_recorded(path=RECORDED):
+    ''' Dict[term, List[qnode]] in the order KGTK-search returned them
+    '''
+    with open(path) as fd:
+        return json.load(fd)
+
+
+def record(host, path=RECORDED):
+    ''' Run the corpus against the remote backend, saving every term's response
+    '''
+    finder = PropertyFinder(host=host)
+    recorded = load_recorded(path) if os.path.exists(path) else {}
+    search = finder._search
+
+    def _search(term, extra_info=True, type_=None):
+        recorded[term] = search(term, extra_info, type_)
+        return recorded[term]
+
+    finder._search = _search
+    for label, type_ in QUERIES:
+        finder._query(label, type_)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as fd:
+        json.dump(recorded, fd, indent=1, sort_keys=True)
+    return recorded
+
+
+def compare(recorded, ks):
+    finder = PropertyFinder(host=LOCAL_search)
+    report = {}
+    for term, remote in recorded.items():
+        local = finder._search(term)
+        report[term] = {'remote': len(remote), 'local': len(local)}
+        for k in ks:
+            expected = set(remote[:k])
+            if expected:
+                report[term][f'recall@{k}'] = len(expected & set(local[:k])) / len(expected)
+
+    summary = {}
+    for k in ks:
+        values = [r[f'recall@{k}'] for r in report.values() if f'recall@{k}' in r]
+        summary[f'recall@{k}'] = sum(values) / len(values) if values else None
+    return {'terms': report, 'summary': summary}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--record', action='store_true', help='fetch and save the remote responses first')
+    parser.add_argument('--host', default=KGTK_search)
+    parser.add_argument('--k', type=int, nargs='+', default=[10, 50, 500])
+    args = parser.parse_args()
+
+    if not args.record and not os.path.exists(RECORDED):
+        sys.exit(f'No recording of KGTK-search responses at {RECORDED}: '
+                 f'run python -m benchmark.recall --record first (needs access to {args.host})')
+    recorded = record(args.host) if args.record else load_recorded()
+    print(json.dumps(compare(recorded, args.k), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+''' Annotation sessions (api/sessions.py) against repeated /search queries.
+
+    Annotates random tables of corpus headers column by column: each column's
+    property is chosen in turn, the top suggestion or a property conflicting
+    with candidates of other columns, and after each choice the suggestions of
+    every column are compared with generate_top_candidates given the other
+    choices as otherProperties. Reports the time of both ways.
+    Exits with status 1 on any difference.
+
+    python -m benchmark.sessions [--tables N] [--columns N] [--seed N]
+'''
+import argparse, json, random, sys
+from time import perf_counter
+
+from api.PropertyFinder2 import PropertyFinder
+from api.sessions import TableSession
+from api.settings import LOCAL_search
+from benchmark.corpus import QUERIES
+
+
+def column_query(label, type_, size):
+    query = {'label': label, 'size': size}
+    if type_ is not None:
+        query['data_type'] = type_
+    return query
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tables', type=int, default=50)
+    parser.add_argument('--columns', type=int, default=6)
+    parser.add_argument('--size', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    finder = PropertyFinder(host=LOCAL_search, result_cache='')
+    table = finder.constraint_table
+    constraints = [None, rnd.choice(sorted(table.allowed)), rnd.choice(sorted(table.required))]
+    conflicting = sorted(table.conflicts)
+
+    session_time = search_time = 0.0
+    checks = differences = refiltered = picks = 0
+    for _ in range(args.tables):
+        settings = {'scope': rnd.choice(['both', 'qualifier', 'main value']), 'filter': rnd.choice(['true', 'false']),
+                    'constraint': rnd.choice(constraints)}
+        columns = [column_query(*query, args.size) for query in rnd.sample(QUERIES, args.columns)]
+
+        start = perf_counter()
+        session = TableSession(finder, **settings)
+        session.add_columns(columns)
+        session_time += perf_counter() - start
+
+        names = list(session.columns)
+        chosen = {}
+        for name in names:
+            affecting = [p for p in conflicting
+                         if any(not session.columns[o].pnodes.isdisjoint(table.conflicts[p]) for o in names if o != name)]
+            suggestions = session.suggestions(name)
+            if affecting and (rnd.random() < 0.5 or not suggestions):
+                pnode = rnd.choice(affecting)
+            elif suggestions:
+                pnode = suggestions[0]['qnode']
+            else:
+                continue
+
+            start = perf_counter()
+            session.choose(name, pnode)
+            results = {n: session.suggestions(n) for n in names}
+            session_time += perf_counter() - start
+            chosen[name] = pnode
+            picks += 1
+
+            start = perf_counter()
+            expected = {}
+            for n, column in zip(names, columns):
+                other = ','.join(p for o, p in chosen.items() if o != n)
+                params, size, _ = finder._parse_args(dict(column, otherProperties=other, **settings))
+                expected[n] = finder.generate_top_candidates(params, size)
+            search_time += perf_counter() - start
+
+            for n in names:
+                checks += 1
+                # json.dumps: descriptions may be NaN, which never equals itself
+                if json.dumps(results[n]) != json.dumps(expected[n]):
+                    differences += 1
+                    print(f'difference: {settings} {columns[names.index(n)]} chosen={chosen}', file=sys.stderr)
+        refiltered += session.refiltered
+
+    print(json.dumps({'tables': args.tables, 'columns': args.columns, 'picks': picks, 'checks': checks,
+                      'differences': differences, 'refiltered_columns': refiltered,
+                      'session_s': round(session_time, 3), 'search_s': round(search_time, 3)}, indent=2))
+    sys.exit(1 if differences else 0)
+
+
+if __name__ == '__main__':
+    main()
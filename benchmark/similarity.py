@@ -0,0 +1,80 @@
+''' Similarity scoring in PropertyRanker.rank.
+
+    Checks that the 'exact' mode ranks every level of the query corpus exactly
+    as the original per-name SequenceMatcher implementation, and reports the
+    speed of both modes and how close the 'ngram' mode's top-k is.
+    Exits with status 1 if the exact ranking differs.
+
+    python -m benchmark.similarity [--k 10]
+'''
+import argparse, json, sys
+import numpy as np
+from collections import defaultdict
+from difflib import SequenceMatcher
+from time import perf_counter
+
+from api.PropertyFinder2 import PropertyFinder
+from api.ranking import PropertyRanker
+from api.settings import LOCAL_search
+from benchmark.corpus import QUERIES
+
+
+def reference_rank(ranker, pnodes, query, metadata, scope='both'):
+    ''' PropertyRanker.rank as originally implemented
+    '''
+    counts = ranker.gen_counts(pnodes, scope)
+    sim = defaultdict(float)
+    for node in pnodes:
+        try:
+            sim[node] = np.max([SequenceMatcher(None, query, n).ratio() for n in metadata.get_names(node)])
+        except KeyError:
+            sim[node] = 0.0
+
+    ranking = defaultdict(float)
+    for pnode in pnodes:
+        ranking[pnode] = sim[pnode] * np.log(counts[pnode] + 1)
+    return dict(sorted(ranking.items(), key=lambda x: x[1], reverse=True))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+
+    finder = PropertyFinder(host=LOCAL_search)
+    metadata = PropertyFinder.metadata
+    rankers = {'exact': PropertyRanker('exact'), 'ngram': PropertyRanker('ngram')}
+
+    timings = {'reference': 0.0, 'exact': 0.0, 'ngram': 0.0}
+    mismatches = []
+    overlap = []
+    for label, type_ in QUERIES:
+        candidates = finder.get_candidates(label, metadata.get_type_alias(type_))
+        for level, pnodes in candidates.items():
+            start = perf_counter()
+            expected = reference_rank(rankers['exact'], pnodes, label, metadata)
+            timings['reference'] += perf_counter() - start
+
+            results = {}
+            for mode, ranker in rankers.items():
+                start = perf_counter()
+                results[mode] = ranker.rank(pnodes, label, metadata)
+                timings[mode] += perf_counter() - start
+
+            if list(results['exact'].items()) != list(expected.items()):
+                mismatches.append([label, level])
+            top = set(list(expected)[:args.k])
+            if top:
+                overlap.append(len(top & set(list(results['ngram'])[:args.k])) / len(top))
+
+    report = {'exact_matches_reference': not mismatches,
+              'mismatches': mismatches,
+              f'ngram_top{args.k}_overlap': sum(overlap) / len(overlap),
+              'seconds': timings}
+    print(json.dumps(report, indent=2))
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+''' Startup benchmark: cold build time of PropertyFinder and the per-request
+    overhead of obtaining a finder in PropertyFinderResource.
+
+    "before" is the code of the first version, reproduced here: a finder
+    reads the claims file once per relation and filters it with a row-wise
+    apply, loads constraints.json, and the resource builds a new finder for
+    every request. "after" builds a finder over a freshly loaded data
+    generation (the store mapped from data/snapshot.bin, with the relation
+    index and constraint table built from it), and the resource takes the
+    shared finder.
+
+    python -m benchmark.startup [--repeat N]
+'''
+import argparse, json
+from collections import defaultdict
+from time import perf_counter
+
+from api.generation import build_generation
+from api.PropertyFinder2 import PropertyFinder
+from api.PropertyFinderResource import PropertyFinderResource
+from api.settings import FILE_claims_property, JSON_constraints
+
+
+def timeit(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        timings.append(perf_counter() - start)
+    return {'min': min(timings), 'mean': sum(timings) / len(timings)}
+
+
+def legacy_gen_relation(label):
+    ''' PropertyFinder.gen_relation of the first version
+    '''
+    import pandas as pd
+    pr = pd.read_csv(FILE_claims_property, sep='\t', usecols=['node1', 'label', 'node2'])
+    pr = pr[pr['label'].apply(lambda x: x == label)].reset_index(drop=True)
+    pr = pr[['node1', 'node2']]
+
+    pr1 = pr.groupby('node1')['node2'].apply(list).reset_index()
+    pr_dict = pr1.set_index('node1').to_dict()['node2']
+
+    pr_dict_r = defaultdict(list)
+    for k, v in pr_dict.items():
+        for vi in v:
+            pr_dict_r[k].append(vi)
+    return pr_dict_r
+
+
+class LegacyFinder(object):
+    ''' The state PropertyFinder.__init__ of the first version built
+    '''
+
+    def __init__(self, metadata_constraints=JSON_constraints):
+        self.map_P1696 = legacy_gen_relation('P1696')
+        self.map_P1647 = legacy_gen_relation('P1647')
+        self.map_P6609 = legacy_gen_relation('P6609')
+        self.map_P1659 = legacy_gen_relation('P1659')
+        with open(metadata_constraints) as fp:
+            self.constraints = json.load(fp)
+
+
+class LegacyResource(object):
+    ''' PropertyFinderResource of the first version: a finder per request
+    '''
+
+    def __init__(self):
+        self.finder = LegacyFinder()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    PropertyFinder.shared()
+
+    report = {
+        'cold_build_s': {
+            'before': timeit(LegacyFinder, args.repeat),
+            'after': timeit(lambda: PropertyFinder(generation=build_generation()), args.repeat),
+        },
+        'per_request_s': {
+            'before': timeit(LegacyResource, args.repeat),
+            'after': timeit(PropertyFinderResource, args.repeat * 100),
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+''' Stand-in for the Elasticsearch index read by fetch_metadata.py, serving
+    the pagerank and statements of data/metadata.json.
+
+    python -m benchmark.stub_es [--port 9200] [--latency 20] [--fail-rate 0.1]
+    python fetch_metadata.py --es-url http://127.0.0.1:9200 --output /tmp/metadata.json
+'''
+import argparse, json, random
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import sleep
+from urllib.parse import urlparse
+
+from api.settings import FILE_metadata
+
+
+class StubESHandler(BaseHTTPRequestHandler):
+    ''' GET /<index>/_doc/<id> and POST /<index>/_mget {"ids": [...]}
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def _doc(self, index, pnode):
+        doc = {'_index': index, '_id': pnode, 'found': pnode in self.server.documents}
+        if doc['found']:
+            doc['_source'] = self.server.documents[pnode]
+        return doc
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _delay(self):
+        ''' Wait the configured latency, and tell whether to fail the request
+        '''
+        server = self.server
+        server.requests += 1
+        if server.latency > 0:
+            sleep(server.latency / 1000)
+        if random.random() < server.fail_rate:
+            server.failures += 1
+            return True
+        return False
+
+    def do_GET(self):
+        parts = urlparse(self.path).path.strip('/').split('/')
+        if self._delay():
+            return self._reply(503, {'error': 'injected failure'})
+        if len(parts) != 3 or parts[1] != '_doc':
+            return self._reply(404, {'error': 'not found'})
+        doc = self._doc(parts[0], parts[2])
+        self._reply(200 if doc['found'] else 404, doc)
+
+    def do_POST(self):
+        parts = urlparse(self.path).path.strip('/').split('/')
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self._delay():
+            return self._reply(503, {'error': 'injected failure'})
+        if len(parts) != 2 or parts[1] != '_mget':
+            return self._reply(404, {'error': 'not found'})
+        self._reply(200, {'docs': [self._doc(parts[0], pnode) for pnode in body.get('ids', [])]})
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port=9200, latency=20.0, fail_rate=0.0, source=FILE_metadata, background=False):
+    ''' Start the stand-in on 127.0.0.1:port, latency in milliseconds,
+        failing a fail_rate fraction of the requests with a 503
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubESHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.fail_rate = fail_rate
+    server.requests = 0
+    server.failures = 0
+    with open(source) as fd:
+        server.documents = {pnode: {'pagerank': info['pagerank'], 'statements': info['statements']}
+                            for pnode, info in json.load(fd).items()}
+
+    if background:
+        Thread(target=server.serve_forever, name='es-stub', daemon=True).start()
+        return server
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=9200)
+    parser.add_argument('--latency', type=float, default=20.0, help='delay of every response in ms')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of requests answered with a 503')
+    parser.add_argument('--source', default=FILE_metadata, help='metadata.json whose entries are served')
+    args = parser.parse_args()
+
+    print(f'Elasticsearch stand-in on http://127.0.0.1:{args.port}')
+    serve(args.port, args.latency, args.fail_rate, args.source)
+
+
+if __name__ == '__main__':
+    main()
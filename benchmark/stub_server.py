@@ -0,0 +1,114 @@
+''' Stub of the KGTK ngram search API, to benchmark the service offline.
+
+    Terms recorded with python -m benchmark.recall --record are answered from
+    the recording; any other term is answered by the local ngram index over
+    the bundled property names. Every response is delayed by the configured
+    latency, to stand in for the round trip to https://kgtk.isi.edu/api; a
+    fraction of them can be made slow, or fail with a 500.
+
+    python -m benchmark.stub_server [--port 8765] [--latency 50] [--jitter 10]
+                                    [--slow-fraction 0.05 --slow-latency 500] [--fail-fraction 0.01]
+    PROPERTY_FINDER_HOST=http://127.0.0.1:8765/api python app.py
+'''
+import argparse, json, os, random
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import sleep
+from urllib.parse import parse_qs, unquote, urlparse
+
+from api.search_index import load_index
+from benchmark.recall import RECORDED, load_recorded
+
+
+class StubServer(ThreadingHTTPServer):
+    # The default backlog of 5 drops the connections of a burst of new
+    # clients, which then retry after a second
+    request_queue_size = 128
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    ''' GET /api/<term>?size=N&...: a JSON list of {'qnode': ...}
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        term = unquote(url.path.rsplit('/', 1)[-1])
+        size = int(parse_qs(url.query).get('size', ['500'])[0])
+
+        server = self.server
+        delay = server.latency + random.uniform(-server.jitter, server.jitter)
+        if random.random() < server.slow_fraction:
+            delay = server.slow_latency
+        if delay > 0:
+            sleep(delay / 1000)
+        if random.random() < server.fail_fraction:
+            server.failed += 1
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if term in server.recorded:
+            qnodes = server.recorded[term][:size]
+            server.replayed += 1
+        else:
+            qnodes = server.index.search(term, size)
+            server.generated += 1
+
+        body = json.dumps([{'qnode': qnode} for qnode in qnodes]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port=8765, latency=50.0, jitter=0.0, recorded=RECORDED, background=False,
+          slow_fraction=0.0, slow_latency=0.0, fail_fraction=0.0):
+    ''' Start the stub on 127.0.0.1:port, latency and jitter in milliseconds.
+        slow_fraction of the responses take slow_latency ms instead, and
+        fail_fraction of them are 500 errors.
+        With background, the server runs in a daemon thread and is returned;
+        its API is at f'http://127.0.0.1:{server.server_port}/api'
+    '''
+    server = StubServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.jitter = jitter
+    server.slow_fraction = slow_fraction
+    server.slow_latency = slow_latency
+    server.fail_fraction = fail_fraction
+    server.recorded = load_recorded(recorded) if recorded and os.path.exists(recorded) else {}
+    server.index = load_index()
+    server.replayed = 0
+    server.generated = 0
+    server.failed = 0
+
+    if background:
+        Thread(target=server.serve_forever, name='kgtk-stub', daemon=True).start()
+        return server
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=50.0, help='delay of every response in ms')
+    parser.add_argument('--jitter', type=float, default=0.0, help='uniform +/- variation of the delay in ms')
+    parser.add_argument('--slow-fraction', type=float, default=0.0, help='fraction of slow responses')
+    parser.add_argument('--slow-latency', type=float, default=500.0, help='delay of the slow responses in ms')
+    parser.add_argument('--fail-fraction', type=float, default=0.0, help='fraction of 500 responses')
+    parser.add_argument('--recorded', default=RECORDED, help='JSON recording of KGTK-search responses')
+    args = parser.parse_args()
+
+    print(f'KGTK-search stub on http://127.0.0.1:{args.port}/api')
+    serve(args.port, args.latency, args.jitter, args.recorded, slow_fraction=args.slow_fraction,
+          slow_latency=args.slow_latency, fail_fraction=args.fail_fraction)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+''' Build time, memory and latency of the BM25 text index over every property
+    in data/, for batches scored with one product against queries scored one by one.
+
+    python -m benchmark.text_retrieval [--batch 1 64 256 1000] [--repeat 5]
+'''
+import argparse, json, tracemalloc
+from time import perf_counter
+
+from api.records import load_store
+from api.settings import TEXT_size
+from api.text_index import TextIndex
+from benchmark.corpus import QUERIES
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 64, 256, 1000])
+    parser.add_argument('--size', type=int, default=TEXT_size)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    store = load_store()
+    start = perf_counter()
+    index = TextIndex(store)
+    build = perf_counter() - start
+
+    # Peak allocations of a second build (tracing slows it down)
+    tracemalloc.start()
+    TextIndex(store)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    report = {'properties': len(store), 'terms': len(index.vocabulary), 'nonzeros': len(index.props),
+              'build_s': build, 'matrix_bytes': index.nbytes(), 'build_peak_bytes': peak, 'batches': {}}
+
+    labels = [label for label, _ in QUERIES]
+    for batch in args.batch:
+        queries = (labels * (batch // len(labels) + 1))[:batch]
+        batched, single = [], []
+        for _ in range(args.repeat):
+            start = perf_counter()
+            index.search_many(queries, args.size)
+            batched.append(perf_counter() - start)
+
+            start = perf_counter()
+            for query in queries:
+                index.search(query, args.size)
+            single.append(perf_counter() - start)
+        report['batches'][batch] = {'batch_ms': min(batched) * 1e3, 'one_by_one_ms': min(single) * 1e3,
+                                    'per_query_us': min(batched) / batch * 1e6}
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
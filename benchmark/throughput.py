@@ -0,0 +1,45 @@
+''' Throughput of PropertyFinder.generate_top_candidates over the query corpus.
+    Candidates are retrieved from the local ngram index, so the numbers do
+    not depend on the network.
+
+    python -m benchmark.throughput [--rounds N] [--size N] [--no-metrics]
+'''
+import argparse, json
+from time import perf_counter
+
+from api.PropertyFinder2 import PropertyFinder
+from api.metrics import registry
+from api.settings import LOCAL_search
+from benchmark.corpus import QUERIES
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--size', type=int, default=10)
+    parser.add_argument('--no-metrics', action='store_true', help='disable the stage timers and counters')
+    args = parser.parse_args()
+
+    registry.enabled = not args.no_metrics
+
+    finder = PropertyFinder(host=LOCAL_search)
+
+    timings = []
+    for _ in range(args.rounds):
+        for label, type_ in QUERIES:
+            params = finder._build_params(label, type_, extra_info='true')
+            start = perf_counter()
+            finder.generate_top_candidates(params, args.size)
+            timings.append(perf_counter() - start)
+
+    timings.sort()
+    report = {'metrics': registry.enabled,
+              'queries': len(timings),
+              'qps': len(timings) / sum(timings),
+              'p50_ms': timings[len(timings) // 2] * 1000,
+              'p95_ms': timings[int(len(timings) * 0.95)] * 1000}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+''' build-snapshot: compile everything under data/ into the binary snapshot
+    loaded by PropertyMetaData, PropertyRanker and PropertyFinder.
+    Rerun it whenever a file under data/ changes; a stale snapshot is ignored.
+
+    python build_snapshot.py [--output data/snapshot.bin]
+'''
+import argparse, os
+from time import time
+
+from api.settings import FILE_snapshot
+from api.snapshot import write_snapshot
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compile data/ into a memory-mappable snapshot')
+    parser.add_argument('--output', default=FILE_snapshot)
+    args = parser.parse_args()
+
+    start = time()
+    header = write_snapshot(args.output)
+    print(f"Wrote {args.output} (version {header['version']}, {header['size']} properties, "
+          f"{os.path.getsize(args.output) / 2 ** 20:.1f} MB) in {time() - start:.1f}s")
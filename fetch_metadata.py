@@ -1,30 +1,166 @@
-from requests import get
-from collections import defaultdict
-from tqdm import tqdm
+''' fetch-metadata: refresh the pagerank and number of statements of every
+    property from the Elasticsearch index of KGTK-search into data/metadata.json.
+
+    Properties are fetched in batches with _mget, concurrently over a pooled
+    session. Every completed batch is appended to a checkpoint file, so an
+    interrupted run resumes where it stopped when started again. With
+    --incremental, only the properties which are new or were fetched more
+    than --max-age days ago are requested again.
+
+    python fetch_metadata.py [--es-url URL] [--incremental] [--snapshot]
+'''
+import argparse, json, os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import time
+
 import pandas as pd
-import json
+from requests import Session
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+from urllib3.util.retry import Retry
+
+from api.settings import FILE_label, FILE_metadata, FILE_snapshot
 
 es_url = 'http://ckg06.isi.edu:9200'
 es_index = 'wikidataos-07'
 
+
+def make_session(workers, retries):
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504],
+                  allowed_methods=['GET', 'POST'], raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry)
+    session = Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def parse_doc(doc, fetched):
+    ''' metadata.json entry of one _mget document, with the defaults used
+        when a field (or the whole document) is missing
+    '''
+    source = doc.get('_source', {}) if doc.get('found') else {}
+    info = {'pagerank': source.get('pagerank', 0.0), 'statements': source.get('statements', 1),
+            'fetched': fetched}
+    if not 'pagerank' in source:
+        tqdm.write(f"{doc['_id']} no pagerank")
+    if not 'statements' in source:
+        tqdm.write(f"{doc['_id']} no statements")
+    return info
+
+
+def fetch_batch(session, url, pnodes, timeout):
+    ''' Dict[pnode, info] of a batch of properties, in one _mget request
+    '''
+    response = session.post(f'{url}/_mget', params={'_source': 'pagerank,statements'},
+                            json={'ids': pnodes}, timeout=timeout)
+    response.raise_for_status()
+    fetched = int(time())
+    return {doc['_id']: parse_doc(doc, fetched) for doc in response.json()['docs']}
+
+
+def read_checkpoint(path):
+    ''' Entries fetched by an interrupted run: one JSON object per batch
+    '''
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path) as fd:
+        for line in fd:
+            try:
+                done.update(json.loads(line))
+            except ValueError:
+                # Last batch of a run killed while writing it
+                break
+    return done
+
+
+def write_atomic(path, metadata):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as fd:
+        json.dump(metadata, fd, separators=(',', ':'))
+        fd.flush()
+        os.fsync(fd.fileno())
+    os.replace(tmp, path)
+
+
+def stale(info, now, max_age):
+    return info is None or now - info.get('fetched', 0) > max_age
+
+
 if __name__ == '__main__':
 
-    metadata = defaultdict(dict)
+    parser = argparse.ArgumentParser(description='Fetch the pagerank and statements of the properties')
+    parser.add_argument('--es-url', default=es_url)
+    parser.add_argument('--es-index', default=es_index)
+    parser.add_argument('--output', default=FILE_metadata)
+    parser.add_argument('--checkpoint', help=f'progress file, {FILE_metadata}.partial by default')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--incremental', action='store_true',
+                        help='only fetch properties missing from the output or older than --max-age')
+    parser.add_argument('--max-age', type=float, default=30, help='days after which an entry is stale')
+    parser.add_argument('--restart', action='store_true', help='ignore the progress of an interrupted run')
+    parser.add_argument('--snapshot', action='store_true',
+                        help=f'rebuild {FILE_snapshot} afterwards (from {FILE_metadata})')
+    args = parser.parse_args()
+    checkpoint = args.checkpoint or f'{args.output}.partial'
 
-    df = pd.read_csv('data/labels.property.en.tsv.gz', usecols=['node1'],
-                     sep='\t')
-    for pnode in tqdm(df['node1']):
-        res = get(f'{es_url}/{es_index}/_doc/{pnode}').json()
-        try:
-            metadata[pnode]['pagerank'] = res['_source']['pagerank']
-        except:
-            print(pnode, 'no pagerank')
-            metadata[pnode]['pagerank'] = 0.0
+    pnodes = pd.read_csv(FILE_label, usecols=['node1'], sep='\t')['node1'].drop_duplicates().tolist()
+
+    existing = {}
+    if args.incremental and os.path.exists(args.output):
+        with open(args.output) as fd:
+            existing = json.load(fd)
+    if args.restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    done = read_checkpoint(checkpoint)
+
+    now = time()
+    todo = [pnode for pnode in pnodes if not pnode in done and stale(existing.get(pnode), now, args.max_age * 86400)]
+    print(f'{len(pnodes)} properties: {len(done)} from the checkpoint, '
+          f'{len(pnodes) - len(done) - len(todo)} up to date, {len(todo)} to fetch')
+
+    session = make_session(args.workers, args.retries)
+    url = f'{args.es_url}/{args.es_index}'
+    batches = [todo[i:i + args.batch_size] for i in range(0, len(todo), args.batch_size)]
+    failed = []
+    with ThreadPoolExecutor(max_workers=args.workers) as executor, open(checkpoint, 'a') as fd, \
+            tqdm(total=len(todo)) as progress:
+        futures = {executor.submit(fetch_batch, session, url, batch, args.timeout): batch for batch in batches}
         try:
-            metadata[pnode]['statements'] = res['_source']['statements']
-        except:
-            print(pnode, 'no statements')
-            metadata[pnode]['statements'] = 1
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    tqdm.write(f'Batch of {len(batch)} starting at {batch[0]} failed: {e}')
+                    failed += batch
+                else:
+                    fd.write(json.dumps(result) + '\n')
+                    fd.flush()
+                    done.update(result)
+                progress.update(len(batch))
+        except KeyboardInterrupt:
+            # Completed batches are in the checkpoint, drop the pending ones
+            for future in futures:
+                future.cancel()
+            raise
+
+    if failed:
+        print(f'{len(failed)} properties could not be fetched; rerun to resume from {checkpoint}')
+        raise SystemExit(1)
+
+    metadata = {}
+    for pnode in pnodes:
+        metadata[pnode] = done[pnode] if pnode in done else existing[pnode]
+    write_atomic(args.output, metadata)
+    os.remove(checkpoint)
+    print(f'Wrote {len(metadata)} properties to {args.output}')
 
-    with open('data/metadata.json', 'w') as fd:
-        json.dump(metadata, fd, indent=2)
+    if args.snapshot:
+        from api.snapshot import write_snapshot
+        write_snapshot(FILE_snapshot)
+        print(f'Rebuilt {FILE_snapshot}')